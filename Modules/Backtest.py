@@ -0,0 +1,335 @@
+import unittest
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+from Modules.Forecast import forecastBatch, floatArray
+from Modules.PriceStore import INDEX_COLUMN, load_arrays
+from Modules.Trade import SELL, BUY, HOLD, trade_signal, profit_factor, rate_thresholds
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+# Reasons a backtested trade was closed
+EXIT_HORIZON, EXIT_LOSS, EXIT_PROFIT = 0, 1, 2
+EXIT_REASONS = {EXIT_HORIZON: 'horizon', EXIT_LOSS: 'loss', EXIT_PROFIT: 'profit'}
+
+# Number of window elements processed at once, bounds the memory of the rolling computations
+CHUNK_ELEMENTS = 2 ** 22
+
+
+def rolling_forecasts(closes, window, size_forecast, step=1, use_relative_frequency=False, from_value=None, dtype=None):
+    """
+    Forecast from the trailing window of closes at every decision point of a history.
+
+    Args:
+        closes (array-like): Closes of the history.
+        window (int): Number of trailing closes each forecast sees.
+        size_forecast (int): Number of steps of each forecast.
+        step (int, optional): Number of bars between decision points. Defaults to 1.
+        use_relative_frequency (bool, optional): Whether to use relative frequencies in the forecast. Defaults to False.
+        from_value (float, optional): Starting point of every forecast. Defaults to the last close of each window.
+        dtype (np.dtype, optional): Float type of the computation, np.float32 halves its memory (see `forecastBatch`).
+            Defaults to the type of closes for float arrays, and to float64 otherwise.
+
+    Returns:
+        tuple:
+            entries (np.array): Index of the bar of every decision point.
+            forecasts (np.array): Array of shape (decisions, 3) with the lower, expected and upper forecast.
+    """
+    closes = floatArray(closes, dtype)
+    entries = np.arange(window - 1, len(closes) - 1, step)
+
+    # Row i of the view is closes[i:i + window], the window ending at bar i + window - 1
+    windows = sliding_window_view(closes, window)
+    rows = entries - (window - 1)
+
+    forecasts = np.empty((len(entries), 3), dtype=closes.dtype)
+    chunk = max(CHUNK_ELEMENTS // window, 1)
+    for start in range(0, len(rows), chunk):
+        forecasts[start:start + chunk] = forecastBatch(
+            windows[rows[start:start + chunk]], from_values=from_value, size_forecasts=size_forecast,
+            use_relative_frequency=use_relative_frequency
+        )
+
+    return entries, forecasts
+
+
+def simulate_trades(closes, entries, actions, size_forecast, spread=0.0, investment_amount=1000,
+                    loss_threshold=None, profit_threshold=None, borrowing_fee=0):
+    """
+    Close every trade at the first bar crossing its loss or profit rate, or after `size_forecast` bars.
+
+    Args:
+        closes (array-like): Closes of the history.
+        entries (array-like): Index of the bar each trade opens at, the close of that bar is its sell rate.
+        actions (array-like): SELL or BUY for each trade.
+        size_forecast (int): Number of bars a trade is held at most.
+        spread (float, optional): Spread paid on every trade. Defaults to 0.
+        investment_amount (float, optional): Amount invested in every trade. Defaults to 1000.
+        loss_threshold (float, optional): Loss at which a trade is closed. Defaults to None, no loss barrier.
+        profit_threshold (float, optional): Profit at which a trade is closed. Defaults to None, no profit barrier.
+        borrowing_fee (float, optional): Fee on the borrowed amount of a sell. Defaults to 0.
+
+    Returns:
+        tuple:
+            exit_index (np.array): Index of the bar each trade closes at.
+            exit_rate (np.array): Close of that bar.
+            exit_reason (np.array): EXIT_HORIZON, EXIT_LOSS or EXIT_PROFIT. A bar crossing both rates counts as a loss.
+            profit (np.array): Profit of each trade.
+    """
+    closes = floatArray(closes)
+    entries, actions = np.asarray(entries, dtype=np.int64), np.asarray(actions)
+
+    opening_rate = closes[entries]
+    rate_loss, rate_profit = rate_thresholds(
+        opening_rate, spread, investment_amount, loss_threshold, profit_threshold, actions, borrowing_fee
+    )
+    rate_loss, rate_profit = np.broadcast_to(rate_loss, entries.shape), np.broadcast_to(rate_profit, entries.shape)
+
+    # Row t of the view holds the size_forecast closes after bar t, NaN past the end of the history
+    padded = np.concatenate([closes, np.full(size_forecast, np.nan, dtype=closes.dtype)])
+    paths = sliding_window_view(padded[1:], size_forecast)
+
+    exit_index = np.minimum(entries + size_forecast, len(closes) - 1)
+    exit_reason = np.full(len(entries), EXIT_HORIZON)
+
+    chunk = max(CHUNK_ELEMENTS // size_forecast, 1)
+    for start in range(0, len(entries), chunk):
+        part = slice(start, start + chunk)
+        path = paths[entries[part]]
+        is_sell = (actions[part] == SELL)[:, None]
+        loss, profit = rate_loss[part, None], rate_profit[part, None]
+
+        # A sell loses when the rate rises and gains when it falls, a buy the other way round
+        loss_hit = np.where(is_sell, path >= loss, path <= loss)
+        profit_hit = np.where(is_sell, path <= profit, path >= profit)
+        hit = loss_hit | profit_hit
+
+        first = hit.argmax(axis=1)
+        any_hit = hit[np.arange(len(first)), first]
+        exit_index[part] = np.where(any_hit, entries[part] + 1 + first, exit_index[part])
+        exit_reason[part] = np.where(
+            any_hit, np.where(loss_hit[np.arange(len(first)), first], EXIT_LOSS, EXIT_PROFIT), EXIT_HORIZON
+        )
+
+    exit_rate = closes[exit_index]
+    profit = investment_amount * profit_factor(exit_rate, opening_rate, spread, actions, borrowing_fee)
+
+    return exit_index, exit_rate, exit_reason, np.atleast_1d(profit)
+
+
+def non_overlapping(entries, exit_index):
+    """
+    Select the trades that open once the previously selected trade has closed.
+
+    Args:
+        entries (array-like): Index of the bar each trade opens at, in ascending order.
+        exit_index (array-like): Index of the bar each trade closes at.
+
+    Returns:
+        np.array: Positions of the selected trades.
+    """
+    selected, free_from = [], -1
+    for position, (entry, exit) in enumerate(zip(np.asarray(entries).tolist(), np.asarray(exit_index).tolist())):
+        if entry >= free_from:
+            selected.append(position)
+            free_from = exit
+
+    return np.array(selected, dtype=np.int64)
+
+
+def summarise(ledger):
+    """
+    Compute the P&L summary of a trade ledger.
+
+    Args:
+        ledger (dict): Ledger as returned by `backtest`.
+
+    Returns:
+        dict: Trade counts, win rate, total, mean, best and worst profit, maximum drawdown and exit reasons.
+    """
+    profit = ledger['profit']
+    equity = np.cumsum(profit)
+    drawdown = np.maximum.accumulate(np.concatenate([[0.0], equity]))[1:] - equity
+
+    summary = {
+        'trades': int(len(profit)),
+        'buys': int(np.count_nonzero(ledger['action'] == BUY)),
+        'sells': int(np.count_nonzero(ledger['action'] == SELL)),
+        'wins': int(np.count_nonzero(profit > 0)),
+        'win_rate': float(np.mean(profit > 0)) if len(profit) else 0.0,
+        'total_profit': float(equity[-1]) if len(profit) else 0.0,
+        'mean_profit': float(np.mean(profit)) if len(profit) else 0.0,
+        'best_trade': float(np.max(profit)) if len(profit) else 0.0,
+        'worst_trade': float(np.min(profit)) if len(profit) else 0.0,
+        'max_drawdown': float(np.max(drawdown)) if len(profit) else 0.0,
+    }
+    for reason, name in EXIT_REASONS.items():
+        summary[f'{name}_exits'] = int(np.count_nonzero(ledger['exit_reason'] == reason))
+
+    return summary
+
+
+def backtest(closes, window, forecast_factor=1/3, step=1, spread=0.0, investment_amount=1000, loss_threshold=200,
+             profit_threshold=100, borrowing_fee=0, use_relative_frequency=False, overlap=False, timestamps=None, dtype=None):
+    """
+    Replay a history, trading on the forecast of the trailing window at every decision point.
+
+    The forecast size is `int(window * forecast_factor)` as in main_trade.py, and each trade is held
+    until its loss or profit rate is crossed or the forecast size has passed.
+
+    Args:
+        closes (array-like): Closes of the history, used as sell rates.
+        window (int): Number of trailing closes each forecast sees.
+        forecast_factor (float, optional): Forecast size as a fraction of the window. Defaults to 1/3.
+        step (int, optional): Number of bars between decision points. Defaults to 1.
+        spread (float, optional): Spread paid on every trade. Defaults to 0.
+        investment_amount (float, optional): Amount invested in every trade. Defaults to 1000.
+        loss_threshold (float, optional): Loss at which a trade is closed. Defaults to 200.
+        profit_threshold (float, optional): Profit at which a trade is closed. Defaults to 100.
+        borrowing_fee (float, optional): Fee on the borrowed amount of a sell. Defaults to 0.
+        use_relative_frequency (bool, optional): Whether to use relative frequencies in the forecast. Defaults to False.
+        overlap (bool, optional): If False, no trade opens while another one is open. Defaults to False.
+        timestamps (array-like, optional): Timestamps of the bars, added to the ledger if given.
+        dtype (np.dtype, optional): Float type of the closes and forecasts, np.float32 halves their memory.
+            Defaults to the type of closes for float arrays, and to float64 otherwise.
+
+    Returns:
+        tuple:
+            ledger (dict): Arrays of entry_index, action, opening_rate, forecast, exit_index, exit_rate,
+                exit_reason and profit, plus entry_time and exit_time if timestamps are given.
+            summary (dict): The P&L summary of the ledger (see `summarise`).
+    """
+    closes = floatArray(closes, dtype)
+    size_forecast = max(int(window * forecast_factor), 1)
+
+    entries, forecasts = rolling_forecasts(closes, window, size_forecast, step, use_relative_frequency)
+    actions = trade_signal(forecasts[:, 1], closes[entries], spread)
+
+    traded = actions != HOLD
+    entries, forecasts, actions = entries[traded], forecasts[traded], actions[traded]
+
+    exit_index, exit_rate, exit_reason, profit = simulate_trades(
+        closes, entries, actions, size_forecast, spread, investment_amount,
+        loss_threshold, profit_threshold, borrowing_fee
+    )
+
+    ledger = {
+        'entry_index': entries,
+        'action': actions,
+        'opening_rate': closes[entries],
+        'forecast': forecasts[:, 1],
+        'exit_index': exit_index,
+        'exit_rate': exit_rate,
+        'exit_reason': exit_reason,
+        'profit': profit,
+    }
+    if not overlap:
+        selected = non_overlapping(entries, exit_index)
+        ledger = {key: values[selected] for key, values in ledger.items()}
+    if timestamps is not None:
+        timestamps = np.asarray(timestamps)
+        ledger['entry_time'] = timestamps[ledger['entry_index']]
+        ledger['exit_time'] = timestamps[ledger['exit_index']]
+
+    return ledger, summarise(ledger)
+
+
+def _backtest_path(path, config):
+    # Runs in a worker process, the history is memory-mapped rather than sent to it
+    arrays = load_arrays(path)
+    return backtest(arrays['Close'], timestamps=arrays[INDEX_COLUMN], **config)
+
+
+def backtest_pairs(paths, workers=None, **config):
+    """
+    Backtest several stored pair histories in parallel, one process per history.
+
+    Args:
+        paths (list of str): Store directories of the histories (see `PriceStore.store_path`).
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        **config: Arguments of `backtest`, the same for every history.
+
+    Returns:
+        dict: The (ledger, summary) tuple of every path.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_backtest_path, paths, [config] * len(paths))
+        return dict(zip(paths, results))
+
+
+#___Unit Testing____#
+class TestBacktest(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a random walk quantised like forex closes."""
+        steps = np.random.default_rng(3).normal(scale=5e-4, size=3000)
+        self.closes = np.round(1.1 + np.cumsum(steps), 5)
+
+    def test_rolling_forecasts(self):
+        """Test that rolling forecasts match forecastData on the trailing windows."""
+        from Modules.Forecast import forecastData
+
+        entries, forecasts = rolling_forecasts(self.closes, 500, 100, step=250)
+        for entry, forecast in zip(entries, forecasts):
+            expected = forecastData(self.closes[entry - 499:entry + 1].tolist(), size_forecast=100)
+            np.testing.assert_allclose(forecast, expected, rtol=1e-9)
+
+    def test_simulate_trades(self):
+        """Test the vectorized exits against a bar by bar replay."""
+        entries = np.arange(0, 2900, 7)
+        actions = np.where(entries % 2, SELL, BUY)
+        exit_index, _, exit_reason, profit = simulate_trades(
+            self.closes, entries, actions, 200, spread=1e-4, loss_threshold=5, profit_threshold=5
+        )
+
+        for entry, action, indx, reason in zip(entries, actions, exit_index, exit_reason):
+            rate_loss, rate_profit = rate_thresholds(self.closes[entry], 1e-4, 1000, 5, 5, action)
+            expected_indx, expected_reason = min(entry + 200, len(self.closes) - 1), EXIT_HORIZON
+            for bar in range(entry + 1, expected_indx + 1):
+                rate = self.closes[bar]
+                if (rate >= rate_loss) if action == SELL else (rate <= rate_loss):
+                    expected_indx, expected_reason = bar, EXIT_LOSS
+                    break
+                if (rate <= rate_profit) if action == SELL else (rate >= rate_profit):
+                    expected_indx, expected_reason = bar, EXIT_PROFIT
+                    break
+            self.assertEqual((indx, reason), (expected_indx, expected_reason))
+
+    def test_backtest(self):
+        """Test that trades of the ledger do not overlap and the summary adds up."""
+        ledger, summary = backtest(self.closes, 500, step=10, spread=1e-4, loss_threshold=5, profit_threshold=5)
+
+        self.assertTrue(np.all(ledger['entry_index'][1:] >= ledger['exit_index'][:-1]))
+        self.assertEqual(summary['trades'], summary['buys'] + summary['sells'])
+        self.assertAlmostEqual(summary['total_profit'], float(np.sum(ledger['profit'])))
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
+
+    parser = argparse.ArgumentParser(description='Backtest stored pair histories.')
+    parser.add_argument('paths', nargs='+', help='Store directories of the histories')
+    parser.add_argument('--window', type=int, default=5000)
+    parser.add_argument('--forecast-factor', type=float, default=1/3)
+    parser.add_argument('--step', type=int, default=10)
+    parser.add_argument('--spread', type=float, default=0.0)
+    parser.add_argument('--loss-threshold', type=float, default=200)
+    parser.add_argument('--profit-threshold', type=float, default=100)
+    parser.add_argument('--borrowing-fee', type=float, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    results = backtest_pairs(
+        args.paths, workers=args.workers, window=args.window, forecast_factor=args.forecast_factor,
+        step=args.step, spread=args.spread, loss_threshold=args.loss_threshold,
+        profit_threshold=args.profit_threshold, borrowing_fee=args.borrowing_fee
+    )
+    for path, (ledger, summary) in results.items():
+        print(path)
+        for key, val in summary.items():
+            print(f'    {key}: {val}')
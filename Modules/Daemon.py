@@ -0,0 +1,397 @@
+import time
+import asyncio
+import unittest
+import numpy as np
+from Modules.OnlineDistribution import OnlineDistribution
+from Modules.PriceStore import INDEX_COLUMN
+from Modules.RateMatrix import RateMatrix
+from Modules.Instrumentation import stage, count, observe
+from Modules.Trade import ACTIONS, trade_signal
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+TICK DAEMON
+-----------
+Keeps the histories of many pairs warm between decisions. The histories are fetched once, then on
+every tick the daemon
+
+    1. requests the quotes of the rate matrix and the bars newer than each history, concurrently
+    2. appends the new bars to the online distribution of each pair (see `Modules.OnlineDistribution`)
+    3. forecasts every pair from its distribution and passes the forecast to `decide`
+
+so a decision costs a few binary searches instead of a fetch and a rescan of the history.
+
+Every tick waits at most `tick_budget` seconds for the provider. A request still running after
+that is not repeated: the next ticks wait on the same request, and the poll interval doubles (up to
+`max_poll_seconds`) until the provider answers within the budget again. Ticks that run late start
+at once rather than queueing up.
+"""
+
+
+def signal_decision(sell_unit: str, buy_unit: str, forecast: list, data_size: int, size_forecast: int,
+                    quote: tuple, quote_time: float) -> dict:
+    """
+    Trade action of a forecast, the default decision of the daemon.
+
+    :param sell_unit: The base currency code (e.g. 'EUR').
+    :param buy_unit: The quote currency code (e.g. 'GBP').
+    :param forecast: Forecasted lower bound, expected value and upper bound of the closing rate.
+    :param data_size: Number of closes the forecast is based on.
+    :param size_forecast: Number of steps forecast.
+    :param quote: Current sell rate, buy rate and spread of the pair.
+    :param quote_time: Time the quote was received.
+    :return: Dict of the pair, its action and forecast.
+    """
+    return {
+        'rate_given': f'{sell_unit}{buy_unit}',
+        'trade_action': ACTIONS[trade_signal(forecast[1], quote[0], quote[2])],
+        'data_size': data_size,
+        'forecast_size': size_forecast,
+        'forecast_closing_rates': list(forecast),
+        'RATE_OPENING': quote[0],
+    }
+
+
+class PairState:
+    """
+    Online distribution of a pair history and the time of its last bar.
+    """
+
+    def __init__(self, history: dict, window: int = None):
+        """
+        :param history: Bars of the pair, as returned by `MarketDataProvider.history`.
+        :param window: Number of closes kept. Defaults to the length of the history.
+        """
+        closes = np.asarray(history['Close'], dtype=np.float64)
+        if len(closes) < 2:
+            raise ValueError('A pair history needs at least 2 closes.')
+        self.distribution = OnlineDistribution(closes, window=window or len(closes))
+        self.last_time = np.asarray(history[INDEX_COLUMN])[-1]
+
+    def append(self, history: dict) -> int:
+        """
+        Add the bars newer than the last bar to the distribution, correcting the close of the last bar.
+
+        :param history: Bars of the pair, possibly overlapping the bars already added.
+        :return: Number of bars added.
+        """
+        index = np.asarray(history[INDEX_COLUMN])
+        closes = np.asarray(history['Close'], dtype=np.float64)
+
+        # The last bar may have still been forming when it was added
+        last = np.flatnonzero(index == self.last_time)
+        if len(last) and closes[last[-1]] != self.distribution.last_close:
+            self.distribution.replace_last(closes[last[-1]])
+
+        new = index > self.last_time
+        if not new.any():
+            return 0
+        self.distribution.update(closes[new])
+        self.last_time = index[new][-1]
+        return int(np.count_nonzero(new))
+
+
+class TickDaemon:
+    """
+    Re-evaluates the trade decision of every pair on each tick, from warm histories.
+    """
+
+    def __init__(self, provider, pairs: list, matrix: RateMatrix = None, decide=signal_decision,
+                 forecast_factor: float = 1/3, window: int = None, period: str = None, interval: str = None,
+                 poll_seconds: float = 1.0, tick_budget: float = 0.5, max_poll_seconds: float = 60.0,
+                 bars_every: int = 1, replay: bool = False):
+        """
+        :param provider: Provider of the histories and quotes (see `Modules.Providers`).
+        :param pairs: (sell_unit, buy_unit) of every pair.
+        :param matrix: Rate matrix quoted on every tick, it must quote the pairs. Defaults to a matrix of the pairs.
+        :param decide: Function of (sell_unit, buy_unit, forecast, data_size, size_forecast, quote, quote_time)
+            returning the decision of a pair. Defaults to `signal_decision`.
+        :param forecast_factor: Forecast size as a fraction of the closes in the distribution.
+        :param window: Number of closes in each distribution. Defaults to the length of the loaded history.
+        :param period: Period of the histories loaded (e.g. '1mo').
+        :param interval: Interval of the bars (e.g. '2m').
+        :param poll_seconds: Time between the starts of two ticks.
+        :param tick_budget: Longest wait for the provider on a tick, in seconds.
+        :param max_poll_seconds: Longest time between two ticks while the provider is slow.
+        :param bars_every: New bars are requested on every `bars_every` ticks, quotes on every tick.
+        :param replay: If True, the provider is a `ReplayProvider` advanced by one bar on every tick.
+        """
+        self.provider = provider
+        self.pairs = [tuple(pair) for pair in pairs]
+        self.matrix = RateMatrix(self.pairs) if matrix is None else matrix
+        self.decide = decide
+        self.forecast_factor = forecast_factor
+        self.window = window
+        self.period = period
+        self.interval = interval
+        self.base_poll_seconds = poll_seconds
+        self.poll_seconds = poll_seconds
+        self.tick_budget = tick_budget
+        self.max_poll_seconds = max_poll_seconds
+        self.bars_every = bars_every
+        self.replay = replay
+
+        self.states = {}
+        self.quotes = {}
+        self.quote_time = None
+        self.ticks = 0
+        self._pending = None
+        self._stopped = False
+
+    async def load(self) -> dict:
+        """
+        Fetch the history of every pair once.
+
+        :return: The exception of every pair whose history could not be loaded, keyed by pair.
+        """
+        with stage('fetch', size=len(self.pairs)):
+            histories = await self.provider.histories(self.pairs, return_exceptions=True, period=self.period, interval=self.interval)
+
+        errors = {}
+        for pair, history in zip(self.pairs, histories):
+            try:
+                if isinstance(history, Exception):
+                    raise history
+                self.states[pair] = PairState(history, self.window)
+                count('bars_fetched', len(history['Close']))
+            except Exception as error:
+                errors[pair] = error
+        return errors
+
+    async def fetch(self):
+        """Request the quotes of the rate matrix, and the bars newer than every history when they are due."""
+        new_bars = self.ticks % self.bars_every == 0
+        pairs = list(self.states) if new_bars else []
+
+        histories, quotes = await asyncio.gather(
+            asyncio.gather(*(
+                # From the last bar on, as it may have still been forming when it was added
+                self.provider.history(*pair, interval=self.interval, start_date=self.states[pair].last_time)
+                for pair in pairs
+            ), return_exceptions=True),
+            self.provider.quotes(self.matrix.base_pairs, return_exceptions=True),
+        )
+        self.quote_time = time.time()
+        count('quotes', len(self.matrix.base_pairs))
+        self.matrix.update(quotes)
+        self.quotes = dict(zip(self.matrix.base_pairs, quotes))
+
+        for pair, history in zip(pairs, histories):
+            # A failed bar request leaves the history as it was until the next one
+            if not isinstance(history, Exception):
+                count('bars_appended', self.states[pair].append(history))
+
+    async def _fetch_within_budget(self) -> bool:
+        # One request at a time: a request outliving its tick is awaited again by the next ticks
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self.fetch())
+        try:
+            await asyncio.wait_for(asyncio.shield(self._pending), self.tick_budget)
+        except asyncio.TimeoutError:
+            count('fetch_timeouts')
+            self.poll_seconds = min(max(self.poll_seconds, self.tick_budget) * 2, self.max_poll_seconds)
+            return False
+        finally:
+            if self._pending.done():
+                pending, self._pending = self._pending, None
+                pending.result()
+
+        self.poll_seconds = max(self.poll_seconds / 2, self.base_poll_seconds)
+        return True
+
+    def evaluate(self, pair: tuple) -> dict:
+        """
+        Decision of a pair from its distribution and latest quote.
+
+        :param pair: (sell_unit, buy_unit) of the pair.
+        :return: The decision returned by `decide`.
+        """
+        quote = self.quotes.get(pair)
+        if quote is None:
+            raise KeyError(f'No quote for {"".join(pair)}.')
+        if isinstance(quote, Exception):
+            raise quote
+
+        distribution = self.distribution(pair)
+        size_forecast = int(distribution.size * self.forecast_factor)
+        with stage('forecast', size=distribution.size):
+            forecast = distribution.forecast(quote[0], size_forecast)
+        return self.decide(*pair, forecast, distribution.size, size_forecast, quote, self.quote_time)
+
+    def distribution(self, pair: tuple) -> OnlineDistribution:
+        """Online distribution of the closes of a pair."""
+        return self.states[pair].distribution
+
+    async def tick(self) -> dict:
+        """
+        Fetch, update and decide every pair once.
+
+        :return: The decision or error of every pair keyed by pair name, empty when the provider missed the
+            tick budget, or None when a replay has no bars left.
+        """
+        start = time.perf_counter()
+        with stage('tick', size=len(self.states)):
+            # A replay waiting on a late request stays at its bar
+            if self.replay and self._pending is None and self.provider.advance() is None:
+                return None
+
+            try:
+                if not await self._fetch_within_budget():
+                    return {}
+            except Exception as error:
+                count('fetch_errors')
+                return {''.join(pair): {'error': repr(error)} for pair in self.states}
+
+            decisions = {}
+            for pair in self.states:
+                try:
+                    decisions[''.join(pair)] = self.evaluate(pair)
+                except Exception as error:
+                    decisions[''.join(pair)] = {'error': repr(error)}
+
+        self.ticks += 1
+        observe('tick', time.perf_counter() - start)
+        return decisions
+
+    async def run(self, ticks: int = None, on_decisions=None) -> int:
+        """
+        Load the histories and tick until stopped.
+
+        :param ticks: Number of ticks to run. Defaults to None, running until `stop` is called or a replay ends.
+        :param on_decisions: Function called with the decisions of every tick that reached the provider.
+        :return: Number of ticks run.
+        """
+        if not self.states:
+            await self.load()
+
+        done = 0
+        while not self._stopped and (ticks is None or done < ticks):
+            started = time.monotonic()
+            decisions = await self.tick()
+            if decisions is None:
+                break
+            if decisions and on_decisions is not None:
+                on_decisions(decisions)
+            done += 1
+
+            # A tick that ran late is followed at once, missed ticks are not made up
+            await asyncio.sleep(max(self.poll_seconds - (time.monotonic() - started), 0))
+
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        return done
+
+    def stop(self):
+        """Stop the daemon after the current tick."""
+        self._stopped = True
+
+
+#___Unit Testing____#
+class TestTickDaemon(unittest.TestCase):
+
+    def setUp(self):
+        """Set up two stored random walks a minute apart and a replay starting at bar 500."""
+        import os
+        import tempfile
+        from Modules.PriceStore import save_arrays
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        root = directory.name
+        self.index = np.datetime64('2024-10-01T00:00', 'ns') + np.arange(600) * np.timedelta64(1, 'm')
+        self.closes, self.paths = {}, {}
+        for seed, (pair, start) in enumerate(((('EUR', 'GBP'), 0.8), (('USD', 'ZAR'), 17.0))):
+            self.closes[pair] = np.round(start + np.cumsum(np.random.default_rng(seed).normal(scale=2e-4 * start, size=600)), 5)
+            self.paths[pair] = os.path.join(root, '_'.join(pair))
+            save_arrays(self.paths[pair], self.index, {'Close': self.closes[pair]})
+
+    def test_replay(self):
+        """Test that every tick decides from the trailing window, as a cold forecast of the same closes would."""
+        from Modules.Forecast import forecastData
+        from Modules.Providers import ReplayProvider
+
+        provider = ReplayProvider(self.paths, spread=1e-4, now=self.index[499])
+        daemon = TickDaemon(provider, list(self.paths), forecast_factor=0.25, poll_seconds=0, replay=True)
+
+        decisions = []
+        self.assertEqual(asyncio.run(daemon.run(ticks=50, on_decisions=decisions.append)), 50)
+        self.assertEqual(len(decisions), 50)
+
+        for pair, closes in self.closes.items():
+            window = closes[50:550]
+            expected = forecastData(window, closes[549], size_forecast=125)
+            decision = decisions[-1][''.join(pair)]
+            np.testing.assert_allclose(decision['forecast_closing_rates'], expected, rtol=1e-9)
+            self.assertEqual(decision['data_size'], 500)
+            self.assertEqual(decision['trade_action'], ACTIONS[trade_signal(expected[1], closes[549], 1e-4)])
+
+        # The replay ends with the histories
+        self.assertEqual(asyncio.run(daemon.run()), 50)
+
+    def test_new_bars(self):
+        """Test that the bars newer than every history are requested in the interval of the daemon."""
+        from Modules.Providers import ReplayProvider
+
+        class RecordingProvider(ReplayProvider):
+            requests = []
+
+            async def _history(self, from_currency, to_currency, period=None, interval=None, start_date=None, end_date=None):
+                RecordingProvider.requests.append(((from_currency, to_currency), {'interval': interval, 'start_date': start_date}))
+                return await super()._history(from_currency, to_currency, period, interval, start_date, end_date)
+
+        provider = RecordingProvider(self.paths, now=self.index[499])
+        daemon = TickDaemon(provider, list(self.paths), interval='1m', poll_seconds=0, replay=True)
+        asyncio.run(daemon.run(ticks=1))
+
+        requests = RecordingProvider.requests[len(self.paths):]
+        self.assertEqual(len(requests), len(self.paths))
+        for pair, kwargs in requests:
+            self.assertEqual(kwargs['interval'], '1m')
+            self.assertEqual(kwargs['start_date'], self.index[499])
+
+    def test_forming_bar(self):
+        """Test that a bar returned again with a new close replaces the one added while it was forming."""
+        from Modules.Forecast import forecastData
+
+        closes = self.closes[('EUR', 'GBP')]
+        forming = closes[:300].copy()
+        forming[-1] += 5e-4
+        state = PairState({INDEX_COLUMN: self.index[:300], 'Close': forming})
+
+        self.assertEqual(state.append({INDEX_COLUMN: self.index[299:310], 'Close': closes[299:310]}), 10)
+        self.assertEqual(state.last_time, self.index[309])
+        np.testing.assert_allclose(state.distribution.forecast(size_forecast=50), forecastData(closes[10:310], size_forecast=50), rtol=1e-9)
+
+    def test_backpressure(self):
+        """Test that a slow provider gets one request at a time and a longer poll interval."""
+        from Modules.Providers import ReplayProvider
+
+        class SlowProvider(ReplayProvider):
+            in_flight, most_in_flight = 0, 0
+
+            async def quotes(self, pairs, return_exceptions=False):
+                SlowProvider.in_flight += 1
+                SlowProvider.most_in_flight = max(SlowProvider.most_in_flight, SlowProvider.in_flight)
+                try:
+                    await asyncio.sleep(0.05)
+                    return await super().quotes(pairs, return_exceptions)
+                finally:
+                    SlowProvider.in_flight -= 1
+
+        provider = SlowProvider(self.paths, now=self.index[499])
+        daemon = TickDaemon(provider, list(self.paths), poll_seconds=0.001, tick_budget=0.01, max_poll_seconds=0.02, replay=True)
+
+        decisions = []
+        asyncio.run(daemon.run(ticks=20, on_decisions=decisions.append))
+        self.assertEqual(SlowProvider.most_in_flight, 1)
+        self.assertLess(len(decisions), 20)
+        self.assertGreater(len(decisions), 0)
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -1,14 +1,15 @@
+import logging
 import numpy as np
 import unittest
 from collections import Counter
+from Modules.Instrumentation import timed
+from Modules import DistributionCache as distribution_cache
 
 # Toggle to enable unit test execution
-# Toggle to print logs of class functions
 RUN_UNIT_TESTING = False 
-DISPLAY_LOG_binCounts = False
-DISPLAY_LOG_linear = False
-DISPLAY_LOG_deviation = False
-DISPLAY_LOG_distribution = False
+
+# Logs of the class functions, shown with logging.getLogger('Modules.DataModification').setLevel(logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 class DataMod:
     """
@@ -22,11 +23,14 @@ class DataMod:
         
         Args:
             data (list): List of numeric values to initialize the data attribute. Defaults to an empty list.
-            **kwargs: Keyword arguments to configure options like standard deviation and absolute difference.
+            **kwargs: Keyword arguments to configure options like standard deviation and absolute difference,
+                and `cache`, a `DistributionCache` memoizing `distribution`. Defaults to the cache set with
+                `DistributionCache.enable`, if any.
         """
-        self.data = np.array(data)
+        self.data = np.asarray(data)
         self.STANDARD_DEVIATION = kwargs.get('std_dev', True)
         self.ABSOLUTE_DIFFERENCE = kwargs.get('abs_diff', True)
+        self.CACHE = kwargs.get('cache')
 
 
     #TODO fix binData
@@ -34,7 +38,8 @@ class DataMod:
         ...
 
 
-    def binCounts(self, bin_ranges, data, rnd=None):
+    @timed('binCounts', size_arg='data')
+    def binCounts(self, bin_ranges, data, rnd=None, inclusive=True, members='values'):
         """
         Purpose
         ------
@@ -42,52 +47,96 @@ class DataMod:
         Bins data into specified ranges and computes statistics for each bin.
 
         Args:
-            bin_ranges (list of float): The boundaries for the bins. 
+            bin_ranges (list of float): The boundaries for the bins, in ascending order. 
                 The length of this list should be at least 2.
-            data (list): The data to be binned. Expected as a list of floats or ints.
+            data (array-like): The data to be binned. Expected as an array or list of floats or ints.
             rnd (int, optional): If specified, the number of decimal places to round the results. 
                 Defaults to None.
+            inclusive (bool, optional): If True, every bin includes both of its edges, so a value on an 
+                inner edge is counted in both bins sharing it. If False, bins are half-open [start, end) 
+                and only the last bin includes its end. Defaults to True.
+            members (str or None, optional): How bin membership is returned. 'values' for arrays of the 
+                data points in each bin, 'indices' for arrays of their positions in data, 'mask' for a 
+                boolean array of shape (bins, len(data)), or None to skip it. Defaults to 'values'.
 
         Returns:
-            tuple: A tuple containing four lists:
-                - bins_count (list of int): The count of data points in each bin.
-                - absolute_frequency (list of float): The absolute frequency of each bin.
-                - relative_frequency (list of float): The relative frequency of each bin, 
+            tuple: A tuple containing four items:
+                - bins_members (list of arrays, array or None): The data points, indices or mask of each bin, 
+                as selected by `members`.
+                - bins_count (array of int): The count of data points in each bin.
+                - absolute_frequency (array of float): The absolute frequency of each bin.
+                - relative_frequency (array of float): The relative frequency of each bin, 
                 considering only the data points within the overall range of the data.
-                - bins_numbers (list of lists): The actual data points in each bin.
+
+        Description:
+        ------------
+        The bins of every data point are found by binary search over the sorted edges, so the work is 
+        O(n log bins) and no per bin pass over the data is made.
         """
-        
-        # Ensure data is a list of floats or integers
-        data = list(data)
-        
+        data = np.asarray(data)
+        edges = np.asarray(bin_ranges, dtype=np.float64)
+
         # Number of bins is one less than the number of ranges
-        size_bin_ranges = len(bin_ranges) - 1  
+        size_bin_ranges = len(edges) - 1
         size_data = len(data)  # Total number of data points
-        size_data_in_range = sum(1 for d in data if bin_ranges[0] <= d <= bin_ranges[-1])
-
-        # Initialize lists for storing statistics
-        bins_count = [0] * size_bin_ranges
-        absolute_frequency = [0] * size_bin_ranges
-        relative_frequency = [0] * size_bin_ranges
-        bins_numbers = [[] for _ in range(size_bin_ranges)]  # List of lists to store actual numbers
-
-        # Iterate over each bin range to count the data points and store the actual numbers
-        for indx, (range_start, range_end) in enumerate(zip(bin_ranges[:-1], bin_ranges[1:])):
-            # Filter data that falls within the current bin
-            bin_data = [float(d) for d in data if range_start <= d <= range_end]
-            bins_count[indx] = len(bin_data)  # Count the number of data points
-            bins_numbers[indx] = bin_data  # Store the actual data points
-            absolute_frequency[indx] = float(bins_count[indx]) / size_data  # Absolute frequency
-            relative_frequency[indx] = float(bins_count[indx]) / size_data_in_range if size_data_in_range > 0 else 0  # Relative frequency
+
+        # Every data point belongs to the bins first_bin..last_bin (empty when first_bin > last_bin)
+        edges_below = np.searchsorted(edges, data, side='left')
+        edges_at_or_below = np.searchsorted(edges, data, side='right')
+        if inclusive:
+            first_bin = np.maximum(edges_below - 1, 0)
+            last_bin = np.minimum(edges_at_or_below - 1, size_bin_ranges - 1)
+        else:
+            first_bin = edges_at_or_below - 1
+            first_bin[data == edges[-1]] = size_bin_ranges - 1  # The last bin includes its end
+            last_bin = first_bin
+
+        in_range = (data >= edges[0]) & (data <= edges[-1])
+        in_bins = in_range & (first_bin <= last_bin)
+        size_data_in_range = int(np.count_nonzero(in_range))
+
+        # Count every point once per bin it spans: +1 at its first bin, -1 after its last bin
+        spans = np.bincount(first_bin[in_bins], minlength=size_bin_ranges + 1)
+        spans -= np.bincount(last_bin[in_bins] + 1, minlength=size_bin_ranges + 1)
+        bins_count = np.cumsum(spans)[:-1]
+
+        absolute_frequency = bins_count / size_data if size_data > 0 else np.zeros(size_bin_ranges)
+        relative_frequency = bins_count / size_data_in_range if size_data_in_range > 0 else np.zeros(size_bin_ranges)
 
         # If rounding is specified, round the results
         if rnd is not None:
-            absolute_frequency = [round(x, rnd) for x in absolute_frequency]
-            relative_frequency = [round(x, rnd) for x in relative_frequency]
+            absolute_frequency = np.round(absolute_frequency, rnd)
+            relative_frequency = np.round(relative_frequency, rnd)
+
+        if members is None:
+            bins_members = None
+        elif members == 'mask':
+            bins = np.arange(size_bin_ranges)[:, None]
+            bins_members = in_bins & (first_bin <= bins) & (bins <= last_bin)
+        elif members in ('indices', 'values'):
+            # Repeat every point once per bin it spans, then group the points by bin keeping data order
+            points = np.flatnonzero(in_bins)
+            span_size = last_bin[points] - first_bin[points] + 1
+            point_bins = np.repeat(first_bin[points], span_size)
+            if len(point_bins) > len(points):
+                span_start = np.repeat(np.cumsum(span_size) - span_size, span_size)
+                point_bins += np.arange(len(point_bins)) - span_start
+                points = np.repeat(points, span_size)
+            points = points[np.argsort(point_bins, kind='stable')]
+            bins_members = np.split(points, np.cumsum(bins_count)[:-1])
+            if members == 'values':
+                bins_members = [data[indices] for indices in bins_members]
+        else:
+            raise ValueError(f"Unknown members option '{members}'.")
 
-        return bins_numbers, bins_count, absolute_frequency, relative_frequency
+        if logger.isEnabledFor(logging.DEBUG):
+            function_name = self.binCounts.__name__
+            logger.debug(f'LOG OF FUNCTION: {function_name}\nbins: {size_bin_ranges}\nsize data: {size_data}\nsize data in range: {size_data_in_range}\n')
 
+        return bins_members, bins_count, absolute_frequency, relative_frequency
 
+
+    @timed('linearise', size_arg='data_arg')
     def linearise(self, data_arg=None, data_type=float):
         """
         Purpose
@@ -99,7 +148,7 @@ class DataMod:
             data_type (type, optional): Desired data type for the linearized output. Defaults to float.
 
         Returns:
-            list: A linearized sequence of data points with the same size as the input data.
+            np.array: A linearized sequence of data points with the same size as the input data.
         
         Raises:
             ValueError: If no data is provided for linearization.
@@ -114,35 +163,36 @@ class DataMod:
         if data_arg is None:
             raise ValueError('No data provided for linearization.')
 
-        # Convert input data to a NumPy array for better manipulation
-        data = np.array(data_arg)
+        # View the input data as a NumPy array, arrays are not copied
+        data = np.asarray(data_arg)
 
         # Calculate minimum and maximum values of the data
-        min_data, max_data = min(data), max(data)
+        min_data, max_data = np.min(data), np.max(data)
         
         # Calculate the mean absolute difference between consecutive elements
         mean_abs_diff = np.mean(np.abs(np.diff(data)))
 
         # Return original data if no variation (mean_abs_diff is 0)
         if mean_abs_diff == 0:
-            if DISPLAY_LOG_linear:
-                print(f'From {self.linearise.__name__}\nMean of absolute difference is 0, returned original data as linearised data\n')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'From {self.linearise.__name__}\nMean of absolute difference is 0, returned original data as linearised data\n')
             return data
 
         # Generate a linearly spaced array with the same number of points as the input data
         linearised_data = np.linspace(min_data, max_data, num=len(data)).astype(data_type)
 
         # Display log if enabled
-        if DISPLAY_LOG_linear:
+        if logger.isEnabledFor(logging.DEBUG):
             function_name = self.linearise.__name__
             log_1 = f'{"--ARG DATA ATTRIBUTES--".upper()}\ntype: {type(data)}\nshape: {np.shape(data)}\nsize: {len(data)}\n'
             log_2 = f'{"--RETURN ATTRIBUTES--".upper()}\ntype: {type(linearised_data)}\nshape: {np.shape(linearised_data)}\nsize: {len(linearised_data)}'
-            print(f'LOG OF FUNCTION: {function_name}\n{log_1}{log_2}\n')
+            logger.debug(f'LOG OF FUNCTION: {function_name}\n{log_1}{log_2}\n')
 
-        return linearised_data.tolist()
+        return linearised_data
 
 
-    def deviation(self, set_1, set_2, abs_diff=None):
+    @timed('deviation', size_arg='set_2')
+    def deviation(self, set_1, set_2, abs_diff=None, return_elements=True):
         """
         Purpose
         --------
@@ -151,55 +201,66 @@ class DataMod:
         Args:
             set_1 (array-like): First dataset.
             set_2 (array-like): Second dataset to compare with set_1.
-            std_dev (bool, optional): If True, compute standard deviation. Defaults to False.
             abs_diff (bool, optional): If True, return absolute element-wise deviations. Defaults to True.
+            return_elements (bool, optional): If False, the element-wise deviations are not built
+                                              and None is returned in their place. Defaults to True.
 
         Returns:
             tuple: 
-                - central_tendency (array): Elements in set_1 with the smallest deviation to set_2.
+                - central_tendency (float): Element of set_1 at the index of the element of set_2 with the
+                                            smallest mean deviation to set_1.
                 - mean_abs_deviation (float): Mean deviation between the datasets.
-                - element_wise_deviations (list): All element-wise deviations between corresponding elements.
+                - element_wise_deviations (np.array or None): All element-wise deviations between corresponding elements.
+
+        Description:
+        ------------
+        The deviations of every pair of elements are never built to compute the central tendency and mean.
+        With set_1 sorted, the sum of |s - x| over set_1 is x * k - (sum of the k elements below x)
+        + (sum of the other elements) - x * (n - k), found for every x of set_2 by a binary search and
+        prefix sums: O((n + m) log n) time and O(n + m) memory for sets of sizes n and m.
+        Only `return_elements=True` builds the n x m deviations.
         """
-        #TODO remove redacted section
-        # std_dev = self.STANDARD_DEVIATION if std_dev is None else std_dev
         abs_diff = self.ABSOLUTE_DIFFERENCE if abs_diff is None else abs_diff
 
-        set_1, set_2 = np.array(set_1), np.array(set_2)
-        set_1 = set_1.reshape(-1, 1) if len(set_1) > 1 else set_1
+        set_1, set_2 = np.asarray(set_1, dtype=float).ravel(), np.asarray(set_2, dtype=float).ravel()
 
         # set_1 attributes often gives rise bugs and errors
-        if DISPLAY_LOG_deviation:
+        if logger.isEnabledFor(logging.DEBUG):
             function_name = self.deviation.__name__
             log_1 = f'{"--ARG SET_1 ATTRIBUTES--".upper()}\ntype: {type(set_1)}\nshape: {np.shape(set_1)}\nsize: {len(set_1)}'
-            print(f'LOG OF FUNCTION: {function_name}\n{log_1}\n')
+            logger.debug(f'LOG OF FUNCTION: {function_name}\n{log_1}\n')
 
-        # Compute deviations: absolute or normal
+        # Shifting both sets leaves the deviations unchanged and keeps the prefix sums small
+        shift = np.mean(set_1)
+        shifted_1, shifted_2 = set_1 - shift, set_2 - shift
+
+        # Sum of the deviations of every element of set_2 to all of set_1: absolute or normal
         if abs_diff:
-            element_wise_deviations = np.abs(set_1 - set_2)
+            sorted_1 = np.sort(shifted_1)
+            prefix = np.concatenate(([0.0], np.cumsum(sorted_1)))
+            below = np.searchsorted(sorted_1, shifted_2, side='left')
+            element_sums = shifted_2 * below - prefix[below] + (prefix[-1] - prefix[below]) - shifted_2 * (len(sorted_1) - below)
         else:
-            element_wise_deviations = set_1 - set_2
-
-        #TODO remove redacted section
-        # Compute mean or standard deviation of deviations
-        # if std_dev:
-        #     squared_element_wise_deviations = element_wise_deviations ** 2
-        #     mean_abs_deviation = np.sqrt(np.mean(squared_element_wise_deviations))
-        # else:
+            element_sums = np.sum(shifted_1) - len(shifted_1) * shifted_2
 
-        mean_abs_deviation = np.mean(element_wise_deviations)
+        mean_element_deviations = element_sums / len(set_1)
+        mean_abs_deviation = np.mean(mean_element_deviations)
 
         # Find the element with the minimum deviation from the central tendency
         if len(set_1) > 1:
-            mean_element_deviations = list(np.mean(element_wise_deviations, axis=0))  
-            index_min_deviation = np.where(mean_element_deviations == min(mean_element_deviations))
-            central_tendency = set_1[index_min_deviation]
+            central_tendency = set_1[np.argmin(mean_element_deviations)]
         else:
             central_tendency = set_1[0]
 
+        element_wise_deviations = None
+        if return_elements:
+            differences = (set_1.reshape(-1, 1) if len(set_1) > 1 else set_1) - set_2
+            element_wise_deviations = np.abs(differences) if abs_diff else differences
 
-        return float(central_tendency), float(mean_abs_deviation), element_wise_deviations.tolist()
+        return float(central_tendency), float(mean_abs_deviation), element_wise_deviations
 
 
+    @timed('distribution', size_arg='data_arg')
     def distribution(self, data_arg, tend_func=None, linear=True, std_dev=None, abs_diff=None):
         """
         Purpose
@@ -224,13 +285,27 @@ class DataMod:
                                     (central tendency ± mean deviation).
                 absolute_probabilities (list): Absolute probabilities calculated for each bin in the distribution.
                 relative_probabilities (list): Relative probabilities calculated for each bin in the distribution.
+
+        Description:
+        ------------
+        With a cache (see `DistributionCache`), results are keyed by the content of the data and the
+        options, and a repeated window is returned without computing it again. Calls with a custom
+        `tend_func` are not cached, as a function has no content key. Arrays of cached results are read-only.
         """
 
+        cache = None if tend_func is not None else (self.CACHE if self.CACHE is not None else distribution_cache.CACHE)
         tend_func = self.deviation if tend_func is None else tend_func
         std_dev = self.STANDARD_DEVIATION if std_dev is None else std_dev
         abs_diff = self.ABSOLUTE_DIFFERENCE if abs_diff is None else abs_diff
 
-        data = self.data if data_arg is None else np.array(data_arg)
+        data = self.data if data_arg is None else np.asarray(data_arg)
+
+        if cache is not None:
+            key = distribution_cache.fingerprint(data, 'distribution', bool(linear), bool(std_dev), bool(abs_diff))
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
         data_1 = self.linearise(data) if linear else data
        
         if std_dev: 
@@ -241,15 +316,18 @@ class DataMod:
             central_tendency = tend_func(data)
         else:
             # The central tendency will be computed using the element with the lowest tendcy to data
-            central_tendency = self.deviation(data_1, data, abs_diff=abs_diff)[0][0]
+            central_tendency = self.deviation(data_1, data, abs_diff=abs_diff, return_elements=False)[0]
 
         central_tendency = float(central_tendency) 
-        mean_abs_deviation = float(np.std(data) if std_dev else self.deviation([central_tendency], data, std_dev=std_dev)[1])
+        mean_abs_deviation = float(np.std(data) if std_dev else self.deviation([central_tendency], data, abs_diff=abs_diff, return_elements=False)[1])
 
         distribution = sorted([central_tendency - mean_abs_deviation, central_tendency, central_tendency + mean_abs_deviation])
 
         distr_values,  distr_counts,  absolute_probabilities, relative_probabilities = self.binCounts(distribution, data)
 
+        if cache is not None:
+            return cache.put(key, (distr_values, mean_abs_deviation, distribution, absolute_probabilities, relative_probabilities))
+
         return distr_values, mean_abs_deviation, distribution, absolute_probabilities, relative_probabilities
 
 
@@ -267,7 +345,7 @@ class DataMod:
         Returns:
             float: Expected value of the events.
         """
-        expected_value = quantity_events * np.sum(np.array(possible_events) * np.array(probabilities))
+        expected_value = quantity_events * np.sum(np.asarray(possible_events) * np.asarray(probabilities))
         return float(expected_value)
 
 
@@ -281,10 +359,59 @@ class TestDataMod(unittest.TestCase):
     def test_binCounts(self):
         """Test the binCounts method."""
         args = [1, 2, 3, 4], [1, 1, 2, 2, 3, 3, 4, 4]
-        result = self.data_mod.binCounts(*args)
-        expected_result = ([2]*4, [0.5]*4, [3]*4, [4]*4) 
-
-        self.assertEqual(result, expected_result)
+        bins_values, bins_count, absolute_frequency, relative_frequency = self.data_mod.binCounts(*args)
+
+        self.assertEqual([values.tolist() for values in bins_values], [[1, 1, 2, 2], [2, 2, 3, 3], [3, 3, 4, 4]])
+        self.assertEqual(bins_count.tolist(), [4]*3)
+        self.assertEqual(absolute_frequency.tolist(), [0.5]*3)
+        self.assertEqual(relative_frequency.tolist(), [0.5]*3)
+
+    def test_binCounts_half_open(self):
+        """Test the binCounts method with half-open bins and index membership."""
+        args = [1, 2, 3, 4], [0, 1, 1, 2, 2, 3, 3, 4, 4, 5]
+        bins_indices, bins_count, absolute_frequency, relative_frequency = self.data_mod.binCounts(*args, inclusive=False, members='indices')
+
+        self.assertEqual([indices.tolist() for indices in bins_indices], [[1, 2], [3, 4], [5, 6, 7, 8]])
+        self.assertEqual(bins_count.tolist(), [2, 2, 4])
+        self.assertEqual(absolute_frequency.tolist(), [0.2, 0.2, 0.4])
+        self.assertEqual(relative_frequency.tolist(), [0.25, 0.25, 0.5])
+
+    def test_binCounts_many_bins(self):
+        """Test the binCounts method against a per bin scan over many bins."""
+        data = np.random.default_rng(0).normal(size=10_000).round(2)
+        bin_ranges = np.linspace(-3, 3, 101)
+        bins_mask, bins_count, _, _ = self.data_mod.binCounts(bin_ranges, data, members='mask')
+
+        expected_count = [np.count_nonzero((start <= data) & (data <= end)) for start, end in zip(bin_ranges[:-1], bin_ranges[1:])]
+        self.assertEqual(bins_count.tolist(), expected_count)
+        self.assertEqual(bins_mask.sum(axis=1).tolist(), expected_count)
+
+    def test_deviation(self):
+        """Test the deviation method against the deviations of every pair of elements."""
+        data = np.random.default_rng(1).normal(size=500).cumsum()
+        linear = self.data_mod.linearise(data)
+
+        for abs_diff in (True, False):
+            deviations = np.array(linear).reshape(-1, 1) - data
+            deviations = np.abs(deviations) if abs_diff else deviations
+            expected_central_tendency = linear[np.argmin(np.mean(deviations, axis=0))]
+
+            central_tendency, mean_abs_deviation, element_wise_deviations = self.data_mod.deviation(linear, data, abs_diff=abs_diff)
+            self.assertEqual(central_tendency, expected_central_tendency)
+            self.assertAlmostEqual(mean_abs_deviation, np.mean(deviations))
+            np.testing.assert_array_equal(element_wise_deviations, deviations)
+
+        self.assertIsNone(self.data_mod.deviation(linear, data, return_elements=False)[2])
+
+    def test_distribution_deviation(self):
+        """Test the distribution method with the deviation as central tendency."""
+        data = [1, 2, 3, 4, 5, 3, 4, 2, 1, 2, 3, 4, 3, 2, 1]
+        _, mean_abs_deviation, distribution, _, _ = self.data_mod.distribution(data, std_dev=False)
+
+        # data[2] = 3 is closest to the linearised data, the central tendency is the linearised value at index 2
+        central_tendency = self.data_mod.linearise(data)[2]
+        self.assertAlmostEqual(distribution[1], central_tendency)
+        self.assertAlmostEqual(mean_abs_deviation, np.mean(np.abs(np.array(data) - central_tendency)))
 
 
 # Main Execution: Unit test and function calls
@@ -0,0 +1,266 @@
+import os
+import pickle
+import hashlib
+import threading
+import unittest
+import numpy as np
+from collections import OrderedDict
+from Modules.Instrumentation import count
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+DISTRIBUTION CACHE
+------------------
+Memoizes `DataMod.distribution` by the content of its input. The key of a call is a blake2b digest
+of the dtype, shape and bytes of the data and of the options, so equal windows of different runs,
+pairs or arrays share an entry while any changed value or option misses.
+
+    memory tier    the `max_entries` most recently used results, in this process
+    disk tier      one pickle per result under `directory`, shared by processes and runs; the least
+                   recently used files are removed once they take more than `max_disk_bytes`
+
+Caching is off until `enable()` is called, or a cache is passed to DataMod (`DataMod(cache=...)`).
+Cached arrays are read-only, as every caller shares them.
+"""
+
+CACHE = None                    # Cache used by DataMod when none is passed to it
+
+MAX_ENTRIES = 256
+MAX_DISK_BYTES = 256 * 2**20
+FILE_SUFFIX = '.pkl'
+
+
+def fingerprint(data, *options) -> str:
+    """
+    Content key of an array and options.
+
+    :param data: Array-like input.
+    :param options: Hashable options changing the result, e.g. flags or function names.
+    :return: Hex digest of the dtype, shape and bytes of data and the repr of the options.
+    """
+    data = np.ascontiguousarray(data)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{data.dtype.str}{data.shape}{options!r}'.encode())
+    digest.update(memoryview(data).cast('B'))
+    return digest.hexdigest()
+
+
+def _read_only(value):
+    # Arrays of a cached result are shared by every hit
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _read_only(item)
+    return value
+
+
+def _copy_containers(value):
+    # Fresh lists and tuples around the shared arrays, so callers can modify them
+    if isinstance(value, list):
+        return [_copy_containers(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_copy_containers(item) for item in value)
+    return value
+
+
+class DistributionCache:
+    """
+    Two-tier cache of results keyed by `fingerprint`.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, directory: str = None, max_disk_bytes: int = MAX_DISK_BYTES):
+        """
+        :param max_entries: Number of results kept in memory.
+        :param directory: Directory of the disk tier. Defaults to None, no disk tier.
+        :param max_disk_bytes: Size of the disk tier before the least recently used files are removed.
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _count(self, name: str):
+        self.counters[name] += 1
+        count(f'distribution_cache_{name}')
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.directory, key + FILE_SUFFIX)
+
+    def get(self, key: str, default=None):
+        """
+        Result of a key, from memory or else from disk.
+
+        :param key: Key of the result (see `fingerprint`).
+        :param default: Returned on a miss.
+        :return: The cached result, or default.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._count('hits')
+                return _copy_containers(self._memory[key])
+
+        if self.directory:
+            try:
+                with open(self._file(key), 'rb') as file:
+                    value = _read_only(pickle.load(file))
+                # Touching the file marks it as recently used for the eviction
+                os.utime(self._file(key))
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            else:
+                self._remember(key, value)
+                with self._lock:
+                    self._count('disk_hits')
+                return _copy_containers(value)
+
+        with self._lock:
+            self._count('misses')
+        return default
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._count('evictions')
+
+    def put(self, key: str, value):
+        """
+        Cache the result of a key in memory and on disk.
+
+        :param key: Key of the result (see `fingerprint`).
+        :param value: Result to cache, its arrays become read-only.
+        :return: The cached result.
+        """
+        value = _read_only(value)
+        self._remember(key, value)
+
+        if self.directory:
+            # Written under a temporary name and renamed, so readers never see a partial file
+            temporary = f'{self._file(key)}.{os.getpid()}.{threading.get_ident()}'
+            with open(temporary, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self._file(key))
+            self._evict_disk()
+
+        return _copy_containers(value)
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(FILE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self._count('disk_evictions')
+
+    def clear(self):
+        """Drop every result, in memory and on disk."""
+        with self._lock:
+            self._memory.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(FILE_SUFFIX):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self) -> dict:
+        """Counters of the cache, with the number of results in memory."""
+        with self._lock:
+            return {**self.counters, 'entries': len(self._memory)}
+
+
+def enable(max_entries: int = MAX_ENTRIES, directory: str = None, max_disk_bytes: int = MAX_DISK_BYTES) -> DistributionCache:
+    """Set the cache used by DataMod when none is passed to it."""
+    global CACHE
+    CACHE = DistributionCache(max_entries, directory, max_disk_bytes)
+    return CACHE
+
+
+def disable():
+    """Stop caching in DataMod instances without their own cache."""
+    global CACHE
+    CACHE = None
+
+
+#___Unit Testing____#
+class TestDistributionCache(unittest.TestCase):
+
+    def setUp(self):
+        """Set up the differences of a random walk and a disk tier."""
+        import tempfile
+
+        self.diff = np.diff(np.round(1.1 + np.cumsum(np.random.default_rng(7).normal(scale=2e-4, size=5000)), 5))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_distribution(self):
+        """Test that cached distributions equal computed ones and options change the key."""
+        from Modules.DataModification import DataMod
+
+        cache = DistributionCache(max_entries=2)
+        data_mod = DataMod(cache=cache)
+        expected = DataMod().distribution(self.diff)
+
+        for _ in range(3):
+            result = data_mod.distribution(self.diff.copy())
+            for value, expected_value in zip(result[1:], expected[1:]):
+                np.testing.assert_array_equal(value, expected_value)
+            for values, expected_values in zip(result[0], expected[0]):
+                np.testing.assert_array_equal(values, expected_values)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+        data_mod.distribution(self.diff, std_dev=False)
+        data_mod.distribution(self.diff.astype(np.float32))
+        self.assertEqual(cache.stats()['misses'], 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        with self.assertRaises(ValueError):
+            result[3][0] = 0
+
+    def test_disk(self):
+        """Test that a new cache on the same directory hits and the disk tier stays under its size."""
+        from Modules.DataModification import DataMod
+
+        DataMod(cache=DistributionCache(directory=self.directory)).distribution(self.diff)
+
+        cache = DistributionCache(directory=self.directory)
+        DataMod(cache=cache).distribution(self.diff)
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+
+        size = os.path.getsize(os.path.join(self.directory, os.listdir(self.directory)[0]))
+        cache = DistributionCache(directory=self.directory, max_disk_bytes=int(2.5 * size))
+        for shift in range(4):
+            cache.put(fingerprint(self.diff, shift), DataMod().distribution(self.diff + shift))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual(cache.stats()['disk_evictions'], 3)
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -0,0 +1,226 @@
+import unittest
+import numpy as np
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+FIRST PASSAGE OF THE THRESHOLDS
+-------------------------------
+How often, and how soon, the loss and profit thresholds of a trade would have been reached in the
+stored history. Every bar t starts a window of the next `horizon` bars, and the thresholds are
+moved to its close: a threshold at rate r for a trade opened at rate o is crossed in the window
+where the close first reaches close[t] * r / o. Each window ends with
+
+    loss        the loss threshold is reached first
+    profit      the profit threshold is reached first
+    neither     no threshold is reached within the horizon
+
+The first bar a window reaches a level is found by binary search over range maxima of the log
+closes, a sparse table: level k holds the max of every window of 2^k bars, built from two shifted
+views of level k - 1. The search over all windows costs O(n log horizon) time for n bars instead
+of the O(n horizon) of scanning every window. Window starts are searched in chunks of at least
+`horizon`, so the tables take O((chunk + horizon) log horizon) memory whatever the length of the
+history.
+"""
+
+OUTCOMES = ('loss', 'profit', 'neither')
+NO_PASSAGE = -1
+TIME_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+CHUNK_SIZE = 2**16
+
+
+def range_max_levels(values: np.ndarray, horizon: int) -> list:
+    """
+    Maxima of the windows of 1, 2, 4 ... bars of a series.
+
+    :param values: Series of length n.
+    :param horizon: Longest window searched.
+    :return: List where level k holds the max of values[i:i + 2**k] at i, for every full window.
+    """
+    levels = [np.asarray(values, dtype=np.float64)]
+    width = 1
+    while 2 * width <= horizon:
+        below = levels[-1]
+        levels.append(np.maximum(below[:-width], below[width:]))
+        width *= 2
+    return levels
+
+
+def passage_times(log_closes: np.ndarray, distance: float, horizon: int, levels: list = None) -> np.ndarray:
+    """
+    Bars until every window first moves `distance` away from its start, in log rate.
+
+    :param log_closes: Log closes of the history.
+    :param distance: Log ratio of the level to the start of the window. Positive for a level above it,
+        negative for one below.
+    :param horizon: Bars of every window.
+    :param levels: `range_max_levels` of the log closes, or of their negation for a negative distance,
+        to share between calls.
+    :return: Array with one entry per window start 0 .. n - horizon - 1: the bars to the first close
+        at or beyond the level (1 .. horizon), or NO_PASSAGE.
+    """
+    values = np.asarray(log_closes, dtype=np.float64)
+    if distance < 0:
+        values, distance = -values, -distance
+    levels = range_max_levels(values, horizon) if levels is None else levels
+
+    starts = np.arange(len(values) - horizon)
+    target = values[starts] + distance
+
+    # Descending powers of two: skip every block of bars whose max stays below the target
+    position, remaining = starts + 1, np.full(len(starts), horizon)
+    for power in range(len(levels) - 1, -1, -1):
+        width = 1 << power
+        fits = remaining >= width
+        skip = np.zeros(len(starts), dtype=bool)
+        skip[fits] = levels[power][position[fits]] < target[fits]
+        position += width * skip
+        remaining -= width * skip
+
+    # The bar after the skipped ones is the first at or beyond the target, if it is in the window
+    hit = remaining > 0
+    times = np.where(hit, position - starts, NO_PASSAGE)
+    hit[hit] = values[position[hit]] >= target[hit]
+    return np.where(hit, times, NO_PASSAGE)
+
+
+def passage_outcomes(closes, loss_ratio: float, profit_ratio: float, horizon: int, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """
+    Which threshold every window reaches first, and when.
+
+    :param closes: Closes of the history.
+    :param loss_ratio: Loss threshold rate over the opening rate, NaN for no loss threshold.
+    :param profit_ratio: Profit threshold rate over the opening rate, NaN for no profit threshold.
+    :param horizon: Bars of every window, the forecast size.
+    :param chunk_size: Window starts searched at once, raised to the horizon if it is shorter.
+    :return: Tuple of (outcome of every window as an index of OUTCOMES, bars to the loss threshold,
+        bars to the profit threshold), the times NO_PASSAGE where a threshold is not reached.
+    """
+    log_closes = np.log(np.asarray(closes, dtype=np.float64))
+    windows = max(len(log_closes) - horizon, 0)
+
+    distances = [
+        None if ratio is None or np.isnan(ratio) or ratio <= 0 else float(np.log(ratio))
+        for ratio in (loss_ratio, profit_ratio)
+    ]
+    loss_times, profit_times = np.full(windows, NO_PASSAGE), np.full(windows, NO_PASSAGE)
+
+    # A chunk of starts needs the tables of its bars and the horizon after them. One table per side
+    # serves both thresholds on it, and only one table is held at a time.
+    step = max(chunk_size, horizon)
+    for start in range(0, windows, step):
+        segment = log_closes[start:min(start + step, windows) + horizon]
+        for side in (True, False):
+            on_side = [indx for indx, distance in enumerate(distances) if distance is not None and (distance >= 0) == side]
+            if not on_side:
+                continue
+            levels = range_max_levels(segment if side else -segment, horizon)
+            for indx in on_side:
+                times = (loss_times, profit_times)[indx]
+                times[start:start + len(segment) - horizon] = passage_times(segment, distances[indx], horizon, levels)
+            del levels
+
+    never = np.iinfo(np.int64).max
+    loss_first = np.where(loss_times == NO_PASSAGE, never, loss_times)
+    profit_first = np.where(profit_times == NO_PASSAGE, never, profit_times)
+
+    # A bar reaching both counts as a loss
+    outcomes = np.where(
+        (loss_first == never) & (profit_first == never), OUTCOMES.index('neither'),
+        np.where(loss_first <= profit_first, OUTCOMES.index('loss'), OUTCOMES.index('profit'))
+    )
+    return outcomes, loss_times, profit_times
+
+
+def threshold_analysis(closes, opening_rate: float, rate_loss_threshold: float, rate_profit_threshold: float,
+                       horizon: int, quantiles=TIME_QUANTILES) -> dict:
+    """
+    Hit probabilities and time to hit of the thresholds of a trade, over the history of its pair.
+
+    :param closes: Closes of the history.
+    :param opening_rate: Sell rate the trade opens at.
+    :param rate_loss_threshold: Rate at which the trade loses its loss threshold, None or NaN for none.
+    :param rate_profit_threshold: Rate at which the trade gains its profit threshold, None or NaN for none.
+    :param horizon: Bars the trade is held, the forecast size.
+    :param quantiles: Quantiles of the time to hit reported.
+    :return: Dict of the number of windows, the probability of every outcome, the probability each threshold
+        is reached at all within the horizon, and the mean and quantiles of the bars to each threshold
+        in the windows it is reached first.
+    """
+    ratio = lambda rate: np.nan if rate is None or rate is False else float(rate) / opening_rate
+    outcomes, loss_times, profit_times = passage_outcomes(closes, ratio(rate_loss_threshold), ratio(rate_profit_threshold), horizon)
+
+    windows = len(outcomes)
+    analysis = {'windows': windows, 'horizon': horizon}
+    if windows == 0:
+        return analysis
+
+    counts = np.bincount(outcomes, minlength=len(OUTCOMES))
+    analysis.update({f'probability_{outcome}_first' if outcome != 'neither' else 'probability_neither': float(count / windows)
+                     for outcome, count in zip(OUTCOMES, counts)})
+
+    for outcome, times in (('loss', loss_times), ('profit', profit_times)):
+        analysis[f'probability_{outcome}_hit'] = float(np.count_nonzero(times != NO_PASSAGE) / windows)
+        first = times[outcomes == OUTCOMES.index(outcome)]
+        analysis[f'time_to_{outcome}'] = {
+            'mean': float(first.mean()) if len(first) else None,
+            'quantiles': {str(quantile): float(value) for quantile, value in zip(quantiles, np.quantile(first, quantiles))} if len(first) else None,
+        }
+
+    return analysis
+
+
+#___Unit Testing____#
+class TestFirstPassage(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a random walk of closes."""
+        rng = np.random.default_rng(9)
+        self.closes = 1.1 * np.exp(np.cumsum(rng.normal(0, 5e-4, 4000)))
+
+    def scan(self, distance, horizon):
+        """Passage times by scanning every window, as strided views of the closes."""
+        from numpy.lib.stride_tricks import sliding_window_view
+
+        log_closes = np.log(self.closes)
+        windows = sliding_window_view(log_closes[1:], horizon)[:len(log_closes) - horizon]
+        moves = windows - log_closes[:len(windows), None]
+        reached = moves >= distance if distance >= 0 else moves <= distance
+        return np.where(reached.any(axis=1), reached.argmax(axis=1) + 1, NO_PASSAGE)
+
+    def test_passage_times(self):
+        """Test that the search matches a scan of every window, for levels above and below and odd horizons."""
+        log_closes = np.log(self.closes)
+        for distance in (0.004, -0.003, 0.0, 0.5):
+            for horizon in (1, 7, 64, 333):
+                np.testing.assert_array_equal(passage_times(log_closes, distance, horizon), self.scan(distance, horizon))
+
+    def test_chunks(self):
+        """Test that searching the window starts in chunks gives the times of one search."""
+        whole = passage_outcomes(self.closes, 1.003, 0.996, 200, chunk_size=len(self.closes))
+        for chunk_size in (1, 333, 1000):
+            for expected, times in zip(whole, passage_outcomes(self.closes, 1.003, 0.996, 200, chunk_size=chunk_size)):
+                np.testing.assert_array_equal(times, expected)
+
+    def test_analysis(self):
+        """Test that the outcome probabilities add up and match the first of the scanned passage times."""
+        horizon, opening = 200, 1.1
+        analysis = threshold_analysis(self.closes, opening, opening * 1.003, opening * 0.996, horizon)
+        self.assertEqual(analysis['windows'], len(self.closes) - horizon)
+        self.assertAlmostEqual(analysis['probability_loss_first'] + analysis['probability_profit_first'] + analysis['probability_neither'], 1)
+
+        loss, profit = self.scan(np.log(1.003), horizon), self.scan(np.log(0.996), horizon)
+        never = horizon + 1
+        loss, profit = np.where(loss < 0, never, loss), np.where(profit < 0, never, profit)
+        self.assertAlmostEqual(analysis['probability_loss_first'], np.mean((loss <= profit) & (loss < never)))
+        self.assertAlmostEqual(analysis['probability_profit_hit'], np.mean(profit < never))
+
+        # Without a profit threshold every window ends as a loss or neither
+        analysis = threshold_analysis(self.closes, opening, opening * 1.003, None, horizon)
+        self.assertEqual(analysis['probability_profit_first'], 0)
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -1,12 +1,41 @@
 import numpy as np
+import unittest
+from concurrent.futures import ProcessPoolExecutor
 from Modules.DataModification import DataMod
+from Modules.PriceStore import period_length
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+# Monte Carlo: paths simulated from one seed, and number of sampled differences held in memory at once
+PATHS_PER_BLOCK = 2 ** 12
+CHUNK_ELEMENTS = 2 ** 22
+
+def floatArray(data, dtype=None):
+    """
+    View data as a float array, copying only when its type changes.
+
+    Args:
+        data (array-like): Values to view.
+        dtype (np.dtype, optional): Float type of the array. Defaults to the type of data for float arrays
+            (e.g. float32 histories stay float32), and to float64 otherwise.
+
+    Returns:
+        np.array: The values as a float array.
+    """
+    data = np.asarray(data)
+    if dtype is None:
+        dtype = data.dtype if data.dtype.kind == 'f' else np.float64
+    return data.astype(dtype, copy=False)
+
 
 def forecastData(data, from_value=None, size_forecast=None, use_relative_frequency=False, **kwargs):
     """
     Forecast data based on the given input series.
 
     Args:
-        data (list or np.array): Time series data for which forecast is generated.
+        data (list or np.array): Time series data for which forecast is generated. Float arrays are used
+            without a copy, in their own precision.
         from_value (float, optional): Starting point for forecast. Defaults to the last value in data.
         size_forecast (int, optional): Number of steps to forecast. Defaults to the length of the data.
         use_relative_frequency (bool, optional): Whether to use relative frequencies in the forecast. Defaults to True.
@@ -15,11 +44,45 @@ def forecastData(data, from_value=None, size_forecast=None, use_relative_frequen
     Returns:
         list: A list containing the forecasted lower bound, expected value, and upper bound.
     """
+    data = floatArray(data)
+    size_forecast = len(data) if size_forecast is None else size_forecast
+
+    return forecastHorizons(data, from_value, [size_forecast], use_relative_frequency, **kwargs)[0].tolist()
+
+
+def forecastHorizons(data, from_value=None, size_forecasts=None, use_relative_frequency=False, forecast_factors=None, **kwargs):
+    """
+    Forecast data over several horizons from one distribution of its differences.
+
+    Args:
+        data (list or np.array): Time series data for which forecast is generated. Float arrays are used
+            without a copy, in their own precision.
+        from_value (float, optional): Starting point for forecast. Defaults to the last value in data.
+        size_forecasts (array-like of int, optional): Number of steps of every horizon (see `horizonSizes`).
+            Defaults to the length of the data.
+        use_relative_frequency (bool, optional): Whether to use relative frequencies in the forecast. Defaults to False.
+        forecast_factors (array-like of float, optional): Horizons as fractions of the length of the data,
+            `int(len(data) * factor)` steps each, in place of `size_forecasts`.
+        **kwargs: Additional arguments to be passed to the DataMod class.
+
+    Returns:
+        np.array: Array of shape (horizons, 3) with the forecasted lower bound, expected value, and upper bound
+            of every horizon, each as `forecastData` gives it.
+
+    Description:
+    ------------
+    The distribution of the differences does not depend on the horizon: it is computed once, and
+    the bounds and expectation of every horizon are its bin means and expected step scaled by the
+    number of steps.
+    """
     data_mod  = DataMod(**kwargs)
+    data = floatArray(data)
 
-    # Default to the last value of the data for 'from_value' and data length for 'size_forecast'
+    # Default to the last value of the data for 'from_value' and data length for 'size_forecasts'
     from_value = data[-1] if from_value is None else from_value
-    size_forecast = len(data) if size_forecast is None else size_forecast
+    if forecast_factors is not None:
+        size_forecasts = [int(len(data) * factor) for factor in np.atleast_1d(forecast_factors)]
+    size_forecasts = np.atleast_1d(len(data) if size_forecasts is None else size_forecasts).astype(np.float64)
 
     # Get the first order difference of data
     diff = np.diff(data, n=1)
@@ -37,22 +100,299 @@ def forecastData(data, from_value=None, size_forecast=None, use_relative_frequen
     prob_lower_bound = probability[0]
     prob_upper_bound = probability[1]
 
-    # Compute the expected difference based on the distribution
-    diff_expectation = data_mod.expectation(size_forecast, [mean_lower_bound, mean_upper_bound], [prob_lower_bound, prob_upper_bound])
-    
+    # Compute the expected difference of every horizon based on the distribution
+    diff_expectation = data_mod.expectation(1, [mean_lower_bound, mean_upper_bound], [prob_lower_bound, prob_upper_bound])
+    diff_expectation = size_forecasts * diff_expectation
+
     # Calculate the min and max expectations
-    min_diff_expectation = float(mean_lower_bound * size_forecast)
-    max_diff_expectation = float(mean_upper_bound * size_forecast)
+    min_diff_expectation = mean_lower_bound * size_forecasts
+    max_diff_expectation = mean_upper_bound * size_forecasts
 
-    # Compute the forecast distribution
-    forecast_distr = [from_value + min_diff_expectation, from_value + diff_expectation, from_value + max_diff_expectation]
+    # Compute the forecast distribution of every horizon
+    from_value = float(from_value)
+    forecast_distr = np.stack([from_value + min_diff_expectation, from_value + diff_expectation, from_value + max_diff_expectation], axis=-1)
 
     return forecast_distr
 
 
+def horizonSizes(horizons, interval):
+    """
+    Number of bars of an interval in every horizon.
+
+    Args:
+        horizons (list of str): Horizons as lengths of time (e.g. ['1h', '4h', '1d']).
+        interval (str): Interval of the bars (e.g. '2m').
+
+    Returns:
+        list of int: Number of whole bars in every horizon.
+    """
+    bar = period_length(interval)
+    return [int(period_length(horizon) // bar) for horizon in horizons]
+
+
+def stackSeries(series):
+    """
+    Stack series of different lengths into one 2-D array for `forecastBatch`.
+
+    Args:
+        series (list of array-like): The series to stack, one per row.
+
+    Returns:
+        tuple:
+            data (np.array): Array of shape (len(series), longest series), padded with NaN after each series.
+            mask (np.array): Boolean array of the same shape, True where data holds a value.
+    """
+    lengths = np.array([len(values) for values in series])
+    mask = np.arange(lengths.max(initial=0)) < lengths[:, None]
+
+    data = np.full(mask.shape, np.nan)
+    data[mask] = np.concatenate([np.asarray(values, dtype=np.float64) for values in series]) if len(series) else []
+
+    return data, mask
+
+
+def forecastBatch(data, from_values=None, size_forecasts=None, mask=None, use_relative_frequency=False, dtype=None):
+    """
+    Forecast many series at once, giving for each row the result of `forecastData` with default options.
+
+    Args:
+        data (np.array): 2-D array with one series per row, e.g. one pair or one window per row.
+        from_values (float or array-like, optional): Starting point of each forecast. Defaults to the last value of each row.
+        size_forecasts (int or array-like, optional): Number of steps of each forecast. Defaults to the length of each row.
+            A 2-D array of shape (rows or 1, horizons) forecasts every row over several horizons.
+        mask (np.array, optional): Boolean array of the shape of data, True where a row holds a value.
+            Defaults to the values of data that are not NaN (see `stackSeries` for ragged series).
+        use_relative_frequency (bool, optional): Whether to use relative frequencies in the forecast. Defaults to False.
+        dtype (np.dtype, optional): Float type of the computation. np.float32 halves its memory, and rounds the
+            differences by about 1e-7 of the rates, which can move differences at the bin edges across them.
+            Defaults to the type of data for float arrays, and to float64 otherwise.
+
+    Returns:
+        np.array: Array of shape (rows, 3) with the forecasted lower bound, expected value, and upper bound of every row,
+            or (rows, horizons, 3) for 2-D `size_forecasts`, in the float type of the computation.
+
+    Description:
+    ------------
+    The differences, their mean and standard deviation, and the counts and means of the bins
+    [mean - std, mean] and [mean, mean + std] are computed along the rows, so no Python loop 
+    runs over the series.
+    """
+    data = np.atleast_2d(floatArray(data, dtype))
+    mask = ~np.isnan(data) if mask is None else np.asarray(mask, dtype=bool)
+
+    lengths = mask.sum(axis=1)
+    last_values = data[np.arange(len(data)), np.maximum(mask.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1), 0)]
+    from_values = last_values if from_values is None else np.broadcast_to(np.asarray(from_values, dtype=data.dtype), lengths.shape)
+    size_forecasts = lengths if size_forecasts is None else np.asarray(size_forecasts, dtype=data.dtype)
+    size_forecasts = np.broadcast_to(size_forecasts, lengths.shape + size_forecasts.shape[1:] if size_forecasts.ndim == 2 else lengths.shape)
+
+    # First order differences, valid where both neighbouring values are
+    valid = mask[:, 1:] & mask[:, :-1]
+    diff = np.where(valid, np.diff(np.where(mask, data, 0), axis=1), 0)
+    size_data = valid.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Row statistics stay in the type of data, so the full size temporaries do too
+        mean = (diff.sum(axis=1) / size_data).astype(data.dtype)
+        std = np.sqrt(np.where(valid, (diff - mean[:, None]) ** 2, 0).sum(axis=1) / size_data).astype(data.dtype)
+
+        # Both bins include their edges, as in DataMod.binCounts
+        lower, upper = (mean - std)[:, None], (mean + std)[:, None]
+        in_lower = valid & (diff >= lower) & (diff <= mean[:, None])
+        in_upper = valid & (diff >= mean[:, None]) & (diff <= upper)
+        size_data_in_range = (valid & (diff >= lower) & (diff <= upper)).sum(axis=1)
+
+        counts = np.stack([in_lower.sum(axis=1), in_upper.sum(axis=1)], axis=1)
+        bins_mean = np.stack([np.where(in_lower, diff, 0).sum(axis=1), np.where(in_upper, diff, 0).sum(axis=1)], axis=1) / counts
+        probability = counts / (size_data_in_range if use_relative_frequency else size_data)[:, None]
+
+    # Row values against the horizons of every row
+    rows = (-1,) + (1,) * (size_forecasts.ndim - 1)
+    from_values, bins_mean = from_values.reshape(rows), bins_mean.reshape(rows + (2,))
+    diff_expectation = size_forecasts * (bins_mean * probability.reshape(rows + (2,))).sum(axis=-1)
+
+    return np.stack([
+        from_values + bins_mean[..., 0] * size_forecasts,
+        from_values + diff_expectation,
+        from_values + bins_mean[..., 1] * size_forecasts,
+    ], axis=-1).astype(data.dtype, copy=False)
+
+
+def simulatePaths(diff, num_paths, size_forecast, seed_sequence, chunk_elements=CHUNK_ELEMENTS):
+    """
+    Sum of `size_forecast` differences drawn with replacement from `diff`, for each of `num_paths` paths.
+
+    Paths and steps are drawn in chunks of at most `chunk_elements` differences, so the
+    (num_paths, size_forecast) matrix of steps is never held in memory.
+
+    Args:
+        diff (np.array): Empirical differences to draw from.
+        num_paths (int): Number of paths.
+        size_forecast (int): Number of steps of each path.
+        seed_sequence (np.random.SeedSequence): Seed of the draws.
+        chunk_elements (int, optional): Maximum number of differences drawn at once. Defaults to CHUNK_ELEMENTS.
+
+    Returns:
+        np.array: Total change of every path.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    totals = np.zeros(num_paths)
+
+    chunk_steps = max(1, min(size_forecast, chunk_elements))
+    chunk_paths = max(1, chunk_elements // chunk_steps)
+    for path_start in range(0, num_paths, chunk_paths):
+        paths = totals[path_start:path_start + chunk_paths]
+        for step_start in range(0, size_forecast, chunk_steps):
+            steps = min(chunk_steps, size_forecast - step_start)
+            paths += diff[rng.integers(0, len(diff), size=(len(paths), steps))].sum(axis=1)
+
+    return totals
+
+
+def forecastMonteCarlo(data, from_value=None, size_forecast=None, num_paths=10_000, quantiles=(0.05, 0.5, 0.95),
+                       seed=None, workers=1, return_quantiles=False, chunk_elements=CHUNK_ELEMENTS):
+    """
+    Forecast data by bootstrapping paths from the differences of the input series.
+
+    Args:
+        data (list or np.array): Time series data for which forecast is generated.
+        from_value (float, optional): Starting point for forecast. Defaults to the last value in data.
+        size_forecast (int, optional): Number of steps to forecast. Defaults to the length of the data.
+        num_paths (int, optional): Number of simulated paths. Defaults to 10 000.
+        quantiles (tuple of float, optional): Quantiles of the closing value to compute. Defaults to (0.05, 0.5, 0.95).
+        seed (int, optional): Seed of the simulation. Defaults to None, a fresh seed on every call.
+        workers (int, optional): Number of processes simulating the paths. Defaults to 1, simulating in this process.
+        return_quantiles (bool, optional): Whether to also return the quantiles. Defaults to False.
+        chunk_elements (int, optional): Maximum number of differences drawn at once per process. Defaults to CHUNK_ELEMENTS.
+
+    Returns:
+        list: A list containing the lowest quantile, the mean and the highest quantile of the closing value,
+            in the shape of `forecastData`.
+        dict: Only if `return_quantiles`, the closing value at every quantile, keyed by quantile.
+
+    Description:
+    ------------
+    Every path adds `size_forecast` differences drawn with replacement from the first order
+    differences of data. Paths are simulated in blocks of PATHS_PER_BLOCK, each drawn from its own
+    child of the seed, so a seed gives the same forecast for any number of workers.
+    """
+    data = floatArray(data)
+
+    # Default to the last value of the data for 'from_value' and data length for 'size_forecast'
+    from_value = float(data[-1] if from_value is None else from_value)
+    size_forecast = len(data) if size_forecast is None else int(size_forecast)
+
+    # Get the first order difference of data
+    diff = np.diff(data, n=1)
+
+    # One independent seed per block of paths
+    block_paths = [min(PATHS_PER_BLOCK, num_paths - start) for start in range(0, num_paths, PATHS_PER_BLOCK)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(block_paths))
+    blocks = [(diff, paths, size_forecast, seed_sequence, chunk_elements) for paths, seed_sequence in zip(block_paths, seed_sequences)]
+
+    if workers == 1:
+        totals = [simulatePaths(*block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            totals = list(executor.map(simulatePaths, *zip(*blocks)))
+
+    closing_values = from_value + np.concatenate(totals)
+
+    quantiles = sorted(quantiles)
+    quantile_values = np.quantile(closing_values, quantiles)
+    forecast_distr = [float(quantile_values[0]), float(np.mean(closing_values)), float(quantile_values[-1])]
+
+    if return_quantiles:
+        return forecast_distr, {quantile: float(value) for quantile, value in zip(quantiles, quantile_values)}
+    return forecast_distr
+
+
+#___Unit Testing____#
+class TestForecastBatch(unittest.TestCase):
+
+    def test_forecastBatch(self):
+        """Test that every row of a ragged batch matches forecastData."""
+        rng = np.random.default_rng(2)
+        series = [np.round(1 + np.cumsum(rng.normal(scale=1e-3, size=size)), 5) for size in (500, 1200, 800)]
+        data, mask = stackSeries(series)
+
+        result = forecastBatch(data, mask=mask, size_forecasts=[100, 400, 250])
+        for row, values, size_forecast in zip(result, series, (100, 400, 250)):
+            np.testing.assert_allclose(row, forecastData(values.tolist(), size_forecast=size_forecast), rtol=1e-9)
+
+        result = forecastBatch(data, from_values=1.0, use_relative_frequency=True)
+        for row, values in zip(result, series):
+            np.testing.assert_allclose(row, forecastData(values.tolist(), 1.0, use_relative_frequency=True), rtol=1e-9)
+
+    def test_float32(self):
+        """Test that float32 forecasts stay in float32 and close to the float64 forecasts."""
+        closes = np.round(1.1 + np.cumsum(np.random.default_rng(5).normal(scale=2e-4, size=(4, 5000)), axis=1), 5)
+
+        result = forecastBatch(closes, size_forecasts=1000, dtype=np.float32)
+        self.assertEqual(result.dtype, np.float32)
+        # Rounding the closes to float32 can move differences at the bin edges across them
+        np.testing.assert_allclose(result, forecastBatch(closes, size_forecasts=1000), rtol=1e-3)
+
+        single = forecastData(closes[0].astype(np.float32), size_forecast=1000)
+        self.assertTrue(all(type(value) is float for value in single))
+        np.testing.assert_allclose(single, result[0], rtol=1e-4)
+
+
+class TestForecastHorizons(unittest.TestCase):
+
+    def test_forecastHorizons(self):
+        """Test that every horizon matches forecastData, for one series and for a batch."""
+        rng = np.random.default_rng(6)
+        series = np.round(1.1 + np.cumsum(rng.normal(scale=2e-4, size=(3, 3000)), axis=1), 5)
+        sizes = horizonSizes(['1h', '4h', '1d'], '2m')
+        self.assertEqual(sizes, [30, 120, 720])
+
+        result = forecastHorizons(series[0], 1.2, sizes, use_relative_frequency=True)
+        self.assertEqual(result.shape, (3, 3))
+        for row, size_forecast in zip(result, sizes):
+            self.assertEqual(row.tolist(), forecastData(series[0], 1.2, size_forecast, use_relative_frequency=True))
+
+        result = forecastHorizons(series[0], forecast_factors=[0.1, 1/3])
+        np.testing.assert_array_equal(result[1], forecastData(series[0], size_forecast=1000))
+
+        batch = forecastBatch(series, size_forecasts=[sizes])
+        self.assertEqual(batch.shape, (3, 3, 3))
+        for rows, values in zip(batch, series):
+            np.testing.assert_allclose(rows, forecastHorizons(values, size_forecasts=sizes), rtol=1e-9)
+
+
+class TestForecastMonteCarlo(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a random walk."""
+        self.data = 1 + np.cumsum(np.random.default_rng(3).normal(scale=1e-3, size=2000))
+
+    def test_forecastMonteCarlo(self):
+        """Test the quantiles and mean against the moments of a sum of bootstrapped differences."""
+        diff = np.diff(self.data)
+        forecast_distr, quantiles = forecastMonteCarlo(self.data, size_forecast=500, num_paths=20_000, seed=1, return_quantiles=True)
+
+        # The sum of 500 draws is close to normal with these moments
+        mean, std = self.data[-1] + 500 * diff.mean(), np.sqrt(500) * diff.std()
+        self.assertAlmostEqual(forecast_distr[1], mean, delta=0.05 * std)
+        self.assertAlmostEqual(quantiles[0.5], mean, delta=0.05 * std)
+        self.assertAlmostEqual(quantiles[0.95] - quantiles[0.05], 2 * 1.645 * std, delta=0.05 * std)
+        self.assertEqual(forecast_distr[0], quantiles[0.05])
+        self.assertEqual(forecast_distr[2], quantiles[0.95])
+
+    def test_chunks_and_workers(self):
+        """Test that a seed gives the same forecast for any chunk size and number of workers."""
+        forecast_distr = forecastMonteCarlo(self.data, size_forecast=300, num_paths=5000, seed=7)
+        self.assertEqual(forecastMonteCarlo(self.data, size_forecast=300, num_paths=5000, seed=7, chunk_elements=1000), forecast_distr)
+        self.assertEqual(forecastMonteCarlo(self.data, size_forecast=300, num_paths=5000, seed=7, workers=2), forecast_distr)
+
+
 if __name__ == '__main__':
     
     data = [1, 2, 3, 4, 5, 3, 4, 2, 1, 2, 3, 4, 3, 2, 1]
     diff = np.diff(data, n=1)
 
     print(diff)
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -1,7 +1,12 @@
-import yfinance as yf
-import requests
-import pandas as pd
+import time
+import threading
+import unittest
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from Modules.PriceStore import has_history, append_history, prepend_history, load_arrays, load_history, read_meta, update_meta, period_length
 
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
 
 # Using Yahho Finance
 """
@@ -14,22 +19,99 @@ KEY VALUES FOR FOREX
 'regularMarketDayHigh' and 'regularMarketDayLow': The highest and lowest prices for the current trading day (0.9282 and 0.9251, respectively).
 """
 
-def forexRate(from_currency: str, to_currency: str) -> tuple:
+# Quotes are cached per symbol for QUOTE_TTL seconds
+QUOTE_TTL = 30
+QUOTE_WORKERS = 8
+_quote_cache = {}       # symbol -> (time fetched, bid, ask)
+_quote_in_flight = {}   # symbol -> Future of a fetch in progress
+_quote_lock = threading.Lock()
+
+def clear_quote_cache():
+    """Forget every cached quote."""
+    with _quote_lock:
+        _quote_cache.clear()
+
+def _fetch_quotes(symbols: list) -> dict:
+    """
+    Fetches the bid and ask of many symbols from Yahoo Finance.
+
+    Yahoo Finance has no bulk bid/ask endpoint, so the symbols share one `yf.Tickers`
+    and their quotes are requested concurrently.
+
+    :param symbols: Yahoo Finance symbols (e.g. 'EURGBP=X').
+    :return: Dictionary of symbol to (bid, ask).
+    """
+    import yfinance as yf
+    tickers = yf.Tickers(' '.join(symbols))
+
+    def quote(symbol):
+        info = tickers.tickers[symbol].info
+        return info['bid'], info['ask']
+
+    with ThreadPoolExecutor(max_workers=min(QUOTE_WORKERS, len(symbols))) as executor:
+        return dict(zip(symbols, executor.map(quote, symbols)))
+
+def forex_rates(pairs: list, ttl: float = None) -> list:
+    """
+    Fetches the latest conversion rates of many currency pairs, using cached quotes younger than `ttl`.
+
+    Every symbol is fetched at most once per TTL: the missing symbols are fetched together, and a
+    symbol already being fetched by another thread is waited for rather than fetched again.
+
+    :param pairs: List of (from_currency, to_currency) tuples (e.g. [('EUR', 'GBP')]).
+    :param ttl: Maximum age of a cached quote in seconds. Defaults to QUOTE_TTL.
+    :return: List of (sell rate, buy rate, spread) tuples in the order of `pairs`.
+    """
+    ttl = QUOTE_TTL if ttl is None else ttl
+    symbols = [f"{from_currency}{to_currency}=X" for from_currency, to_currency in pairs]
+    now = time.monotonic()
+
+    with _quote_lock:
+        fresh = {symbol for symbol in symbols if symbol in _quote_cache and now - _quote_cache[symbol][0] <= ttl}
+        waiting = {symbol: _quote_in_flight[symbol] for symbol in symbols if symbol not in fresh and symbol in _quote_in_flight}
+        missing = list(dict.fromkeys(symbol for symbol in symbols if symbol not in fresh and symbol not in waiting))
+        if missing:
+            fetch = Future()
+            for symbol in missing:
+                _quote_in_flight[symbol] = fetch
+
+    if missing:
+        try:
+            quotes = _fetch_quotes(missing)
+            fetch.set_result(None)
+        except Exception as error:
+            fetch.set_exception(error)
+            raise
+        finally:
+            with _quote_lock:
+                if fetch.exception() is None:
+                    fetched_at = time.monotonic()
+                    for symbol, (bid, ask) in quotes.items():
+                        _quote_cache[symbol] = (fetched_at, bid, ask)
+                for symbol in missing:
+                    _quote_in_flight.pop(symbol, None)
+
+    for waited in set(waiting.values()):
+        waited.result()
+
+    rates = []
+    with _quote_lock:
+        for symbol in symbols:
+            _, latest_sell_rate, latest_buy_rate = _quote_cache[symbol]
+            rates.append((latest_sell_rate, latest_buy_rate, float(latest_buy_rate - latest_sell_rate)))
+
+    return rates
+
+def forexRate(from_currency: str, to_currency: str, ttl: float = None) -> tuple:
     """
     Fetches the latest conversion rate between two currencies using Yahoo Finance.
 
     :param from_currency: The base currency code (e.g., 'USD').
     :param to_currency: The target currency code (e.g., 'EUR').
+    :param ttl: Maximum age in seconds of a cached quote to reuse. Defaults to QUOTE_TTL.
     :return: Latest sell rate, buy rate, and spread as a tuple.
     """
-    pair_symbol = f"{from_currency}{to_currency}=X"
-    ticker = yf.Ticker(pair_symbol)
-
-    latest_sell_rate = ticker.info['bid']  # Sell price
-    latest_buy_rate = ticker.info['ask']    # Buy price
-    spread = float(latest_buy_rate - latest_sell_rate)
-
-    return latest_sell_rate, latest_buy_rate, spread
+    return forex_rates([(from_currency, to_currency)], ttl=ttl)[0]
 
 def assetRate(asset: str) -> tuple:
     """
@@ -38,6 +120,7 @@ def assetRate(asset: str) -> tuple:
     :param asset: The stock ticker symbol (e.g., 'TSLA').
     :return: Latest bid price and ask price as a tuple.
     """
+    import yfinance as yf
     ticker = yf.Ticker(asset)
     latest_bid = ticker.info['bid']  # Bid price
     latest_ask = ticker.info['ask']    # Ask price
@@ -50,12 +133,14 @@ def hist_forex(from_currency: str, to_currency: str, start_date: str, end_date:
 
     :param from_currency: The base currency code (e.g., 'USD').
     :param to_currency: The target currency code (e.g., 'EUR').
-    :param start_date: Start date for historical data.
+    :param start_date: Start date for historical data. Without an end date, the bars from it up to now.
     :param end_date: End date for historical data.
     :param period: Period for historical data (optional).
     :param interval: Interval for historical data (optional).
     :return: Historical forex data as a DataFrame.
     """
+    import yfinance as yf
+
     pair_symbol = f"{from_currency}{to_currency}=X"
     ticker = yf.Ticker(pair_symbol)
 
@@ -72,11 +157,79 @@ def hist_forex(from_currency: str, to_currency: str, start_date: str, end_date:
             if interval
             else ticker.history(start=start_date, end=end_date)
         )
+    elif start_date:
+        # Bars since a time, e.g. the ones newer than a stored history
+        price_data = (
+            ticker.history(start=start_date, interval=interval)
+            if interval
+            else ticker.history(start=start_date)
+        )
     else:
         price_data = ticker.history()
 
     return price_data
 
+def period_timedelta(period: str):
+    """
+    Converts a Yahoo Finance period (e.g. '5d', '1mo', '1y') to a pandas Timedelta.
+
+    :param period: Period string, 'max' and 'ytd' are not fixed lengths and return None.
+    :return: The length of the period, or None.
+    """
+    import pandas as pd
+
+    length = period_length(period)
+    return None if length is None else pd.Timedelta(length)
+
+def hist_forex_incremental(from_currency: str, to_currency: str, store_dir: str, period: str = None, interval: str = None, fetch=None):
+    """
+    Fetches historical forex rates, downloading only the bars newer than the stored history.
+
+    The first call fetches the full `period` and stores it. Later calls request the range from
+    the last stored timestamp to now, replace the overlapping bar and append the rest. A `period`
+    starting before the first stored bar is backfilled once: the earliest start requested is kept
+    in the store metadata as 'fetched_from', so a start without bars (e.g. on a weekend) is not
+    requested again.
+
+    :param from_currency: The base currency code (e.g., 'USD').
+    :param to_currency: The target currency code (e.g., 'EUR').
+    :param store_dir: Store directory of the pair history for this interval (see `PriceStore.store_path`).
+    :param period: Period of history returned (optional). The store keeps everything fetched.
+    :param interval: Interval for historical data (optional).
+    :param fetch: Callable with the signature of `hist_forex` used to download bars. Defaults to `hist_forex`.
+    :return: Historical forex data covering `period` as a DataFrame.
+    """
+    fetch = hist_forex if fetch is None else fetch
+
+    if not has_history(store_dir):
+        price_data = fetch(from_currency, to_currency, None, None, period=period, interval=interval).dropna()
+        append_history(store_dir, price_data, interval=interval)
+    else:
+        import pandas as pd
+        index = load_arrays(store_dir)['Datetime']
+        first_timestamp, last_timestamp = pd.Timestamp(index[0], tz='UTC'), pd.Timestamp(index[-1], tz='UTC')
+
+        # Backfill the head of a period reaching before the stored history
+        window = period_timedelta(period)
+        fetched_from = read_meta(store_dir).get('fetched_from')
+        fetched_from = first_timestamp if fetched_from is None else pd.Timestamp(fetched_from)
+        if window is not None and last_timestamp - window < fetched_from:
+            price_data = fetch(from_currency, to_currency, last_timestamp - window, first_timestamp, interval=interval).dropna()
+            prepend_history(store_dir, price_data, interval=interval)
+            update_meta(store_dir, fetched_from=(last_timestamp - window).isoformat())
+
+        price_data = fetch(from_currency, to_currency, last_timestamp, pd.Timestamp.now(tz='UTC'), interval=interval).dropna()
+        append_history(store_dir, price_data, interval=interval)
+
+    history = load_history(store_dir)
+
+    # Return the trailing window of the requested period
+    window = period_timedelta(period)
+    if window is not None and len(history):
+        history = history[history.index > history.index[-1] - window]
+
+    return history
+
 def hist_asset(asset: str, start_date: str, end_date: str, period: str = None, interval: str = None):
     """
     Fetches historical prices of a specified asset.
@@ -88,6 +241,7 @@ def hist_asset(asset: str, start_date: str, end_date: str, period: str = None, i
     :param interval: Interval for historical data (optional).
     :return: Historical asset data as a DataFrame.
     """
+    import yfinance as yf
     ticker = yf.Ticker(asset)
 
     # Get historical data
@@ -112,6 +266,8 @@ def hist_asset(asset: str, start_date: str, end_date: str, period: str = None, i
 # Using API
 
 def blitzRate(currency_a, currency_b, start_date=None, end_date=None, api_url=None):
+    import requests
+
     # Set the API URL for fetching historical exchange rates
     api_url = f"https://api.blitzRate-api.com/v4/latest/{currency_a}" if api_url is None else api_url
     
@@ -133,6 +289,8 @@ def blitzRate(currency_a, currency_b, start_date=None, end_date=None, api_url=No
         return None
 
 def assetPrice(asset_symbol, api_url=None):
+    import requests
+
     # Set the API URL for fetching asset prices
     # This example uses a mock URL. Replace it with the actual endpoint for the asset price API you're using.
     api_url = f"https://api.example.com/v1/price/{asset_symbol}" if api_url is None else api_url
@@ -154,8 +312,120 @@ def assetPrice(asset_symbol, api_url=None):
         print(f"Error fetching asset price: {e}")
         return None
 
+#___Unit Testing____#
+class TestHistForexIncremental(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a stand-in provider serving 2m bars from a fixed history."""
+        import tempfile
+        import pandas as pd
+
+        index = pd.date_range('2024-10-01', periods=1000, freq='2min', tz='Europe/London', name='Datetime')
+        close = 1 + 0.001 * np.sin(np.arange(1000) / 10)
+        self.history = pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 0}, index=index)
+        self.now = 900
+        self.rows_fetched = 0
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store_dir = directory.name
+
+    def fetch(self, from_currency, to_currency, start_date, end_date, period=None, interval=None):
+        available = self.history.iloc[:self.now]
+        if start_date is None:
+            price_data = available.iloc[-500:]
+        else:
+            price_data = available[(available.index >= start_date) & (available.index < (end_date or available.index[-1] + available.index.freq))]
+        self.rows_fetched += len(price_data)
+        return price_data
+
+    def test_incremental_fetch(self):
+        """Test that later fetches only download bars from the cached tail onwards."""
+        first = hist_forex_incremental('EUR', 'GBP', self.store_dir, interval='2m', fetch=self.fetch)
+        self.assertEqual(self.rows_fetched, 500)
+
+        self.now = 910
+        second = hist_forex_incremental('EUR', 'GBP', self.store_dir, interval='2m', fetch=self.fetch)
+        self.assertEqual(self.rows_fetched, 500 + 11)
+        self.assertEqual(len(second), len(first) + 10)
+        self.assertTrue(second.index.is_unique)
+        np.testing.assert_array_equal(second['Close'].to_numpy(), self.history['Close'].iloc[400:910].to_numpy())
+
+    def test_backfill(self):
+        """Test that a longer period fetches the missing head once and keeps the stored bars."""
+        hist_forex_incremental('EUR', 'GBP', self.store_dir, interval='2m', fetch=self.fetch)
+
+        # Bars 400 .. 899 are stored, a day of 2m bars reaches back to bar 179
+        longer = hist_forex_incremental('EUR', 'GBP', self.store_dir, period='1d', interval='2m', fetch=self.fetch)
+        self.assertEqual(self.rows_fetched, 500 + 221 + 1)
+        np.testing.assert_array_equal(longer['Close'].to_numpy(), self.history['Close'].iloc[180:900].to_numpy())
+        self.assertTrue(longer.index.is_monotonic_increasing and longer.index.is_unique)
+
+        # The head was requested, a second call only fetches the tail
+        hist_forex_incremental('EUR', 'GBP', self.store_dir, period='1d', interval='2m', fetch=self.fetch)
+        self.assertEqual(self.rows_fetched, 500 + 221 + 1 + 1)
+
+
+class TestHistForex(unittest.TestCase):
+
+    def setUp(self):
+        """Replace yfinance with a stand-in recording the history requests."""
+        import sys
+        import types
+
+        self.requests = []
+        ticker = type('Ticker', (), {
+            '__init__': lambda ticker, symbol: None,
+            'history': lambda ticker, **kwargs: self.requests.append(kwargs),
+        })
+        self.yfinance = sys.modules.get('yfinance')
+        sys.modules['yfinance'] = types.SimpleNamespace(Ticker=ticker)
+
+    def tearDown(self):
+        import sys
+
+        if self.yfinance is None:
+            sys.modules.pop('yfinance')
+        else:
+            sys.modules['yfinance'] = self.yfinance
+
+    def test_start_only(self):
+        """Test that a start without an end requests the bars of the interval from the start."""
+        hist_forex('EUR', 'GBP', '2024-10-01 08:00', None, interval='2m')
+        self.assertEqual(self.requests, [{'start': '2024-10-01 08:00', 'interval': '2m'}])
+
+
+class TestForexRates(unittest.TestCase):
+
+    def setUp(self):
+        """Replace the Yahoo Finance fetch with a counting stand-in."""
+        self.fetched = []
+        self.fetch_quotes = globals()['_fetch_quotes']
+        globals()['_fetch_quotes'] = lambda symbols: self.fetched.append(list(symbols)) or {symbol: (1.0, 1.5) for symbol in symbols}
+        clear_quote_cache()
+
+    def tearDown(self):
+        globals()['_fetch_quotes'] = self.fetch_quotes
+        clear_quote_cache()
+
+    def test_forex_rates(self):
+        """Test that quotes are fetched once per symbol per TTL, missing symbols together."""
+        rates = forex_rates([('EUR', 'GBP'), ('ZAR', 'GBP'), ('EUR', 'GBP')])
+        self.assertEqual(rates, [(1.0, 1.5, 0.5)] * 3)
+        self.assertEqual(self.fetched, [['EURGBP=X', 'ZARGBP=X']])
+
+        forexRate('ZAR', 'GBP')
+        forex_rates([('EUR', 'GBP'), ('ZAR', 'EUR')])
+        self.assertEqual(self.fetched, [['EURGBP=X', 'ZARGBP=X'], ['ZAREUR=X']])
+
+        forexRate('EUR', 'GBP', ttl=0)
+        self.assertEqual(self.fetched[-1], ['EURGBP=X'])
+
+
 if __name__== '__main__':
  
+    if RUN_UNIT_TESTING:
+        unittest.main()
+
     unit_a = 'EUR'
     unit_b = 'GBP'
 
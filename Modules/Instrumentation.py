@@ -0,0 +1,311 @@
+import json
+import time
+import bisect
+import inspect
+import threading
+import functools
+import unittest
+from contextlib import contextmanager
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+INSTRUMENTATION
+---------------
+Wall time, call counts and input sizes of the stages of a run, counters, and latency histograms.
+
+    with stage('forecast', size=len(data)):     # time a block
+        ...
+
+    @timed('distribution', size_arg=1)          # time every call, sized by the length of an argument
+    def distribution(self, data_arg, ...):
+
+    observe('quote_to_decision', seconds)       # latency sample
+    count('quotes', 3)                          # counter
+
+Recording is off until `enable()` is called. While off, `stage` returns a shared no-op context and
+`timed` functions make one flag check before calling through, so instrumented hot paths cost close
+to nothing. Metrics are kept per process: `snapshot()` and `merge()` carry the metrics of worker
+processes back to the parent, and `to_json` / `to_prometheus` export them.
+
+Debug logs of the instrumented modules go through `logging` (logger names `Modules.<module>`).
+"""
+
+ENABLED = False
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_stages = {}      # name -> [calls, total seconds, max seconds, total size]
+_counters = {}    # name -> value
+_latencies = {}   # name -> [bucket counts..., +Inf count, sum, count]
+
+
+def enable():
+    """Start recording metrics."""
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    """Stop recording metrics, the metrics recorded so far are kept."""
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """Drop every recorded metric."""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _latencies.clear()
+
+
+def record(name: str, seconds: float, size: int = None):
+    """
+    Record one call of a stage.
+
+    :param name: Name of the stage (e.g. 'fetch').
+    :param seconds: Wall time of the call.
+    :param size: Input size of the call (optional).
+    """
+    with _lock:
+        calls, total, longest, total_size = _stages.get(name, (0, 0.0, 0.0, 0))
+        _stages[name] = [calls + 1, total + seconds, max(longest, seconds), total_size + (size or 0)]
+
+
+def count(name: str, value: float = 1):
+    """Add a value to a counter."""
+    if ENABLED:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, seconds: float):
+    """Add a sample to a latency histogram."""
+    if not ENABLED:
+        return
+    with _lock:
+        histogram = _latencies.setdefault(name, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0])
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+class _NullStage:
+    # Shared context of the stages while recording is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+@contextmanager
+def _timed_stage(name, size):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, size)
+
+
+def stage(name: str, size: int = None):
+    """
+    Context timing a block as one call of a stage.
+
+    :param name: Name of the stage (e.g. 'fetch').
+    :param size: Input size of the block (optional).
+    """
+    return _timed_stage(name, size) if ENABLED else _NULL_STAGE
+
+
+def timed(name: str = None, size_arg=None):
+    """
+    Decorator timing every call of a function as a stage.
+
+    :param name: Name of the stage. Defaults to the name of the function.
+    :param size_arg: Position or name of the argument whose length is the input size (optional).
+    """
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        # The sized argument by position and by name, as it can be passed either way
+        parameters = list(inspect.signature(function).parameters)
+        size_position = size_arg if isinstance(size_arg, int) else parameters.index(size_arg) if size_arg in parameters else None
+        size_name = parameters[size_arg] if isinstance(size_arg, int) and size_arg < len(parameters) else size_arg
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+
+            size = None
+            if size_arg is not None:
+                value = args[size_position] if size_position is not None and size_position < len(args) else kwargs.get(size_name)
+                size = len(value) if hasattr(value, '__len__') else None
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage_name, time.perf_counter() - start, size)
+
+        return wrapper
+    return decorator
+
+
+def snapshot() -> dict:
+    """
+    Recorded metrics of this process.
+
+    :return: Dict of 'stages' (calls, seconds, max_seconds, mean_seconds, size per stage), 'counters'
+        and 'latencies' (bucket counts, sum and count per histogram).
+    """
+    with _lock:
+        stages = {
+            name: {
+                'calls': calls,
+                'seconds': total,
+                'max_seconds': longest,
+                'mean_seconds': total / calls,
+                'size': total_size,
+            }
+            for name, (calls, total, longest, total_size) in _stages.items()
+        }
+        latencies = {
+            name: {
+                'buckets': dict(zip([*map(str, LATENCY_BUCKETS), '+Inf'], histogram[:-2])),
+                'sum': histogram[-2],
+                'count': histogram[-1],
+            }
+            for name, histogram in _latencies.items()
+        }
+        return {'stages': stages, 'counters': dict(_counters), 'latencies': latencies}
+
+
+def merge(metrics: dict):
+    """Add the metrics of a snapshot, e.g. from a worker process, to the metrics of this process."""
+    with _lock:
+        for name, values in metrics.get('stages', {}).items():
+            calls, total, longest, total_size = _stages.get(name, (0, 0.0, 0.0, 0))
+            _stages[name] = [
+                calls + values['calls'], total + values['seconds'],
+                max(longest, values['max_seconds']), total_size + values['size']
+            ]
+        for name, value in metrics.get('counters', {}).items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, values in metrics.get('latencies', {}).items():
+            histogram = _latencies.setdefault(name, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0])
+            for indx, bucket_count in enumerate(values['buckets'].values()):
+                histogram[indx] += bucket_count
+            histogram[-2] += values['sum']
+            histogram[-1] += values['count']
+
+
+def to_json(file_path: str = None) -> str:
+    """Metrics as JSON, also written to `file_path` if given."""
+    text = json.dumps(snapshot(), indent=4)
+    if file_path:
+        with open(file_path, 'w') as file:
+            file.write(text)
+    return text
+
+
+def to_prometheus(file_path: str = None, prefix: str = 'forecast') -> str:
+    """Metrics in the Prometheus text exposition format, also written to `file_path` if given."""
+    metrics = snapshot()
+    lines = []
+
+    for metric, key, kind in (('stage_calls_total', 'calls', 'counter'), ('stage_seconds_total', 'seconds', 'counter'),
+                              ('stage_max_seconds', 'max_seconds', 'gauge'), ('stage_size_total', 'size', 'counter')):
+        lines.append(f'# TYPE {prefix}_{metric} {kind}')
+        lines.extend(f'{prefix}_{metric}{{stage="{name}"}} {values[key]}' for name, values in metrics['stages'].items())
+
+    for name, value in metrics['counters'].items():
+        lines.append(f'# TYPE {prefix}_{name}_total counter')
+        lines.append(f'{prefix}_{name}_total {value}')
+
+    for name, values in metrics['latencies'].items():
+        lines.append(f'# TYPE {prefix}_{name}_seconds histogram')
+        cumulative = 0
+        for bound, bucket_count in values['buckets'].items():
+            cumulative += bucket_count
+            lines.append(f'{prefix}_{name}_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_{name}_seconds_sum {values["sum"]}')
+        lines.append(f'{prefix}_{name}_seconds_count {values["count"]}')
+
+    text = '\n'.join(lines) + '\n'
+    if file_path:
+        with open(file_path, 'w') as file:
+            file.write(text)
+    return text
+
+
+def export(file_path: str):
+    """Write the metrics to a file, in the Prometheus format for `.prom` files and as JSON otherwise."""
+    return to_prometheus(file_path) if file_path.endswith('.prom') else to_json(file_path)
+
+
+#___Unit Testing____#
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        enable()
+
+    def tearDown(self):
+        disable()
+        reset()
+
+    def test_stages(self):
+        """Test that stages and timed functions record calls, time and sizes."""
+        @timed('square', size_arg=0)
+        def square(values):
+            return [value * value for value in values]
+
+        with stage('block', size=3):
+            square([1, 2, 3])
+        square(values=[1, 2])
+
+        stages = snapshot()['stages']
+        self.assertEqual(stages['square']['calls'], 2)
+        self.assertEqual(stages['square']['size'], 5)
+        self.assertEqual(stages['block']['calls'], 1)
+        self.assertGreaterEqual(stages['block']['seconds'], stages['square']['max_seconds'])
+
+    def test_disabled(self):
+        """Test that nothing is recorded while disabled."""
+        disable()
+        with stage('block'):
+            count('quotes')
+            observe('latency', 0.1)
+        self.assertEqual(snapshot(), {'stages': {}, 'counters': {}, 'latencies': {}})
+
+    def test_merge_and_export(self):
+        """Test merging snapshots and the Prometheus histogram."""
+        observe('quote_to_decision', 0.002)
+        observe('quote_to_decision', 0.2)
+        count('quotes', 2)
+        metrics = snapshot()
+        merge(metrics)
+
+        merged = snapshot()
+        self.assertEqual(merged['counters']['quotes'], 4)
+        self.assertEqual(merged['latencies']['quote_to_decision']['count'], 4)
+
+        text = to_prometheus()
+        self.assertIn('forecast_quote_to_decision_seconds_bucket{le="0.005"} 2', text)
+        self.assertIn('forecast_quote_to_decision_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('forecast_quotes_total 4', text)
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import unittest
+import numpy as np
+from Modules.Trade import ACTIONS
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+RUN JOURNAL
+-----------
+Every trade decision of every run is appended to a journal, never overwritten. A journal is either
+
+    trade_journal.jsonl       one JSON object per decision
+    trade_journal.bin         fixed-size records of RECORD_DTYPE, back to back
+    trade_journal.bin.json    dtype of the records, written with the first record
+
+Both hold the fields of RECORD_DTYPE. Binary journals are read with `np.memmap`, so reading
+millions of decisions maps the file instead of parsing it. Records are written in batches
+of `batch_size` with one append each, and a journal is read back as a structured array.
+"""
+
+JSONL_EXTENSION = '.jsonl'
+BINARY_EXTENSION = '.bin'
+META_SUFFIX = '.json'
+
+ACTION_CODES = {action: code for code, action in ACTIONS.items()}
+
+# Fields of a journal record. Prices are NaN where a decision has none (e.g. the thresholds of a hold).
+RECORD_DTYPE = np.dtype([
+    ('time', 'datetime64[ns]'),         # Time the decision was journaled, UTC
+    ('pair', 'S8'),                     # e.g. b'EURGBP'
+    ('interval', 'S4'),                 # Interval of the history, e.g. b'2m'
+    ('action', 'i1'),                   # SELL, HOLD or BUY
+    ('data_size', 'i8'),
+    ('forecast_size', 'i8'),
+    ('rate_opening', 'f8'),
+    ('spread', 'f8'),
+    ('forecast_min', 'f8'),
+    ('forecast', 'f8'),
+    ('forecast_max', 'f8'),
+    ('investment_amount', 'f8'),
+    ('expected_profit', 'f8'),
+    ('max_possible_loss', 'f8'),
+    ('rate_loss_threshold', 'f8'),
+    ('rate_profit_threshold', 'f8'),
+])
+
+
+def journal_record(output_variables: dict, decision_time=None) -> dict:
+    """
+    Journal record of the output variables of a pair, as returned by `main_trade.evaluate_pair`.
+
+    :param output_variables: Output variables of the pair.
+    :param decision_time: Time of the decision. Defaults to now.
+    :return: Dict of the fields of RECORD_DTYPE.
+    """
+    decision_time = time.time_ns() if decision_time is None else decision_time
+    thresholds = [value for key, value in output_variables.items() if key.startswith(('rate_loss_threshold', 'rate_profit_threshold'))]
+    forecast_min, forecast, forecast_max = output_variables['forecast_closing_rates']
+
+    return {
+        'time': np.datetime64(decision_time, 'ns'),
+        'pair': output_variables['rate_given'],
+        'interval': output_variables.get('interval') or '',
+        'action': ACTION_CODES[output_variables['trade_action']],
+        'data_size': output_variables['data_size'],
+        'forecast_size': output_variables['forecast_size'],
+        'rate_opening': output_variables['RATE_OPENING'],
+        'spread': output_variables['price_spread'],
+        'forecast_min': forecast_min,
+        'forecast': forecast,
+        'forecast_max': forecast_max,
+        'investment_amount': output_variables.get('investment_amount'),
+        'expected_profit': output_variables.get('expected_profit'),
+        'max_possible_loss': output_variables.get('max_possible_loss'),
+        'rate_loss_threshold': thresholds[0] if thresholds else None,
+        'rate_profit_threshold': thresholds[1] if len(thresholds) > 1 else None,
+    }
+
+
+def to_records(records: list) -> np.ndarray:
+    """Structured array of RECORD_DTYPE from record dicts, None becoming NaN."""
+    array = np.zeros(len(records), dtype=RECORD_DTYPE)
+    for name in RECORD_DTYPE.names:
+        values = [record.get(name) for record in records]
+        if RECORD_DTYPE[name].kind == 'f':
+            values = [np.nan if value is None else value for value in values]
+        elif RECORD_DTYPE[name].kind == 'S':
+            values = [(value or '').encode() if isinstance(value, str) else value or b'' for value in values]
+        array[name] = values
+    return array
+
+
+def json_record(record) -> str:
+    """One line of a JSON Lines journal, with the action by name and the time in ISO format."""
+    fields = {}
+    for name in RECORD_DTYPE.names:
+        value = record[name]
+        if name == 'time':
+            value = str(np.datetime_as_string(value, unit='ns')) + 'Z'
+        elif name == 'action':
+            value = ACTIONS[int(value)]
+        elif isinstance(value, bytes):
+            value = value.decode()
+        elif isinstance(value, np.floating):
+            value = None if np.isnan(value) else float(value)
+        else:
+            value = value.item()
+        fields[name] = value
+    return json.dumps(fields)
+
+
+def is_binary(path: str) -> bool:
+    """Returns True if `path` is a binary journal."""
+    return path.endswith(BINARY_EXTENSION)
+
+
+class JournalWriter:
+    """
+    Appends records to a journal in batches. Use as a context manager, or call `close`, so
+    the last batch is written.
+    """
+
+    def __init__(self, path: str, batch_size: int = 64):
+        """
+        :param path: Journal file, binary for a `.bin` extension and JSON Lines otherwise.
+        :param batch_size: Number of records held before they are written.
+        """
+        self.path = path
+        self.binary = is_binary(path)
+        self.batch_size = batch_size
+        self._pending = []
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.binary and not os.path.exists(path + META_SUFFIX):
+            with open(path + META_SUFFIX, 'w') as file:
+                json.dump({'dtype': RECORD_DTYPE.descr}, file, indent=4)
+
+    def append(self, record: dict):
+        """Add a record (see `journal_record`), writing the batch once it is full."""
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending records with one append."""
+        if not self._pending:
+            return
+        records = to_records(self._pending)
+        if self.binary:
+            data = records.tobytes()
+        else:
+            data = ''.join(json_record(record) + '\n' for record in records).encode()
+
+        # O_APPEND keeps concurrent writers from overwriting each other's records
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(descriptor, data)
+        finally:
+            os.close(descriptor)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def read_journal(path: str) -> np.ndarray:
+    """
+    Read a journal as a structured array of RECORD_DTYPE.
+
+    :param path: Journal file.
+    :return: The records in the order they were written, memory-mapped for binary journals.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+
+    if is_binary(path):
+        with open(path + META_SUFFIX) as file:
+            dtype = np.dtype([tuple(field) for field in json.load(file)['dtype']])
+        # A record cut short by an interrupted write is left out
+        rows = os.path.getsize(path) // dtype.itemsize
+        return np.memmap(path, dtype=dtype, mode='r', shape=(rows,)) if rows else np.zeros(0, dtype=dtype)
+
+    records = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record['time'] = np.datetime64(record['time'].rstrip('Z'), 'ns')
+            record['action'] = ACTION_CODES[record['action']]
+            records.append(record)
+    return to_records(records)
+
+
+#___Unit Testing____#
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        """Set up the output variables of a buy and a hold."""
+        import tempfile
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.buy = {
+            'rate_given': 'EURGBP', 'trade_action': 'buy', 'interval': '2m', 'data_size': 100, 'forecast_size': 33,
+            'price_spread': 1e-4, 'forecast_closing_rates': [0.82, 0.84, 0.86], 'RATE_OPENING': 0.83,
+            'EXPECTED_CLOSING_RATE': 0.84, 'investment_amount': 1000.0, 'expected_profit': 12.5,
+            'max_possible_loss': -12.0, 'rate_loss_threshold (>)': 0.8, 'rate_profit_threshold (<)': 0.9,
+        }
+        self.hold = {key: value for key, value in self.buy.items() if not key.startswith(('rate_', 'investment', 'expected', 'max'))}
+        self.hold.update(rate_given='USDZAR', trade_action='hold')
+
+    def test_round_trip(self):
+        """Test that both formats read back the records written, over several batches."""
+        for name in ('journal.jsonl', 'journal.bin'):
+            path = os.path.join(self.root, name)
+            with JournalWriter(path, batch_size=3) as writer:
+                for indx in range(10):
+                    writer.append(journal_record(self.buy if indx % 2 else self.hold, decision_time=indx))
+
+            records = read_journal(path)
+            self.assertEqual(len(records), 10)
+            self.assertEqual(records['pair'][:2].tolist(), [b'USDZAR', b'EURGBP'])
+            self.assertEqual(records['action'][:2].tolist(), [ACTION_CODES['hold'], ACTION_CODES['buy']])
+            self.assertEqual(records['time'][3], np.datetime64(3, 'ns'))
+            self.assertEqual(records['rate_profit_threshold'][1], 0.9)
+            self.assertTrue(np.isnan(records['expected_profit'][0]))
+
+    def test_append(self):
+        """Test that writers append to an existing journal."""
+        path = os.path.join(self.root, 'journal.bin')
+        for _ in range(2):
+            with JournalWriter(path) as writer:
+                writer.append(journal_record(self.buy))
+        self.assertEqual(len(read_journal(path)), 2)
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -0,0 +1,375 @@
+import math
+import unittest
+import numpy as np
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+
+class _Fenwick:
+    """
+    Prefix sums of a list of numbers, updated and queried in O(log n).
+    """
+
+    def __init__(self, values=()):
+        self.build(values)
+
+    def build(self, values):
+        """Replace the numbers, in O(n)."""
+        values = np.asarray(values)
+        prefix = np.concatenate([np.zeros(1, dtype=values.dtype), np.cumsum(values)])
+        positions = np.arange(1, len(values) + 1)
+        # Node i holds the sum of the numbers i - lowbit(i) .. i - 1
+        self.tree = [0] + (prefix[positions] - prefix[positions - (positions & -positions)]).tolist()
+
+    def add(self, indx, delta):
+        """Add delta to the number at indx."""
+        indx += 1
+        while indx < len(self.tree):
+            self.tree[indx] += delta
+            indx += indx & -indx
+
+    def prefix(self, indx):
+        """Sum of the numbers before indx."""
+        total = 0
+        while indx > 0:
+            total += self.tree[indx]
+            indx -= indx & -indx
+        return total
+
+
+class _SortedBlocks:
+    """
+    A sorted multiset of floats kept as a list of sorted blocks, each with its sum.
+
+    Adding or removing a value touches one block, and the count and sum of the values
+    below a bound touch one block plus the prefix counts and sums of the blocks before it,
+    kept in Fenwick trees. Splitting or dropping a block rebuilds the trees, once every
+    `block_size` changes at most, and the tree of sums is rebuilt from the exact block sums
+    once every `len(blocks)` changes so rounding does not build up: both cost O(1) per change
+    on average.
+    """
+
+    def __init__(self, block_size=256):
+        self.block_size = block_size
+        self.blocks = []
+        self.maxes = []
+        self.sums = []
+        self.size = 0
+        self._rebuild()
+
+    def build(self, values):
+        """Replace the contents with the given values."""
+        values = np.sort(np.asarray(values, dtype=np.float64)).tolist()
+        self.blocks = [values[i:i + self.block_size] for i in range(0, len(values), self.block_size)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.sums = [math.fsum(block) for block in self.blocks]
+        self.size = len(values)
+        self._rebuild()
+
+    def _rebuild(self):
+        self._counts = _Fenwick(np.array([len(block) for block in self.blocks], dtype=np.int64))
+        self._totals = _Fenwick(np.array(self.sums, dtype=np.float64))
+        self._changes = 0
+
+    def _changed(self, indx, count, old_sum):
+        # One value more or less in block indx
+        self._changes += 1
+        if self._changes > len(self.blocks):
+            self._rebuild()
+            return
+        self._counts.add(indx, count)
+        self._totals.add(indx, self.sums[indx] - old_sum)
+
+    def add(self, value):
+        if not self.blocks:
+            self.build([value])
+            return
+
+        indx = min(bisect_left(self.maxes, value), len(self.blocks) - 1)
+        block = self.blocks[indx]
+        insort(block, value)
+        self.maxes[indx] = block[-1]
+        self.size += 1
+
+        # Split blocks that grew too large so inserts stay cheap
+        if len(block) > 2 * self.block_size:
+            half = len(block) // 2
+            self.blocks[indx:indx + 1] = [block[:half], block[half:]]
+            self.maxes[indx:indx + 1] = [block[half - 1], block[-1]]
+            self.sums[indx:indx + 1] = [math.fsum(block[:half]), math.fsum(block[half:])]
+            self._rebuild()
+        else:
+            old_sum, self.sums[indx] = self.sums[indx], math.fsum(block)
+            self._changed(indx, 1, old_sum)
+
+    def remove(self, value):
+        indx = bisect_left(self.maxes, value)
+        block = self.blocks[indx]
+        del block[bisect_left(block, value)]
+        self.size -= 1
+
+        if block:
+            self.maxes[indx] = block[-1]
+            old_sum, self.sums[indx] = self.sums[indx], math.fsum(block)
+            self._changed(indx, -1, old_sum)
+        else:
+            del self.blocks[indx], self.maxes[indx], self.sums[indx]
+            self._rebuild()
+
+    def below(self, bound, inclusive=False):
+        """Count and sum of the values below bound (or equal to it if inclusive)."""
+        search = bisect_right if inclusive else bisect_left
+        indx = search(self.maxes, bound)
+
+        count = self._counts.prefix(indx)
+        total = self._totals.prefix(indx)
+        if indx < len(self.blocks):
+            block = self.blocks[indx]
+            position = search(block, bound)
+            count += position
+            total += math.fsum(block[:position])
+
+        return count, total
+
+
+class OnlineDistribution:
+    """
+    An incrementally updated distribution of the first order differences of a series,
+    giving the same forecast as `forecastData` with the default standard deviation bins.
+
+    New closes are added one at a time or in batches. The mean and variance of the differences
+    are updated with Welford's method and the differences are kept in a sorted block structure,
+    so the count and sum of each bin come from a few binary searches instead of a rescan.
+    With a `window`, only the last `window` closes are part of the distribution.
+    """
+
+    def __init__(self, data=None, window=None, block_size=256):
+        """
+        Initialize the distribution with optional data.
+
+        Args:
+            data (array-like, optional): Initial closes of the series. Defaults to None.
+            window (int, optional): Number of most recent closes kept. Defaults to None, keeping every close.
+            block_size (int, optional): Size of the sorted blocks holding the differences. Defaults to 256.
+        """
+        if window is not None and window < 2:
+            raise ValueError('The window must hold at least 2 closes.')
+
+        self.window = window
+        self.diffs = deque()
+        self.sorted_diffs = _SortedBlocks(block_size)
+        self.last_close = None
+        self.previous_close = None
+        self.mean = 0.0
+        self.m2 = 0.0
+
+        if data is not None:
+            self.update(data)
+
+    @property
+    def size(self):
+        """Number of closes in the distribution."""
+        return len(self.diffs) + 1 if self.last_close is not None else 0
+
+    def _add_diff(self, diff):
+        self.diffs.append(diff)
+        self.sorted_diffs.add(diff)
+
+        delta = diff - self.mean
+        self.mean += delta / len(self.diffs)
+        self.m2 += delta * (diff - self.mean)
+
+    def _expire_diff(self):
+        diff = self.diffs.popleft()
+        self.sorted_diffs.remove(diff)
+        self._remove_moments(diff)
+
+    def _remove_moments(self, diff):
+        count = len(self.diffs)
+        if count == 0:
+            self.mean, self.m2 = 0.0, 0.0
+            return
+        delta = diff - self.mean
+        self.mean -= delta / count
+        self.m2 = max(self.m2 - delta * (diff - self.mean), 0.0)
+
+    def add(self, close):
+        """
+        Add one close to the distribution, expiring the oldest one if the window is full.
+
+        Args:
+            close (float): The new close of the series.
+        """
+        close = float(close)
+        if self.last_close is not None:
+            self._add_diff(close - self.last_close)
+            if self.window is not None and len(self.diffs) > self.window - 1:
+                self._expire_diff()
+        self.previous_close, self.last_close = self.last_close, close
+
+    def replace_last(self, close):
+        """
+        Correct the last close, e.g. once the bar that was still forming when it was added has closed.
+
+        Args:
+            close (float): The corrected close of the series.
+        """
+        close = float(close)
+        if self.diffs and self.previous_close is not None:
+            diff = self.diffs.pop()
+            self.sorted_diffs.remove(diff)
+            self._remove_moments(diff)
+            self._add_diff(close - self.previous_close)
+        self.last_close = close
+
+    def update(self, closes):
+        """
+        Add a batch of closes to the distribution.
+
+        Args:
+            closes (float or array-like): New closes of the series, oldest first.
+        """
+        closes = np.atleast_1d(np.asarray(closes, dtype=np.float64))
+        if self.window is not None:
+            closes = closes[-self.window:]
+
+        # An empty distribution is built in one pass from the batch
+        if self.last_close is None and len(closes) > 1:
+            diffs = np.diff(closes)
+            self.diffs = deque(diffs.tolist())
+            self.sorted_diffs.build(diffs)
+            self.mean = float(np.mean(diffs))
+            self.m2 = float(np.var(diffs) * len(diffs))
+            self.previous_close, self.last_close = float(closes[-2]), float(closes[-1])
+            return
+
+        for close in closes.tolist():
+            self.add(close)
+
+    def std(self):
+        """Population standard deviation of the differences."""
+        return math.sqrt(self.m2 / len(self.diffs)) if self.diffs else 0.0
+
+    def distribution(self):
+        """
+        Compute the bins of the differences around their mean.
+
+        Returns:
+            tuple:
+                distribution (list): Bin edges [mean - std, mean, mean + std].
+                bins_count (list): Count of the differences in the lower and upper bin.
+                bins_mean (list): Mean of the differences in the lower and upper bin.
+                absolute_frequency (list): Absolute frequency of the lower and upper bin.
+                relative_frequency (list): Relative frequency of the lower and upper bin.
+        """
+        mean, std = self.mean, self.std()
+        distribution = [mean - std, mean, mean + std]
+
+        # Both bins include their edges, as in DataMod.binCounts
+        count_low, sum_low = self.sorted_diffs.below(distribution[0])
+        count_mid_below, sum_mid_below = self.sorted_diffs.below(distribution[1])
+        count_mid, sum_mid = self.sorted_diffs.below(distribution[1], inclusive=True)
+        count_high, sum_high = self.sorted_diffs.below(distribution[2], inclusive=True)
+
+        bins_count = [count_mid - count_low, count_high - count_mid_below]
+        bins_sum = [sum_mid - sum_low, sum_high - sum_mid_below]
+        bins_mean = [total / count if count else math.nan for total, count in zip(bins_sum, bins_count)]
+
+        size_data = len(self.diffs)
+        size_data_in_range = count_high - count_low
+        absolute_frequency = [count / size_data if size_data else 0 for count in bins_count]
+        relative_frequency = [count / size_data_in_range if size_data_in_range else 0 for count in bins_count]
+
+        return distribution, bins_count, bins_mean, absolute_frequency, relative_frequency
+
+    def forecast(self, from_value=None, size_forecast=None, use_relative_frequency=False):
+        """
+        Forecast the series from the current distribution, as `forecastData` does over the same closes.
+
+        Args:
+            from_value (float, optional): Starting point for forecast. Defaults to the last close.
+            size_forecast (int, optional): Number of steps to forecast. Defaults to the number of closes.
+            use_relative_frequency (bool, optional): Whether to use relative frequencies in the forecast. Defaults to False.
+
+        Returns:
+            list: A list containing the forecasted lower bound, expected value, and upper bound.
+        """
+        from_value = self.last_close if from_value is None else from_value
+        size_forecast = self.size if size_forecast is None else size_forecast
+
+        _, _, bins_mean, absolute_frequency, relative_frequency = self.distribution()
+        probability = relative_frequency if use_relative_frequency else absolute_frequency
+
+        diff_expectation = size_forecast * (bins_mean[0] * probability[0] + bins_mean[1] * probability[1])
+
+        return [from_value + bins_mean[0] * size_forecast, from_value + diff_expectation, from_value + bins_mean[1] * size_forecast]
+
+
+#___Unit Testing____#
+class TestOnlineDistribution(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a random walk quantised like forex closes."""
+        steps = np.random.default_rng(1).normal(scale=2e-4, size=3000)
+        self.closes = np.round(1.1 + np.cumsum(steps), 5)
+
+    def test_forecast_matches_forecastData(self):
+        """Test that ticks fed one at a time give the same forecast as forecastData."""
+        from Modules.Forecast import forecastData
+
+        online = OnlineDistribution(self.closes[:2000])
+        for close in self.closes[2000:]:
+            online.add(close)
+
+        expected = forecastData(self.closes.tolist(), size_forecast=500)
+        np.testing.assert_allclose(online.forecast(size_forecast=500), expected, rtol=1e-9)
+
+    def test_window(self):
+        """Test that a fixed-length window forecasts like forecastData over the trailing closes."""
+        from Modules.Forecast import forecastData
+
+        online = OnlineDistribution(window=1000)
+        online.update(self.closes[:1500])
+        online.update(self.closes[1500:1700])
+        for close in self.closes[1700:]:
+            online.add(close)
+
+        self.assertEqual(online.size, 1000)
+        expected = forecastData(self.closes[-1000:].tolist(), use_relative_frequency=True)
+        np.testing.assert_allclose(online.forecast(use_relative_frequency=True), expected, rtol=1e-9)
+
+    def test_replace_last(self):
+        """Test that correcting the last close gives the distribution of the corrected closes."""
+        from Modules.Forecast import forecastData
+
+        online = OnlineDistribution(self.closes[:1000], window=500)
+        online.replace_last(self.closes[999] + 3e-4)
+        online.add(self.closes[1000])
+        online.replace_last(self.closes[1000] - 2e-4)
+
+        corrected = self.closes[501:1001].copy()
+        corrected[-2] += 3e-4
+        corrected[-1] -= 2e-4
+        self.assertEqual(online.size, 500)
+        np.testing.assert_allclose(online.forecast(size_forecast=100), forecastData(corrected.tolist(), size_forecast=100), rtol=1e-9)
+
+    def test_small_blocks(self):
+        """Test that ticks through many block splits and drops keep the forecast of forecastData."""
+        from Modules.Forecast import forecastData
+
+        online = OnlineDistribution(self.closes[:500], window=500, block_size=8)
+        for close in self.closes[500:]:
+            online.add(close)
+            online.distribution()
+
+        expected = forecastData(self.closes[-500:].tolist(), size_forecast=100)
+        np.testing.assert_allclose(online.forecast(size_forecast=100), expected, rtol=1e-9)
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -0,0 +1,262 @@
+import unittest
+import numpy as np
+from Modules.Trade import ACTIONS, HOLD, profit_factor
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+PORTFOLIO PROFIT DISTRIBUTION
+-----------------------------
+The profit of many open positions taken together, over the joint historical moves of their pairs.
+
+Every scenario is one start time t of the price matrix (see `Modules.PriceMatrix`): each position
+closes at its opening rate moved by the log change of its pair from t to t + its horizon. All pairs
+move over the same stretch of history, so correlated pairs gain and lose together.
+
+    scenarios x positions     profit of every position in every scenario (see `Trade.profit_factor`)
+    scenarios                 portfolio profit, the sum over the positions
+
+With a forecast, the moves of a position are centred on it: its mean closing rate is the forecast
+and the history only gives the spread around it.
+
+A position held in the inverse of a stored pair (e.g. GBPEUR for a stored EURGBP) moves by the
+negated log change.
+"""
+
+# Fields of a position. Horizons are in bars of the price matrix, forecasts are NaN where there is none.
+POSITION_DTYPE = np.dtype([
+    ('pair', 'U8'),                     # e.g. 'EURGBP'
+    ('action', 'i1'),                   # SELL or BUY
+    ('investment_amount', 'f8'),        # In the investment currency, profits are in it too
+    ('opening_rate', 'f8'),             # Sell rate when the position was opened
+    ('spread', 'f8'),
+    ('borrowing_fee', 'f8'),
+    ('horizon', 'i8'),
+    ('forecast', 'f8'),                 # Expected closing rate
+])
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+LOSS_QUANTILE = 0.05
+
+
+def positions(pairs, actions, investment_amounts, opening_rates, spreads, borrowing_fees=0, horizons=1, forecasts=np.nan) -> np.ndarray:
+    """
+    Structured array of positions, every argument broadcast against the pairs.
+
+    :param pairs: Pair name of every position.
+    :param actions: SELL or BUY of every position.
+    :param investment_amounts: Amount invested in every position.
+    :param opening_rates: Sell rate when every position was opened.
+    :param spreads: Spread when every position was opened.
+    :param borrowing_fees: Fee on the borrowed amount of sells.
+    :param horizons: Number of bars every position is held.
+    :param forecasts: Expected closing rate of every position, NaN for none.
+    :return: Array of POSITION_DTYPE.
+    """
+    array = np.zeros(len(pairs), dtype=POSITION_DTYPE)
+    fields = (pairs, actions, investment_amounts, opening_rates, spreads, borrowing_fees, horizons, forecasts)
+    for name, values in zip(POSITION_DTYPE.names, fields):
+        array[name] = values
+    return array
+
+
+def positions_from_outputs(outputs: dict) -> np.ndarray:
+    """
+    Positions of the trades decided by a run of main_trade.
+
+    :param outputs: Output variables of every pair, as returned by `main_trade.run_pairs`. Holds and errors are left out.
+    :return: Array of POSITION_DTYPE, the forecast size as the horizon.
+    """
+    codes = {action: code for code, action in ACTIONS.items()}
+    traded = [
+        output for output in outputs.values()
+        if output and 'error' not in output and codes[output['trade_action']] != HOLD
+    ]
+    return positions(
+        [output['rate_given'] for output in traded],
+        [codes[output['trade_action']] for output in traded],
+        [output['investment_amount'] for output in traded],
+        [output['RATE_OPENING'] for output in traded],
+        [output['price_spread'] for output in traded],
+        [output.get('borrowing_fee') or 0 for output in traded],
+        [output['forecast_size'] for output in traded],
+        [output['EXPECTED_CLOSING_RATE'] for output in traded],
+    )
+
+
+def pair_columns(matrix_pairs: list, pairs) -> tuple:
+    """
+    Columns of the price matrix the pairs move with.
+
+    :param matrix_pairs: Pair names of the matrix columns.
+    :param pairs: Pair names of the positions.
+    :return: Tuple of (column of every pair, +1 for a stored pair or -1 for the inverse of one).
+    """
+    columns = {pair: indx for indx, pair in enumerate(matrix_pairs)}
+    column, sign = np.zeros(len(pairs), dtype=np.int64), np.ones(len(pairs))
+    for indx, pair in enumerate(pairs):
+        inverse = pair[len(pair) // 2:] + pair[:len(pair) // 2]
+        if pair in columns:
+            column[indx] = columns[pair]
+        elif inverse in columns:
+            column[indx], sign[indx] = columns[inverse], -1
+        else:
+            raise KeyError(f'No prices of {pair} or {inverse} in the matrix.')
+    return column, sign
+
+
+def scenario_returns(prices: np.ndarray, columns: np.ndarray, horizons: np.ndarray) -> np.ndarray:
+    """
+    Joint log changes of the positions over every stretch of the history.
+
+    :param prices: Prices of shape (time, pair), see `PriceMatrix.values`.
+    :param columns: Column of every position.
+    :param horizons: Number of bars of every position.
+    :return: Array of shape (scenarios, positions). Scenarios where a position has no price are left out.
+    """
+    log_prices = np.log(np.asarray(prices, dtype=np.float64))
+    horizons = np.asarray(horizons, dtype=np.int64)
+    starts = np.arange(len(log_prices) - horizons.max()) if len(horizons) else np.zeros(0, dtype=np.int64)
+
+    returns = log_prices[starts[:, None] + horizons, columns] - log_prices[starts[:, None], columns]
+    return returns[~np.isnan(returns).any(axis=1)]
+
+
+def profit_scenarios(positions: np.ndarray, returns: np.ndarray, signs=1) -> np.ndarray:
+    """
+    Profit of every position in every scenario.
+
+    :param positions: Array of POSITION_DTYPE.
+    :param returns: Log changes of shape (scenarios, positions), see `scenario_returns`.
+    :param signs: -1 for positions in the inverse of the pair of their returns, see `pair_columns`.
+    :return: Array of shape (scenarios, positions).
+    """
+    returns = returns * signs
+    forecast = positions['forecast']
+
+    # With a forecast the moves are centred so the mean closing rate is the forecast
+    centred = ~np.isnan(forecast)
+    base = np.where(centred, forecast, positions['opening_rate'])
+    shift = np.where(centred, np.log(np.mean(np.exp(returns), axis=0)) if len(returns) else 0, 0)
+    closing_rates = base * np.exp(returns - shift)
+
+    factor = profit_factor(closing_rates, positions['opening_rate'], positions['spread'], positions['action'], positions['borrowing_fee'])
+    return positions['investment_amount'] * factor
+
+
+def evaluate_portfolio(positions: np.ndarray, matrix, quantiles=QUANTILES, loss_quantile: float = LOSS_QUANTILE) -> dict:
+    """
+    Joint profit distribution of open positions.
+
+    :param positions: Array of POSITION_DTYPE.
+    :param matrix: PriceMatrix of the pairs of the positions, or of their inverses.
+    :param quantiles: Quantiles of the portfolio profit reported.
+    :param loss_quantile: Quantile of the quantile loss and expected shortfall.
+    :return: Dict of the expected profit, profit quantiles, quantile loss (the profit at `loss_quantile`),
+        expected shortfall (the mean profit below it), worst scenario, and the expected profit and
+        shortfall contribution of every position. The contributions of the positions add up to the totals.
+    """
+    columns, signs = pair_columns(matrix.pairs, positions['pair'])
+    returns = scenario_returns(matrix.values, columns, positions['horizon'])
+    if len(returns) == 0:
+        raise ValueError('The price matrix is shorter than the longest horizon of the positions.')
+
+    profits = profit_scenarios(positions, returns, signs)
+    total = profits.sum(axis=1)
+
+    quantile_loss = float(np.quantile(total, loss_quantile))
+    tail = total <= quantile_loss
+    contributions = profits.mean(axis=0)
+    tail_contributions = profits[tail].mean(axis=0)
+
+    return {
+        'scenarios': len(total),
+        'expected_profit': float(total.mean()),
+        'profit_quantiles': {str(quantile): float(value) for quantile, value in zip(quantiles, np.quantile(total, quantiles))},
+        'loss_quantile': loss_quantile,
+        'quantile_loss': quantile_loss,
+        'expected_shortfall': float(total[tail].mean()),
+        'max_possible_loss': float(total.min()),
+        'positions': [
+            {
+                'pair': str(position['pair']),
+                'action': ACTIONS[int(position['action'])],
+                'expected_profit': float(contribution),
+                'shortfall_contribution': float(tail_contribution),
+            }
+            for position, contribution, tail_contribution in zip(positions, contributions, tail_contributions)
+        ],
+    }
+
+
+#___Unit Testing____#
+class TestPortfolio(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a matrix of two correlated pairs and an independent one."""
+        from Modules.PriceMatrix import PriceMatrix
+
+        rng = np.random.default_rng(2)
+        size = 5000
+        common, own = rng.normal(0, 1e-3, size), rng.normal(0, 1e-3, (size, 3))
+        steps = np.stack([common + 0.2 * own[:, 0], common + 0.2 * own[:, 1], own[:, 2]], axis=1)
+        index = np.datetime64('2024-10-01', 'ns') + np.arange(size).astype('timedelta64[m]')
+        self.matrix = PriceMatrix(index, np.exp(np.cumsum(steps, axis=0)), ['EURUSD', 'GBPUSD', 'USDZAR'])
+
+    def test_scenarios(self):
+        """Test that profits match profit_factor on the closes of every stretch of history."""
+        from Modules.Trade import SELL, BUY
+
+        book = positions(['EURUSD', 'USDGBP'], [BUY, SELL], [1000, 500], [1.0, 0.9], [1e-4, 2e-4], [0, 0.001], [30, 10])
+        columns, signs = pair_columns(self.matrix.pairs, book['pair'])
+        profits = profit_scenarios(book, scenario_returns(self.matrix.values, columns, book['horizon']), signs)
+
+        prices = self.matrix.values
+        start = 123
+        eur = 1.0 * prices[start + 30, 0] / prices[start, 0]
+        gbp = 0.9 * prices[start, 1] / prices[start + 10, 1]
+        self.assertAlmostEqual(profits[start, 0], 1000 * profit_factor(eur, 1.0, 1e-4, BUY))
+        self.assertAlmostEqual(profits[start, 1], 500 * profit_factor(gbp, 0.9, 2e-4, SELL, 0.001))
+
+    def test_correlation(self):
+        """Test that offsetting positions in correlated pairs have a smaller shortfall than the same positions in independent ones."""
+        from Modules.Trade import SELL, BUY
+
+        hedged = positions(['EURUSD', 'GBPUSD'], [BUY, SELL], 1000, 1.0, 0, horizons=60)
+        unhedged = positions(['EURUSD', 'USDZAR'], [BUY, SELL], 1000, 1.0, 0, horizons=60)
+
+        hedged, unhedged = evaluate_portfolio(hedged, self.matrix), evaluate_portfolio(unhedged, self.matrix)
+        self.assertGreater(hedged['quantile_loss'], unhedged['quantile_loss'])
+        for result in (hedged, unhedged):
+            self.assertAlmostEqual(sum(position['expected_profit'] for position in result['positions']), result['expected_profit'])
+            self.assertAlmostEqual(sum(position['shortfall_contribution'] for position in result['positions']), result['expected_shortfall'])
+
+    def test_forecast(self):
+        """Test that a forecast sets the mean closing rate of its position."""
+        from Modules.Trade import BUY
+
+        book = positions(['EURUSD'], [BUY], 1000, 1.0, 0, horizons=100, forecasts=1.01)
+        columns, signs = pair_columns(self.matrix.pairs, book['pair'])
+        profits = profit_scenarios(book, scenario_returns(self.matrix.values, columns, book['horizon']), signs)
+        self.assertAlmostEqual(profits.mean(), 1000 * profit_factor(1.01, 1.0, 0, BUY))
+
+    def test_many_positions(self):
+        """Test that many positions in stored and inverse pairs are evaluated together."""
+        from Modules.Trade import SELL, BUY
+
+        rng = np.random.default_rng(0)
+        size = 50
+        book = positions(
+            rng.choice(['EURUSD', 'GBPUSD', 'USDZAR', 'ZARUSD'], size), rng.choice([SELL, BUY], size),
+            rng.uniform(100, 5000, size), rng.uniform(0.9, 1.1, size), 1e-4, horizons=rng.integers(1, 500, size)
+        )
+        result = evaluate_portfolio(book, self.matrix)
+        self.assertEqual(len(result['positions']), size)
+        self.assertEqual(result['scenarios'], len(self.matrix.values) - book['horizon'].max())
+        self.assertAlmostEqual(sum(position['expected_profit'] for position in result['positions']), result['expected_profit'])
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
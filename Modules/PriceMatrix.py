@@ -0,0 +1,311 @@
+import os
+import json
+import unittest
+import numpy as np
+from Modules.PriceStore import INDEX_COLUMN, write_meta
+from Modules.Resample import interval_history
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+PRICE MATRIX
+------------
+The histories of many pairs aligned on one time index, as a (time x pair) array:
+
+                        EURGBP     GBPUSD     USDZAR
+    2024-10-21 08:00    0.8321     1.2993     17.612
+    2024-10-21 08:01    0.8322     1.2991     NaN        <- no USDZAR bar yet
+
+The index is the union of the timestamps of every pair. A pair without a bar at a timestamp holds
+its last price before it (or NaN before its first bar), or NaN when `fill` is off. Rows are
+contiguous, so a time range is a view found by binary search on the index.
+
+A matrix is saved as a directory of `.npy` files, which are memory-mapped when loaded:
+
+    Prices_1m/
+        Datetime.npy    datetime64[ns], UTC
+        values.npy      float64, (time, pair)
+        meta.json       pairs, column, interval, and the rows and last bar of every source history
+
+Worker processes share a saved matrix without copying it: pickling a loaded matrix sends its
+directory, and the worker maps the same files.
+"""
+
+VALUES_FILE = 'values.npy'
+META_FILE = 'meta.json'
+
+
+def matrix_path(root: str, interval: str) -> str:
+    """Directory of the saved price matrix of an interval under `root`."""
+    return os.path.join(root, f'Prices_{interval}')
+
+
+def align(histories: dict, column: str = 'Close', fill: bool = True) -> tuple:
+    """
+    Align the histories of many pairs on the union of their timestamps.
+
+    :param histories: Mapping of pair name to history, as returned by `load_arrays`.
+    :param column: Column of the histories to align.
+    :param fill: If True, a pair without a bar at a timestamp holds its last price before it.
+    :return: Tuple of (index as datetime64[ns], values as a (time, pair) float64 array).
+    """
+    indexes = [np.asarray(history[INDEX_COLUMN], dtype='datetime64[ns]') for history in histories.values()]
+    index = np.unique(np.concatenate(indexes)) if indexes else np.zeros(0, dtype='datetime64[ns]')
+
+    values = np.full((len(index), len(histories)), np.nan)
+    for indx, (pair_index, history) in enumerate(zip(indexes, histories.values())):
+        prices = np.asarray(history[column], dtype=np.float64)
+        if fill:
+            # Last bar at or before every timestamp of the index
+            last = np.searchsorted(pair_index, index, side='right') - 1
+            values[:, indx] = np.where(last >= 0, prices[np.maximum(last, 0)], np.nan)
+        else:
+            values[np.searchsorted(index, pair_index), indx] = prices
+
+    return index, values
+
+
+class PriceMatrix:
+    """
+    Prices of many pairs on one time index.
+    """
+
+    def __init__(self, index, values, pairs: list, column: str = 'Close', interval: str = None, path: str = None,
+                 offset: int = 0):
+        """
+        :param index: Timestamps of the rows, datetime64[ns] UTC, ascending.
+        :param values: Array of shape (time, pair).
+        :param pairs: Pair names of the columns (e.g. ['EURGBP', 'USDZAR']).
+        :param column: History column the prices are taken from.
+        :param interval: Interval of the bars (e.g. '1m').
+        :param path: Directory the matrix is saved in, if its arrays are mapped from it.
+        :param offset: Row of the saved matrix the first row of this one is.
+        """
+        self.index = index
+        self.values = values
+        self.pairs = list(pairs)
+        self.column = column
+        self.interval = interval
+        self.path = path
+        self.offset = offset
+        self._columns = {pair: indx for indx, pair in enumerate(self.pairs)}
+
+        if values.shape != (len(index), len(self.pairs)):
+            raise ValueError(f'Values of shape {values.shape} do not match {len(index)} rows and {len(self.pairs)} pairs.')
+
+    @classmethod
+    def from_histories(cls, histories: dict, column: str = 'Close', fill: bool = True, interval: str = None):
+        """
+        Matrix of pair histories held in memory.
+
+        :param histories: Mapping of pair name to history, as returned by `load_arrays`.
+        :param column: Column of the histories to align.
+        :param fill: If True, gaps hold the last price of the pair, see `align`.
+        :param interval: Interval of the histories.
+        """
+        index, values = align(histories, column, fill)
+        return cls(index, values, list(histories), column, interval)
+
+    @classmethod
+    def from_directory(cls, root: str, interval: str, column: str = 'Close', fill: bool = True, save: bool = True):
+        """
+        Matrix of the stored histories of every `Trade_of_X_Y` folder of a directory.
+
+        The matrix saved under `root` (see `matrix_path`) is loaded while every history it was built
+        from is unchanged, otherwise it is built again and, if `save`, saved in its place.
+
+        :param root: Directory holding the trade folders (e.g. 'Trade_1_day').
+        :param interval: Interval of the histories, resampled from a finer one when not stored.
+        :param column: Column of the histories to align.
+        :param fill: If True, gaps hold the last price of the pair, see `align`.
+        :param save: If True, a rebuilt matrix is saved.
+        """
+        histories, sources = {}, {}
+        for name in sorted(os.listdir(root or '.')):
+            parts = name.split('_')
+            if len(parts) != 4 or not name.startswith('Trade_of_'):
+                continue
+            folder = os.path.join(root, name)
+            try:
+                history = interval_history(folder, parts[2], parts[3], interval)
+            except FileNotFoundError:
+                continue
+            histories[parts[2] + parts[3]] = history
+            # The last bar of a history may be replaced by a later fetch, so its close is part of the state
+            last = len(history[INDEX_COLUMN]) - 1
+            sources[parts[2] + parts[3]] = [last + 1, str(history[INDEX_COLUMN][last]), float(history[column][last])] if last >= 0 else [0]
+
+        path = matrix_path(root, interval)
+        if os.path.isfile(os.path.join(path, META_FILE)):
+            with open(os.path.join(path, META_FILE)) as file:
+                meta = json.load(file)
+            if meta['sources'] == sources and meta['column'] == column and meta['fill'] == fill:
+                return cls.load(path)
+
+        matrix = cls.from_histories(histories, column, fill, interval)
+        if save:
+            matrix.save(path, sources=sources, fill=fill)
+            return cls.load(path)
+        return matrix
+
+    def save(self, path: str, **meta):
+        """
+        Save the matrix as `.npy` files, see the layout above.
+
+        :param path: Directory of the matrix.
+        :param meta: Further fields of meta.json.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name, array in ((f'{INDEX_COLUMN}.npy', self.index), (VALUES_FILE, self.values)):
+            # Written next to the target and renamed, so workers never map a half written file
+            temp = os.path.join(path, f'.{name}.tmp')
+            with open(temp, 'wb') as file:
+                np.save(file, np.ascontiguousarray(array))
+            os.replace(temp, os.path.join(path, name))
+
+        write_meta(path, {'pairs': self.pairs, 'column': self.column, 'interval': self.interval, **meta})
+        self.path, self.offset = path, 0
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Open a saved matrix.
+
+        :param path: Directory of the matrix.
+        :param mmap: If True, the arrays are memory-mapped read only, otherwise read into memory.
+        """
+        with open(os.path.join(path, META_FILE)) as file:
+            meta = json.load(file)
+        mmap_mode = 'r' if mmap else None
+        index = np.load(os.path.join(path, f'{INDEX_COLUMN}.npy'), mmap_mode=mmap_mode)
+        values = np.load(os.path.join(path, VALUES_FILE), mmap_mode=mmap_mode)
+        return cls(index, values, meta['pairs'], meta['column'], meta['interval'], path=path if mmap else None)
+
+    def __reduce__(self):
+        # A mapped matrix is sent to other processes as its directory and rows, which they map again
+        if self.path is not None:
+            return _load_rows, (self.path, self.offset, self.offset + len(self.index))
+        return self.__class__, (np.asarray(self.index), np.asarray(self.values), self.pairs, self.column, self.interval)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    def between(self, start_date=None, end_date=None):
+        """
+        Rows of a time range, as a view of this matrix.
+
+        :param start_date: Earliest timestamp, inclusive (e.g. '2024-10-01' or a datetime64).
+        :param end_date: Latest timestamp, exclusive.
+        :return: PriceMatrix sharing the arrays of this one.
+        """
+        first = 0 if start_date is None else int(np.searchsorted(self.index, np.datetime64(start_date, 'ns'), side='left'))
+        last = len(self.index) if end_date is None else int(np.searchsorted(self.index, np.datetime64(end_date, 'ns'), side='left'))
+        return PriceMatrix(
+            self.index[first:last], self.values[first:last], self.pairs, self.column, self.interval, self.path, self.offset + first
+        )
+
+    def select(self, pairs: list):
+        """Columns of the given pairs, in that order, as a new matrix."""
+        columns = [self._columns[pair] for pair in pairs]
+        return PriceMatrix(self.index, self.values[:, columns], pairs, self.column, self.interval)
+
+    def series(self, pair: str) -> np.ndarray:
+        """Prices of one pair, NaN before its first bar."""
+        return self.values[:, self._columns[pair]]
+
+    def dropna(self):
+        """Rows where every pair has a price."""
+        keep = ~np.isnan(self.values).any(axis=1)
+        return PriceMatrix(self.index[keep], self.values[keep], self.pairs, self.column, self.interval)
+
+
+def _load_rows(path, start, stop):
+    # Counterpart of PriceMatrix.__reduce__
+    matrix = PriceMatrix.load(path)
+    return PriceMatrix(matrix.index[start:stop], matrix.values[start:stop], matrix.pairs, matrix.column, matrix.interval, path, start)
+
+
+#___Unit Testing____#
+class TestPriceMatrix(unittest.TestCase):
+
+    def setUp(self):
+        """Set up stored minute histories of three pairs with different timestamps."""
+        import tempfile
+        from Modules.PriceStore import save_arrays, store_path
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        rng = np.random.default_rng(5)
+        start = np.datetime64('2024-10-21T08:00', 'ns')
+        self.histories = {}
+        for (sell, buy), offset, size in ((('EUR', 'GBP'), 0, 300), (('GBP', 'USD'), 20, 250), (('USD', 'ZAR'), 5, 280)):
+            index = start + np.sort(rng.choice(400, size, replace=False) + offset).astype('timedelta64[m]')
+            close = 1 + np.cumsum(rng.normal(0, 1e-3, size))
+            self.histories[sell + buy] = {INDEX_COLUMN: index, 'Close': close}
+            folder = os.path.join(self.root, f'Trade_of_{sell}_{buy}')
+            save_arrays(store_path(folder, sell, buy, '1m'), index, {'Close': close}, interval='1m')
+
+    def test_align(self):
+        """Test that every cell holds the last price of its pair at or before its timestamp."""
+        matrix = PriceMatrix.from_histories(self.histories)
+        self.assertTrue(np.all(np.diff(matrix.index) > np.timedelta64(0)))
+
+        for pair, history in self.histories.items():
+            for row in range(0, len(matrix), 37):
+                before = history[INDEX_COLUMN] <= matrix.index[row]
+                expected = history['Close'][before][-1] if before.any() else np.nan
+                np.testing.assert_equal(matrix.series(pair)[row], expected)
+
+        unfilled = PriceMatrix.from_histories(self.histories, fill=False)
+        self.assertEqual(np.count_nonzero(~np.isnan(unfilled.values)), sum(len(h['Close']) for h in self.histories.values()))
+
+    def test_between(self):
+        """Test that time ranges are views holding the rows of the range."""
+        matrix = PriceMatrix.from_histories(self.histories)
+        start, end = np.datetime64('2024-10-21T09:00', 'ns'), np.datetime64('2024-10-21T10:30', 'ns')
+
+        view = matrix.between(start, end)
+        keep = (matrix.index >= start) & (matrix.index < end)
+        np.testing.assert_array_equal(view.values, matrix.values[keep])
+        self.assertTrue(np.shares_memory(view.values, matrix.values))
+
+    def test_saved(self):
+        """Test that a saved matrix is reused, rebuilt when a history changes, and pickled by its path."""
+        import pickle
+
+        matrix = PriceMatrix.from_directory(self.root, '1m')
+        self.assertIsInstance(matrix.values, np.memmap)
+        np.testing.assert_array_equal(matrix.values, PriceMatrix.from_histories(self.histories).values)
+
+        modified = os.path.getmtime(os.path.join(matrix.path, VALUES_FILE))
+        self.assertEqual(PriceMatrix.from_directory(self.root, '1m').pairs, ['EURGBP', 'GBPUSD', 'USDZAR'])
+        self.assertEqual(os.path.getmtime(os.path.join(matrix.path, VALUES_FILE)), modified)
+
+        view = matrix.between('2024-10-21T08:30').between('2024-10-21T09:00', '2024-10-21T10:00')
+        sent = pickle.dumps(view)
+        self.assertLess(len(sent), 1024)
+        received = pickle.loads(sent)
+        np.testing.assert_array_equal(received.index, view.index)
+        np.testing.assert_array_equal(received.values, view.values)
+
+        # A fetch replacing the last bar of a history rebuilds the matrix
+        from Modules.PriceStore import save_arrays, store_path
+        history = self.histories['EURGBP']
+        save_arrays(store_path(os.path.join(self.root, 'Trade_of_EUR_GBP'), 'EUR', 'GBP', '1m'), history[INDEX_COLUMN],
+                    {'Close': np.append(history['Close'][:-1], 2.0)}, interval='1m')
+        self.assertEqual(PriceMatrix.from_directory(self.root, '1m').series('EURGBP')[-1], 2.0)
+
+        # Derived intervals are aligned as well
+        self.assertEqual(PriceMatrix.from_directory(self.root, '5m', save=False).shape[1], 3)
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -0,0 +1,532 @@
+import os
+import re
+import json
+import glob
+import unittest
+import numpy as np
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+PRICE STORE LAYOUT
+------------------
+A pair history is stored as a directory holding one `.npy` file per column:
+
+    Trade_of_EUR_GBP/EUR_GBP_2m/
+        Datetime.npy    datetime64[ns], UTC
+        Open.npy        float64
+        High.npy        float64
+        Low.npy         float64
+        Close.npy       float64
+        Volume.npy      int64
+        meta.json       column names, timezone, interval, row count
+
+The `.npy` files are opened with `np.load(..., mmap_mode='r')`, so loading a history
+maps the columns into memory instead of parsing text.
+"""
+
+INDEX_COLUMN = 'Datetime'
+PRICE_COLUMNS = ('Open', 'High', 'Low', 'Close')
+VOLUME_COLUMN = 'Volume'
+COLUMNS = PRICE_COLUMNS + (VOLUME_COLUMN,)
+META_FILE = 'meta.json'
+
+# Fields of meta.json written by save_arrays, any other field is kept by appends (e.g. 'fetched_from')
+STORE_FIELDS = ('columns', 'tz', 'interval', 'rows')
+
+# Utc offsets stored as the timezone of histories without a zone name (e.g. '+01:00')
+UTC_OFFSET = re.compile(r'^(UTC)?[+-]\d\d:\d\d$')
+
+# Zones tried for legacy dumps whose utc offset changes, Yahoo Finance forex bars are in Europe/London
+LEGACY_ZONES = ('Europe/London', 'Europe/Berlin', 'America/New_York', 'Africa/Johannesburg')
+
+# Matches one row of a `str(DataFrame)` dump or a CSV file: timestamp, optional utc offset, then values
+LEGACY_ROW = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)([+-]\d\d:\d\d)?[\s,]+(.*?)[\s\\]*$')
+
+
+def store_path(folder: str, sell_unit: str, buy_unit: str, interval: str) -> str:
+    """
+    Returns the store directory of a pair history for the given interval.
+
+    :param folder: The trade folder of the pair (e.g. 'Trade_of_EUR_GBP/').
+    :param sell_unit: The base currency code (e.g. 'EUR').
+    :param buy_unit: The quote currency code (e.g. 'GBP').
+    :param interval: The bar interval (e.g. '2m').
+    :return: Path of the store directory.
+    """
+    return os.path.join(folder, f'{sell_unit}_{buy_unit}_{interval}')
+
+
+def has_history(path: str) -> bool:
+    """Returns True if a stored history exists at `path`."""
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def period_length(period: str):
+    """
+    Converts a Yahoo Finance period (e.g. '5d', '1mo', '1y') or interval (e.g. '2m', '1h') to a length of time.
+
+    :param period: Period string, 'max' and 'ytd' are not fixed lengths and return None.
+    :return: The length of the period as a np.timedelta64, or None.
+    """
+    if not period or period in ('max', 'ytd'):
+        return None
+
+    units = {'m': (1, 'm'), 'h': (1, 'h'), 'd': (1, 'D'), 'wk': (7, 'D'), 'mo': (30, 'D'), 'y': (365, 'D')}
+    for unit, (size, step) in units.items():
+        if period.endswith(unit) and period[:-len(unit)].isdigit():
+            return np.timedelta64(int(period[:-len(unit)]) * size, step).astype('timedelta64[ns]')
+
+    raise ValueError(f"Unknown period '{period}'.")
+
+
+def read_meta(path: str) -> dict:
+    """Reads the metadata of a stored history."""
+    with open(os.path.join(path, META_FILE)) as file:
+        return json.load(file)
+
+
+def write_meta(path: str, meta: dict):
+    """Writes the metadata of a stored history next to it and renames it, so readers never see a partial file."""
+    temp = os.path.join(path, f'.{META_FILE}.tmp')
+    with open(temp, 'w') as file:
+        json.dump(meta, file, indent=4)
+    os.replace(temp, os.path.join(path, META_FILE))
+
+
+def _save_npy(path: str, name: str, array: np.ndarray):
+    # Write next to the target and rename, so readers never map a half written file
+    target = os.path.join(path, f'{name}.npy')
+    temp = os.path.join(path, f'.{name}.npy.tmp')
+    with open(temp, 'wb') as file:
+        np.save(file, array)
+    os.replace(temp, target)
+
+
+def save_arrays(path: str, index, columns: dict, tz: str = None, interval: str = None, overwrite: bool = True,
+                meta: dict = None) -> bool:
+    """
+    Saves a history given as arrays to the store.
+
+    :param path: Store directory of the history.
+    :param index: Timestamps of the bars, converted to datetime64[ns] UTC.
+    :param columns: Mapping of column name to values. Volume is stored as int64, prices as float64.
+    :param tz: Timezone name or utc offset used when the history is loaded as a DataFrame.
+    :param interval: Bar interval of the history (e.g. '2m').
+    :param overwrite: If False, an existing history is left untouched.
+    :param meta: Further fields of meta.json.
+    :return: True if the history was written.
+    """
+    if has_history(path) and not overwrite:
+        return False
+
+    os.makedirs(path, exist_ok=True)
+
+    index = np.asarray(index, dtype='datetime64[ns]')
+    written = []
+    for name in COLUMNS:
+        if name not in columns:
+            continue
+        dtype = np.int64 if name == VOLUME_COLUMN else np.float64
+        values = np.ascontiguousarray(columns[name], dtype=dtype)
+        if len(values) != len(index):
+            raise ValueError(f'Column {name} has {len(values)} rows, index has {len(index)}.')
+        _save_npy(path, name, values)
+        written.append(name)
+
+    _save_npy(path, INDEX_COLUMN, index)
+
+    write_meta(path, {'columns': written, 'tz': tz, 'interval': interval, 'rows': int(len(index)), **(meta or {})})
+
+    return True
+
+
+def history_arrays(price_data) -> tuple:
+    """
+    Converts a history DataFrame, as returned by `hist_forex`, to arrays.
+
+    :param price_data: DataFrame indexed by a DatetimeIndex with Open/High/Low/Close/Volume columns.
+    :return: Tuple of (mapping of 'Datetime' (datetime64[ns] UTC) and every column to its array, timezone name).
+    """
+    index = price_data.index
+    tz = str(index.tz) if index.tz is not None else None
+    if tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+
+    arrays = {INDEX_COLUMN: index.to_numpy().astype('datetime64[ns]')}
+    arrays.update({name: price_data[name].to_numpy() for name in COLUMNS if name in price_data.columns})
+
+    return arrays, tz
+
+
+def save_history(path: str, price_data, interval: str = None, overwrite: bool = True) -> bool:
+    """
+    Saves a history DataFrame, as returned by `hist_forex`, to the store.
+
+    :param path: Store directory of the history.
+    :param price_data: DataFrame indexed by a DatetimeIndex with Open/High/Low/Close/Volume columns.
+    :param interval: Bar interval of the history (e.g. '2m').
+    :param overwrite: If False, an existing history is left untouched.
+    :return: True if the history was written.
+    """
+    arrays, tz = history_arrays(price_data)
+    index = arrays.pop(INDEX_COLUMN)
+
+    return save_arrays(path, index, arrays, tz=tz, interval=interval, overwrite=overwrite)
+
+
+def append_history(path: str, price_data, interval: str = None) -> int:
+    """
+    Appends newer bars to a stored history, creating it if it does not exist.
+
+    Bars of `price_data` replace stored bars from the first new timestamp onwards, so the
+    overlapping (possibly still forming) last bar of the store is taken from the new fetch.
+
+    :param path: Store directory of the history.
+    :param price_data: DataFrame indexed by a DatetimeIndex with Open/High/Low/Close/Volume columns.
+    :param interval: Bar interval of the history (e.g. '2m').
+    :return: Number of rows the history grew by.
+    """
+    if not has_history(path):
+        save_history(path, price_data, interval=interval)
+        return len(price_data)
+    if len(price_data) == 0:
+        return 0
+
+    meta = read_meta(path)
+    stored = load_arrays(path, mmap=False)
+
+    # A zone name of the new bars replaces a stored utc offset, which is wrong across DST changes
+    new, tz = history_arrays(price_data)
+    if not tz or (UTC_OFFSET.match(tz) and meta.get('tz')):
+        tz = meta.get('tz') or tz
+    index = new[INDEX_COLUMN]
+
+    # Keep the stored bars strictly older than the first new bar
+    keep = np.searchsorted(stored[INDEX_COLUMN], index.min(), side='left')
+    merged_index = np.concatenate([stored[INDEX_COLUMN][:keep], index])
+    columns = {
+        name: np.concatenate([stored[name][:keep], new[name]])
+        for name in meta['columns'] if name in new
+    }
+
+    # New bars may arrive out of order or repeated, keep the last copy of each timestamp
+    order = np.argsort(merged_index, kind='stable')
+    merged_index = merged_index[order]
+    last = np.append(merged_index[1:] != merged_index[:-1], True)
+    columns = {name: values[order][last] for name, values in columns.items()}
+
+    save_arrays(path, merged_index[last], columns, tz=tz, interval=interval or meta.get('interval'), meta=_extra_meta(meta))
+    return int(last.sum()) - meta['rows']
+
+
+def prepend_history(path: str, price_data, interval: str = None) -> int:
+    """
+    Adds older bars before a stored history, e.g. when a longer period is requested than is stored.
+
+    :param path: Store directory of the history.
+    :param price_data: DataFrame indexed by a DatetimeIndex with Open/High/Low/Close/Volume columns.
+        Only its bars older than the first stored bar are added.
+    :param interval: Bar interval of the history (e.g. '2m').
+    :return: Number of rows the history grew by.
+    """
+    if not has_history(path):
+        return append_history(path, price_data, interval=interval)
+
+    meta = read_meta(path)
+    stored = load_arrays(path, mmap=False)
+    new, _ = history_arrays(price_data)
+
+    older = new[INDEX_COLUMN] < stored[INDEX_COLUMN][0] if len(stored[INDEX_COLUMN]) else np.ones(len(new[INDEX_COLUMN]), dtype=bool)
+    if not older.any() or not all(name in new for name in meta['columns']):
+        return 0
+
+    # New bars may be out of order or repeated, keep the last copy of each timestamp
+    order = np.argsort(new[INDEX_COLUMN][older], kind='stable')
+    head_index = new[INDEX_COLUMN][older][order]
+    last = np.append(head_index[1:] != head_index[:-1], True)
+
+    index = np.concatenate([head_index[last], stored[INDEX_COLUMN]])
+    columns = {name: np.concatenate([new[name][older][order][last], stored[name]]) for name in meta['columns']}
+    save_arrays(path, index, columns, tz=meta.get('tz'), interval=interval or meta.get('interval'), meta=_extra_meta(meta))
+    return int(last.sum())
+
+
+def update_meta(path: str, **fields):
+    """Sets fields of the metadata of a stored history."""
+    write_meta(path, {**read_meta(path), **fields})
+
+
+def _extra_meta(meta: dict) -> dict:
+    # Fields of meta.json other than the ones save_arrays writes
+    return {key: value for key, value in meta.items() if key not in STORE_FIELDS}
+
+
+def load_arrays(path: str, mmap: bool = True) -> dict:
+    """
+    Opens a stored history as NumPy arrays without parsing text.
+
+    :param path: Store directory of the history.
+    :param mmap: If True, the columns are memory-mapped read only, otherwise read into memory.
+    :return: Mapping of 'Datetime' (datetime64[ns] UTC) and every stored column to its array.
+    """
+    if not has_history(path):
+        raise FileNotFoundError(f"No stored history at '{path}'.")
+
+    meta = read_meta(path)
+    mmap_mode = 'r' if mmap else None
+
+    arrays = {INDEX_COLUMN: np.load(os.path.join(path, f'{INDEX_COLUMN}.npy'), mmap_mode=mmap_mode)}
+    for name in meta['columns']:
+        arrays[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    return arrays
+
+
+def load_history(path: str, mmap: bool = True):
+    """
+    Opens a stored history as a DataFrame shaped like the output of `hist_forex`.
+
+    :param path: Store directory of the history.
+    :param mmap: If True, the columns are memory-mapped read only, otherwise read into memory.
+    :return: DataFrame with a timezone aware DatetimeIndex named 'Datetime'.
+    """
+    import pandas as pd
+
+    meta = read_meta(path)
+    arrays = load_arrays(path, mmap=mmap)
+
+    index = pd.DatetimeIndex(arrays.pop(INDEX_COLUMN), name=INDEX_COLUMN).tz_localize('UTC')
+    if meta.get('tz'):
+        index = index.tz_convert(meta['tz'])
+
+    return pd.DataFrame(arrays, index=index, copy=False)
+
+
+# Legacy dumps
+
+def _offset_seconds(offsets: list) -> np.ndarray:
+    return np.array([
+        0 if not offset else (1 if offset[0] == '+' else -1) * (int(offset[1:3]) * 3600 + int(offset[4:6]) * 60)
+        for offset in offsets
+    ], dtype='timedelta64[s]')
+
+
+def _parse_timestamps(stamps: list, offsets: list) -> np.ndarray:
+    # Local wall time minus its utc offset gives the utc timestamp
+    local = np.array(stamps, dtype='datetime64[s]')
+    return (local - _offset_seconds(offsets)).astype('datetime64[ns]')
+
+
+def legacy_timezone(index: np.ndarray, offsets: list) -> str:
+    """
+    Timezone of a legacy dump, which only records the utc offset of every row.
+
+    :param index: Timestamps of the rows, datetime64[ns] UTC.
+    :param offsets: Utc offset of every row (e.g. '+01:00'), None for rows without one.
+    :return: The offset when it never changes. Otherwise the first of LEGACY_ZONES with the offsets
+        of every row, or the offset of the last row if none matches.
+    """
+    if len(set(offsets)) <= 1:
+        return offsets[0] if offsets else None
+
+    import pandas as pd
+
+    utc = pd.DatetimeIndex(index).tz_localize('UTC')
+    seconds = _offset_seconds(offsets).astype('timedelta64[ns]')
+    for zone in LEGACY_ZONES:
+        local = utc.tz_convert(zone).tz_localize(None)
+        if np.array_equal((local - utc.tz_localize(None)).to_numpy(), seconds):
+            return zone
+
+    return offsets[-1]
+
+
+def read_legacy_dump(file_path: str) -> tuple:
+    """
+    Parses a history written by `file.write(str(raw_data))` in older versions of main_trade.py.
+
+    The dump is the pandas text rendering of the DataFrame, wrapped into blocks of columns.
+    CSV files written with `DataFrame.to_csv` are accepted as well.
+
+    :param file_path: Path of the legacy dump (e.g. 'Trade_of_EUR_GBP/EUR_GBP.csv').
+    :return: Tuple of (index as datetime64[ns] UTC, mapping of column to values, list of the utc offset of every row).
+    """
+    with open(file_path) as file:
+        lines = file.read().splitlines()
+
+    if lines and lines[0].startswith(f'{INDEX_COLUMN},'):
+        header = lines[0].split(',')[1:]
+        blocks = [(header, lines[1:])]
+        split_row = lambda values: values.lstrip(',').split(',')
+    else:
+        # Every column block starts with a header line followed by a 'Datetime' line
+        starts = [i for i, line in enumerate(lines) if line.startswith(INDEX_COLUMN)]
+        ends = starts[1:] + [len(lines)]
+        blocks = [
+            (re.split(r'\s{2,}', lines[start - 1].replace('\\', '').strip()), lines[start + 1:end])
+            for start, end in zip(starts, ends)
+        ]
+        split_row = lambda values: values.split()
+
+    stamps, offsets, columns = [], [], {}
+    for block_indx, (header, rows) in enumerate(blocks):
+        values = []
+        for row in rows:
+            match = LEGACY_ROW.match(row)
+            if match is None:
+                continue
+            if block_indx == 0:
+                stamps.append(match.group(1))
+                offsets.append(match.group(2))
+            values.append(split_row(match.group(3)))
+
+        if len(values) != len(stamps):
+            raise ValueError(f"Column block {header} of '{file_path}' has {len(values)} rows, expected {len(stamps)}.")
+
+        block = np.array(values, dtype=np.float64).reshape(len(values), len(header))
+        for col_indx, name in enumerate(header):
+            columns[name] = block[:, col_indx]
+
+    if not stamps:
+        raise ValueError(f"No rows found in '{file_path}'.")
+
+    return _parse_timestamps(stamps, offsets), columns, offsets
+
+
+def _legacy_interval(file_path: str, index: np.ndarray) -> str:
+    # The output json written next to the dump records the interval of the fetch
+    output_file = os.path.splitext(file_path)[0]
+    try:
+        with open(output_file) as file:
+            return json.load(file)['interval'].strip('\'"')
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Otherwise infer it from the most common spacing of the bars
+    steps = np.diff(index).astype('timedelta64[s]').astype(np.int64)
+    seconds = int(np.bincount(steps[steps > 0]).argmax()) if len(steps) else 0
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds and seconds % size == 0:
+            return f'{seconds // size}{unit}'
+    return f'{seconds}s'
+
+
+def convert_legacy_file(file_path: str, overwrite: bool = False) -> str:
+    """
+    Converts one legacy dump into a stored history next to it.
+
+    :param file_path: Path of the legacy dump (e.g. 'Trade_of_EUR_GBP/EUR_GBP.csv').
+    :param overwrite: If False, an existing stored history is left untouched.
+    :return: The store directory of the converted history.
+    """
+    index, columns, offsets = read_legacy_dump(file_path)
+    interval = _legacy_interval(file_path, index)
+    tz = legacy_timezone(index, offsets)
+
+    folder, name = os.path.split(os.path.splitext(file_path)[0])
+    path = os.path.join(folder, f'{name}_{interval}')
+
+    # Drop repeated bars and keep the history ordered by time
+    index, unique = np.unique(index, return_index=True)
+    columns = {key: values[unique] for key, values in columns.items()}
+
+    save_arrays(path, index, columns, tz=tz, interval=interval, overwrite=overwrite)
+    return path
+
+
+def convert_legacy(root: str = '.', overwrite: bool = False) -> list:
+    """
+    Converts every legacy dump under `Trade_of_*/` and `Trade_1_day/Trade_of_*/` in `root`.
+
+    :param root: Directory holding the trade folders.
+    :param overwrite: If False, existing stored histories are left untouched.
+    :return: List of the store directories.
+    """
+    patterns = [os.path.join(root, 'Trade_of_*', '*.csv'), os.path.join(root, 'Trade_1_day', 'Trade_of_*', '*.csv')]
+    file_paths = sorted(path for pattern in patterns for path in glob.glob(pattern))
+
+    return [convert_legacy_file(path, overwrite=overwrite) for path in file_paths]
+
+
+#___Unit Testing____#
+class TestPriceStore(unittest.TestCase):
+
+    def setUp(self):
+        """Set up 2m bars in Europe/London crossing the end of summer time on 2024-10-27."""
+        import tempfile
+        import pandas as pd
+
+        index = pd.date_range('2024-10-26 22:00', periods=300, freq='2min', tz='UTC', name=INDEX_COLUMN).tz_convert('Europe/London')
+        close = 1 + 0.001 * np.sin(np.arange(300) / 10)
+        self.history = pd.DataFrame({'Open': close, 'High': close + 1e-4, 'Low': close - 1e-4, 'Close': close, 'Volume': np.arange(300)}, index=index)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.folder = directory.name
+        self.path = os.path.join(self.folder, 'EUR_GBP_2m')
+
+    def test_round_trip(self):
+        """Test that saved arrays load unchanged, with their dtypes, and meta.json is written in place."""
+        arrays, tz = history_arrays(self.history)
+        index = arrays.pop(INDEX_COLUMN)
+        self.assertTrue(save_arrays(self.path, index, arrays, tz=tz, interval='2m'))
+        self.assertFalse(save_arrays(self.path, index[:10], arrays, tz=tz, overwrite=False))
+
+        loaded = load_arrays(self.path)
+        np.testing.assert_array_equal(loaded[INDEX_COLUMN], index)
+        for name in COLUMNS:
+            np.testing.assert_array_equal(loaded[name], arrays[name])
+        self.assertEqual(loaded[VOLUME_COLUMN].dtype, np.int64)
+        self.assertEqual(read_meta(self.path), {'columns': list(COLUMNS), 'tz': 'Europe/London', 'interval': '2m', 'rows': 300})
+        self.assertEqual(sorted(os.listdir(self.path)), sorted([f'{name}.npy' for name in (INDEX_COLUMN,) + COLUMNS] + [META_FILE]))
+
+        self.assertTrue(load_history(self.path).equals(self.history))
+
+    def test_append_history(self):
+        """Test that appended bars replace the overlapping stored ones and older bars are prepended."""
+        append_history(self.path, self.history.iloc[100:200], interval='2m')
+
+        # The last two stored bars are fetched again with new prices
+        update = self.history.iloc[198:250].copy()
+        update.loc[update.index[:2], 'Close'] = 2.0
+        self.assertEqual(append_history(self.path, update), 50)
+        self.assertEqual(prepend_history(self.path, self.history.iloc[:120]), 100)
+
+        history = load_history(self.path)
+        self.assertEqual(len(history), 250)
+        self.assertTrue(history.index.is_unique and history.index.is_monotonic_increasing)
+        np.testing.assert_array_equal(history['Close'].to_numpy()[198:200], [2.0, 2.0])
+        np.testing.assert_array_equal(history['Close'].to_numpy()[200:], self.history['Close'].to_numpy()[200:250])
+        self.assertEqual(read_meta(self.path)['interval'], '2m')
+
+    def test_convert_legacy_file(self):
+        """Test that a dump crossing a DST change is stored in its zone, not the offset of its first row."""
+        file_path = os.path.join(self.folder, 'EUR_GBP.csv')
+        # A repeated bar is dropped
+        self.history.iloc[list(range(300)) + [5]].to_csv(file_path)
+
+        path = convert_legacy_file(file_path)
+        self.assertEqual(path, self.path)
+        self.assertEqual(read_meta(path)['tz'], 'Europe/London')
+        self.assertEqual(read_meta(path)['interval'], '2m')
+        history = load_history(path)
+        self.assertEqual(len(history), 300)
+        self.assertEqual(list(history.index.strftime('%H:%M%z')[[0, -1]]), ['23:00+0100', '07:58+0000'])
+        np.testing.assert_allclose(history['Close'].to_numpy(), self.history['Close'].to_numpy())
+
+        # A dump with one offset keeps it
+        self.history.iloc[:20].to_csv(file_path)
+        self.assertEqual(read_meta(convert_legacy_file(file_path, overwrite=True))['tz'], '+01:00')
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
+    else:
+        import sys
+
+        root = sys.argv[1] if len(sys.argv) > 1 else '.'
+        for path in convert_legacy(root, overwrite='--overwrite' in sys.argv):
+            print(f'{path}: {read_meta(path)["rows"]} rows')
@@ -0,0 +1,342 @@
+import os
+import asyncio
+import unittest
+import numpy as np
+from Modules.PriceStore import INDEX_COLUMN, store_path, has_history, load_arrays, history_arrays, period_length, convert_legacy_file
+from Modules.Resample import finest_history, interval_history
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+MARKET DATA PROVIDERS
+---------------------
+Every provider offers the coroutines
+
+    quote(from_currency, to_currency)       -> (sell rate, buy rate, spread)
+    history(from_currency, to_currency, ...) -> {'Datetime': ..., 'Open': ..., ..., 'Close': ..., 'Volume': ...}
+    quotes(pairs) / histories(pairs, ...)    -> one result per pair, requested concurrently
+
+Histories are mappings of column name to array, as returned by `PriceStore.load_arrays`.
+At most `max_concurrency` requests of a provider run at the same time.
+"""
+
+
+class MarketDataProvider:
+    """
+    Base class of the market data providers. Subclasses implement `_quote` and `_history`.
+    """
+
+    def __init__(self, max_concurrency: int = 8):
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Created on first use, inside the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _quote(self, from_currency: str, to_currency: str) -> tuple:
+        raise NotImplementedError
+
+    async def _history(self, from_currency: str, to_currency: str, period: str = None, interval: str = None,
+                       start_date=None, end_date=None) -> dict:
+        raise NotImplementedError
+
+    async def quote(self, from_currency: str, to_currency: str) -> tuple:
+        """
+        Latest quote of a currency pair.
+
+        :param from_currency: The base currency code (e.g., 'USD').
+        :param to_currency: The target currency code (e.g., 'EUR').
+        :return: Latest sell rate, buy rate, and spread as a tuple.
+        """
+        async with self.semaphore:
+            return await self._quote(from_currency, to_currency)
+
+    async def history(self, from_currency: str, to_currency: str, period: str = None, interval: str = None,
+                      start_date=None, end_date=None) -> dict:
+        """
+        Historical bars of a currency pair.
+
+        :param from_currency: The base currency code (e.g., 'USD').
+        :param to_currency: The target currency code (e.g., 'EUR').
+        :param period: Period for historical data (optional).
+        :param interval: Interval for historical data (optional).
+        :param start_date: Start date for historical data (optional).
+        :param end_date: End date for historical data (optional).
+        :return: Mapping of 'Datetime' (datetime64[ns] UTC) and every column to its array.
+        """
+        async with self.semaphore:
+            return await self._history(from_currency, to_currency, period, interval, start_date, end_date)
+
+    async def quotes(self, pairs: list, return_exceptions: bool = False) -> list:
+        """Latest quotes of many (from_currency, to_currency) pairs, requested concurrently."""
+        return await asyncio.gather(*(self.quote(*pair) for pair in pairs), return_exceptions=return_exceptions)
+
+    async def histories(self, pairs: list, return_exceptions: bool = False, **kwargs) -> list:
+        """Historical bars of many (from_currency, to_currency) pairs, requested concurrently."""
+        return await asyncio.gather(*(self.history(*pair, **kwargs) for pair in pairs), return_exceptions=return_exceptions)
+
+
+class YahooProvider(MarketDataProvider):
+    """
+    Yahoo Finance through `Modules.Forex`, run on worker threads so requests overlap.
+    """
+
+    async def _quote(self, from_currency, to_currency):
+        from Modules.Forex import forexRate
+        return await asyncio.to_thread(forexRate, from_currency, to_currency)
+
+    async def _history(self, from_currency, to_currency, period=None, interval=None, start_date=None, end_date=None):
+        import pandas as pd
+        from Modules.Forex import hist_forex
+
+        # Times of the stores are datetime64 UTC, yfinance takes timezone aware timestamps
+        def utc(date):
+            date = pd.Timestamp(date)
+            return date.tz_localize('UTC') if date.tzinfo is None else date.tz_convert('UTC')
+
+        start_date, end_date = (None if date is None else utc(date) for date in (start_date, end_date))
+        price_data = await asyncio.to_thread(hist_forex, from_currency, to_currency, start_date, end_date, period, interval)
+        return history_arrays(price_data.dropna())[0]
+
+    async def quotes(self, pairs, return_exceptions=False):
+        # One bulk request through the quote cache instead of one request per pair
+        from Modules.Forex import forex_rates
+        try:
+            async with self.semaphore:
+                return await asyncio.to_thread(forex_rates, list(pairs))
+        except Exception:
+            if not return_exceptions:
+                raise
+        return await super().quotes(pairs, return_exceptions=True)
+
+
+class ApiProvider(MarketDataProvider):
+    """
+    Latest rates from the HTTP rate API of `Modules.Forex.blitzRate`. It has no bid/ask, so the spread is 0.
+    """
+
+    def __init__(self, api_url: str = None, max_concurrency: int = 8):
+        super().__init__(max_concurrency)
+        self.api_url = api_url
+
+    async def _quote(self, from_currency, to_currency):
+        from Modules.Forex import blitzRate
+        rate = await asyncio.to_thread(blitzRate, from_currency, to_currency, api_url=self.api_url)
+        if rate is None:
+            raise LookupError(f'No rate for {from_currency}{to_currency}.')
+        return rate, rate, 0.0
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Quotes and bars served from stored histories, as of a replay time.
+
+    The quote of a pair is the close of its last bar at or before the replay time, with a fixed
+    spread added for the buy rate. Inverse pairs are served from the stored pair. Histories only
+    hold the bars up to the replay time, so a replay never sees the future.
+    """
+
+    def __init__(self, paths: dict, spread=0.0, now=None, max_concurrency: int = 8):
+        """
+        Args:
+            paths (dict): Store directory of every (sell_unit, buy_unit) pair.
+            spread (float or dict, optional): Spread of every pair, or a dict of spread per pair. Defaults to 0.
+            now (datetime64, optional): Replay time. Defaults to None, the end of the histories.
+            max_concurrency (int, optional): Maximum number of requests at once. Defaults to 8.
+        """
+        super().__init__(max_concurrency)
+        self.paths = dict(paths)
+        self.spread = spread
+        self.now = None if now is None else np.datetime64(now, 'ns')
+        self._arrays = {}
+
+    @classmethod
+    def from_directory(cls, root: str, interval: str, **kwargs):
+        """
+        Replay the stored histories of every `Trade_of_X_Y` folder of a directory for one interval.
+        Intervals not stored are resampled from the finest stored one (see `Modules.Resample`), and
+        folders holding only a legacy dump are converted on first use, as `main_trade.load_data` does.
+        """
+        paths = {}
+        for name in sorted(os.listdir(root or '.')):
+            parts = name.split('_')
+            if len(parts) == 4 and name.startswith('Trade_of_'):
+                folder = os.path.join(root, name)
+                legacy_file = os.path.join(folder, f'{parts[2]}_{parts[3]}.csv')
+                try:
+                    if (not has_history(store_path(folder, parts[2], parts[3], interval)) and os.path.isfile(legacy_file)
+                            and finest_history(folder, parts[2], parts[3], interval) is None):
+                        convert_legacy_file(legacy_file)
+                    interval_history(folder, parts[2], parts[3], interval)
+                except (FileNotFoundError, ValueError):
+                    continue
+                paths[(parts[2], parts[3])] = store_path(folder, parts[2], parts[3], interval)
+        return cls(paths, **kwargs)
+
+    def arrays(self, pair: tuple) -> dict:
+        """Memory-mapped columns of a stored pair history."""
+        if pair not in self._arrays:
+            self._arrays[pair] = load_arrays(self.paths[pair])
+        return self._arrays[pair]
+
+    def _end(self, pair):
+        # Number of bars at or before the replay time
+        index = self.arrays(pair)[INDEX_COLUMN]
+        return len(index) if self.now is None else int(np.searchsorted(index, self.now, side='right'))
+
+    def _spread(self, pair):
+        return self.spread.get(pair, 0.0) if isinstance(self.spread, dict) else self.spread
+
+    def advance(self, bars: int = 1):
+        """
+        Move the replay time to the timestamp of the next bar of any pair.
+
+        :param bars: Number of steps to move.
+        :return: The new replay time, or None when every history is exhausted.
+        """
+        for _ in range(bars):
+            upcoming = [
+                self.arrays(pair)[INDEX_COLUMN][end] for pair in self.paths
+                if (end := self._end(pair)) < len(self.arrays(pair)[INDEX_COLUMN])
+            ]
+            if self.now is None or not upcoming:
+                return None
+            self.now = min(upcoming)
+        return self.now
+
+    async def _quote(self, from_currency, to_currency):
+        pair, inverse = (from_currency, to_currency), (to_currency, from_currency)
+        if pair not in self.paths and inverse not in self.paths:
+            raise KeyError(f'No stored history for {from_currency}{to_currency}.')
+
+        stored = pair if pair in self.paths else inverse
+        end = self._end(stored)
+        if end == 0:
+            raise LookupError(f'No bar of {from_currency}{to_currency} before the replay time.')
+
+        close, spread = float(self.arrays(stored)['Close'][end - 1]), self._spread(stored)
+        if stored == pair:
+            return close, close + spread, spread
+        latest_sell_rate, latest_buy_rate = 1 / (close + spread), 1 / close
+        return latest_sell_rate, latest_buy_rate, latest_buy_rate - latest_sell_rate
+
+    async def _history(self, from_currency, to_currency, period=None, interval=None, start_date=None, end_date=None):
+        pair = (from_currency, to_currency)
+        if pair not in self.paths:
+            raise KeyError(f'No stored history for {from_currency}{to_currency}.')
+
+        arrays = self.arrays(pair)
+        index = arrays[INDEX_COLUMN]
+        end = self._end(pair)
+        if end_date is not None:
+            end = min(end, int(np.searchsorted(index, np.datetime64(end_date, 'ns'), side='left')))
+
+        length = period_length(period)
+        if start_date is not None:
+            start = int(np.searchsorted(index, np.datetime64(start_date, 'ns'), side='left'))
+        elif length is not None and end > 0:
+            start = int(np.searchsorted(index, index[end - 1] - length, side='right'))
+        else:
+            start = 0
+
+        return {name: values[start:end] for name, values in arrays.items()}
+
+
+#___Unit Testing____#
+class TestReplayProvider(unittest.TestCase):
+
+    def setUp(self):
+        """Set up two stored histories with bars a minute apart."""
+        import tempfile
+        from Modules.PriceStore import save_arrays
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        root = directory.name
+        index = np.datetime64('2024-10-01T00:00', 'ns') + np.arange(100) * np.timedelta64(1, 'm')
+        self.paths = {}
+        for pair, offset in ((('EUR', 'GBP'), 0.8), (('USD', 'ZAR'), 17.0)):
+            self.paths[pair] = os.path.join(root, '_'.join(pair))
+            save_arrays(self.paths[pair], index, {'Close': offset + np.arange(100) / 1000})
+        self.index = index
+
+    def test_replay(self):
+        """Test that quotes and histories follow the replay time, never reaching past it."""
+        provider = ReplayProvider(self.paths, spread=0.001, now=self.index[9])
+
+        history, quotes = asyncio.run(self.fetch(provider))
+        self.assertEqual(len(history[INDEX_COLUMN]), 10)
+        self.assertAlmostEqual(quotes[0][0], 0.809)
+        self.assertAlmostEqual(quotes[0][1], 0.810)
+        self.assertAlmostEqual(quotes[1][1], 1 / 17.009)
+
+        self.assertEqual(provider.advance(5), self.index[14])
+        history, quotes = asyncio.run(self.fetch(provider))
+        self.assertEqual(len(history[INDEX_COLUMN]), 15)
+        self.assertAlmostEqual(quotes[0][0], 0.814)
+
+    async def fetch(self, provider):
+        history = await provider.history('EUR', 'GBP', period='1d')
+        quotes = await provider.quotes([('EUR', 'GBP'), ('ZAR', 'USD')])
+        return history, quotes
+
+    def test_legacy_directory(self):
+        """Test that a directory holding only legacy dumps is converted and replayed."""
+        import tempfile
+        import pandas as pd
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        folder = os.path.join(directory.name, 'Trade_of_EUR_GBP')
+        os.makedirs(folder)
+        close = 0.8 + np.arange(100) / 1000
+        index = pd.DatetimeIndex(self.index, name=INDEX_COLUMN).tz_localize('UTC').tz_convert('Europe/London')
+        pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 0}, index=index).to_csv(os.path.join(folder, 'EUR_GBP.csv'))
+
+        provider = ReplayProvider.from_directory(directory.name, '5m')
+        self.assertEqual(list(provider.paths), [('EUR', 'GBP')])
+        self.assertEqual(len(provider.arrays(('EUR', 'GBP'))[INDEX_COLUMN]), 20)
+        self.assertAlmostEqual(asyncio.run(provider.quotes([('EUR', 'GBP')]))[0][0], 0.899)
+
+    def test_concurrency(self):
+        """Test that requests overlap up to the concurrency limit, and no further."""
+        class CountingProvider(MarketDataProvider):
+            running = peak = 0
+
+            async def _quote(self, from_currency, to_currency):
+                CountingProvider.running += 1
+                CountingProvider.peak = max(CountingProvider.peak, CountingProvider.running)
+                await asyncio.sleep(0)
+                CountingProvider.running -= 1
+                return 1.0, 1.0, 0.0
+
+        quotes = asyncio.run(CountingProvider(max_concurrency=5).quotes([('EUR', 'GBP')] * 20))
+        self.assertEqual(len(quotes), 20)
+        self.assertEqual(CountingProvider.peak, 5)
+
+    def test_yahoo_start_only(self):
+        """Test that the Yahoo provider forwards the interval and start of a request without an end."""
+        import pandas as pd
+        from Modules import Forex
+
+        requests = []
+        empty = pd.DataFrame({'Close': []}, index=pd.DatetimeIndex([], tz='UTC'))
+        hist_forex = Forex.hist_forex
+        Forex.hist_forex = lambda *args: requests.append(args) or empty
+        try:
+            asyncio.run(YahooProvider().history('EUR', 'GBP', interval='2m', start_date=np.datetime64('2024-10-01T08:00', 'ns')))
+        finally:
+            Forex.hist_forex = hist_forex
+
+        self.assertEqual(requests, [('EUR', 'GBP', pd.Timestamp('2024-10-01 08:00', tz='UTC'), None, None, '2m')])
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
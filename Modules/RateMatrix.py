@@ -0,0 +1,177 @@
+import time
+import unittest
+import numpy as np
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+# Currencies whose crosses are quoted by default
+BASE_CURRENCIES = ('USD', 'EUR')
+
+
+class RateMatrix:
+    """
+    Bid and ask rates between every pair of a set of currencies, derived from a few quoted base pairs.
+
+    A rate that is not quoted is taken from the inverse quote, or triangulated through other
+    currencies: converting A to C through B sells at bid(A, B) * bid(B, C) and buys at
+    ask(A, B) * ask(B, C). Of all routes, the one with the smallest relative spread is used.
+    Lookups are then in memory, and one refresh of the base pairs serves every conversion.
+    """
+
+    def __init__(self, base_pairs: list):
+        """
+        Initialize the matrix for a list of base pairs.
+
+        Args:
+            base_pairs (list of tuple): The quoted (from_currency, to_currency) pairs.
+        """
+        self.base_pairs = list(dict.fromkeys(tuple(pair) for pair in base_pairs))
+        self.currencies = sorted({currency for pair in self.base_pairs for currency in pair})
+        self.position = {currency: indx for indx, currency in enumerate(self.currencies)}
+
+        size = len(self.currencies)
+        self.bid = np.full((size, size), np.nan)
+        self.ask = np.full((size, size), np.nan)
+        self.refreshed_at = None
+
+    @classmethod
+    def for_currencies(cls, currencies, bases=BASE_CURRENCIES):
+        """
+        Matrix quoting every currency against each base currency (e.g. USDZAR, EURZAR, EURUSD).
+
+        Args:
+            currencies (iterable of str): Currencies to convert between.
+            bases (tuple of str, optional): Base currencies. Defaults to BASE_CURRENCIES.
+        """
+        currencies = list(dict.fromkeys([*bases, *currencies]))
+        return cls([(base, currency) for indx, base in enumerate(bases) for currency in currencies if currency not in bases[:indx + 1]])
+
+    def update(self, quotes):
+        """
+        Set the quotes of the base pairs and derive every other rate.
+
+        Args:
+            quotes (list): (sell rate, buy rate, spread) of each base pair, in the order of `base_pairs`.
+                Quotes that are None or exceptions (e.g. from a failed fetch) are skipped.
+        """
+        size = len(self.currencies)
+        bid, ask = np.full((size, size), np.nan), np.full((size, size), np.nan)
+
+        quoted = [(pair, quote) for pair, quote in zip(self.base_pairs, quotes) if quote is not None and not isinstance(quote, Exception)]
+        for (from_currency, to_currency), (latest_sell_rate, latest_buy_rate, *_) in quoted:
+            i, j = self.position[from_currency], self.position[to_currency]
+            bid[i, j], ask[i, j] = latest_sell_rate, latest_buy_rate
+
+        # Inverse rates where the inverse pair is not quoted itself
+        inverse = np.isnan(bid) & ~np.isnan(bid.T)
+        with np.errstate(divide='ignore'):
+            bid = np.where(inverse, 1 / ask.T, bid)
+            ask = np.where(inverse, 1 / bid.T, ask)
+        np.fill_diagonal(bid, 1.0)
+        np.fill_diagonal(ask, 1.0)
+
+        # Relative spreads multiply along a route, so their logs add up: shortest paths over log(ask / bid)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cost = np.where(np.isnan(bid), np.inf, np.log(ask) - np.log(bid))
+        for k in range(size):
+            via_cost = cost[:, k, None] + cost[None, k, :]
+            better = via_cost < cost
+            bid = np.where(better, bid[:, k, None] * bid[None, k, :], bid)
+            ask = np.where(better, ask[:, k, None] * ask[None, k, :], ask)
+            cost = np.where(better, via_cost, cost)
+
+        self.bid, self.ask = bid, ask
+        self.refreshed_at = time.time()
+
+    def refresh(self, fetch=None):
+        """
+        Fetch the quotes of every base pair in one batch.
+
+        Args:
+            fetch (callable, optional): Function taking the list of base pairs and returning their quotes.
+                Defaults to `Modules.Forex.forex_rates`.
+        """
+        if fetch is None:
+            from Modules.Forex import forex_rates as fetch
+        self.update(fetch(self.base_pairs))
+
+    async def refresh_async(self, provider):
+        """
+        Fetch the quotes of every base pair through a market data provider, skipping the pairs it cannot quote.
+
+        Args:
+            provider (MarketDataProvider): Provider of the quotes (see `Modules.Providers`).
+        """
+        self.update(await provider.quotes(self.base_pairs, return_exceptions=True))
+
+    def rate(self, from_currency: str, to_currency: str) -> tuple:
+        """
+        Conversion rate between two currencies.
+
+        Args:
+            from_currency (str): The base currency code (e.g., 'ZAR').
+            to_currency (str): The target currency code (e.g., 'GBP').
+
+        Returns:
+            tuple: Sell rate, buy rate, and spread.
+
+        Raises:
+            KeyError: If the currencies cannot be converted with the quoted base pairs.
+        """
+        if from_currency == to_currency:
+            return 1.0, 1.0, 0.0
+        try:
+            i, j = self.position[from_currency], self.position[to_currency]
+        except KeyError:
+            raise KeyError(f'No rate for {from_currency}{to_currency}, a currency is not in the matrix.') from None
+
+        latest_sell_rate, latest_buy_rate = float(self.bid[i, j]), float(self.ask[i, j])
+        if np.isnan(latest_sell_rate):
+            raise KeyError(f'No rate for {from_currency}{to_currency}, the quoted pairs do not connect them.')
+
+        return latest_sell_rate, latest_buy_rate, latest_buy_rate - latest_sell_rate
+
+    def rates(self, pairs: list) -> list:
+        """Conversion rates of many (from_currency, to_currency) pairs, as returned by `rate`."""
+        return [self.rate(*pair) for pair in pairs]
+
+
+#___Unit Testing____#
+class TestRateMatrix(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a matrix of USD crosses."""
+        self.matrix = RateMatrix([('USD', 'ZAR'), ('GBP', 'USD'), ('USD', 'JPY')])
+        self.matrix.update([(17.5, 17.6, 0.1), (1.29, 1.30, 0.01), ValueError('no quote')])
+
+    def test_rate(self):
+        """Test direct, inverse and triangulated rates."""
+        self.assertEqual(self.matrix.rate('USD', 'ZAR'), (17.5, 17.6, 17.6 - 17.5))
+
+        latest_sell_rate, latest_buy_rate, _ = self.matrix.rate('ZAR', 'USD')
+        self.assertAlmostEqual(latest_sell_rate, 1 / 17.6)
+        self.assertAlmostEqual(latest_buy_rate, 1 / 17.5)
+
+        latest_sell_rate, latest_buy_rate, spread = self.matrix.rate('ZAR', 'GBP')
+        self.assertAlmostEqual(latest_sell_rate, 1 / 17.6 / 1.30)
+        self.assertAlmostEqual(latest_buy_rate, 1 / 17.5 / 1.29)
+        self.assertAlmostEqual(spread, latest_buy_rate - latest_sell_rate)
+
+    def test_unreachable(self):
+        """Test that currencies without a quoted route raise KeyError."""
+        with self.assertRaises(KeyError):
+            self.matrix.rate('ZAR', 'JPY')
+        with self.assertRaises(KeyError):
+            self.matrix.rate('ZAR', 'CHF')
+
+    def test_for_currencies(self):
+        """Test the base pairs quoted for a set of currencies."""
+        matrix = RateMatrix.for_currencies(['ZAR', 'GBP', 'EUR'])
+        self.assertEqual(matrix.base_pairs, [('USD', 'EUR'), ('USD', 'ZAR'), ('USD', 'GBP'), ('EUR', 'ZAR'), ('EUR', 'GBP')])
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -25,10 +25,10 @@ def write_output_to_file(write_file: str, output_data: dict, file_format = '.py'
                     for key, val in output_data.items():
                         # Handle list values
                         if isinstance(val, list):
-                            formatted_val = ', '.join(str(v) for v in val)
+                            formatted_val = ', '.join(repr(v) for v in val)
                             formatted_val = f'[{formatted_val}]'
                         else:
-                            formatted_val = str(val)
+                            formatted_val = repr(val)
                         
                         file.write(f'{key} = {formatted_val}\n')
         except FileExistsError:
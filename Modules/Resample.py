@@ -0,0 +1,408 @@
+import os
+import re
+import glob
+import unittest
+import numpy as np
+from datetime import datetime
+from Modules.PriceStore import (
+    INDEX_COLUMN, VOLUME_COLUMN, has_history, read_meta, update_meta, load_arrays, save_arrays, period_length, store_path
+)
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+RESAMPLING
+----------
+Coarser intervals of a pair are built from its finest stored history instead of being fetched:
+
+    Trade_of_EUR_GBP/EUR_GBP_1m/     fetched bars
+    Trade_of_EUR_GBP/EUR_GBP_5m/     derived from EUR_GBP_1m, "source" in its meta.json
+    Trade_of_EUR_GBP/EUR_GBP_1h/     derived from EUR_GBP_1m
+
+Bars are grouped by the interval in the local time of the history, so daily bars start at local
+midnight and weekly bars on Monday. A bar is built from the source bars it holds: the open of the
+first, the highest high, the lowest low, the close of the last and the summed volume. Intervals
+without source bars (weekends, gaps in the feed) have no bar, unless gaps are filled.
+
+A derived history is saved to the store with the row count, first and last timestamp of its source.
+It is served as stored while its source is unchanged, and only its last bar onwards is rebuilt when
+bars were appended to the source. Any other change, such as older bars backfilled before the first
+one, rebuilds it in full.
+"""
+
+# Monday, the first day of weekly bars
+WEEK_ORIGIN = np.datetime64('1970-01-05', 'ns')
+EPOCH = np.datetime64('1970-01-01', 'ns')
+
+# Offset timezones as stored by legacy dumps ('+01:00') and pandas ('UTC+01:00')
+UTC_OFFSET = re.compile(r'^(?:UTC)?([+-])(\d\d):?(\d\d)$')
+
+
+# Aggregate of every column over the source bars starts[i]:ends[i] of each bar. NaN prices of a
+# source bar are skipped by the high and low.
+AGGREGATES = {
+    'Open': lambda values, starts, ends: values[starts],
+    'High': lambda values, starts, ends: np.fmax.reduceat(values, starts),
+    'Low': lambda values, starts, ends: np.fmin.reduceat(values, starts),
+    'Close': lambda values, starts, ends: values[ends - 1],
+    VOLUME_COLUMN: lambda values, starts, ends: np.add.reduceat(values, starts),
+}
+
+
+def interval_step(interval: str) -> np.timedelta64:
+    """
+    Length of the bars of an interval.
+
+    :param interval: Interval of fixed length (e.g. '5m', '1h', '1d', '1wk').
+    :return: The length as a np.timedelta64[ns].
+    """
+    if interval.endswith(('mo', 'y')):
+        raise ValueError(f"Interval '{interval}' has no fixed length to resample to.")
+    step = period_length(interval)
+    if step is None:
+        raise ValueError(f"Interval '{interval}' has no fixed length to resample to.")
+    return step
+
+
+def utc_offsets(index: np.ndarray, tz: str = None) -> np.ndarray:
+    """
+    UTC offset of the local time of every timestamp.
+
+    :param index: Timestamps as datetime64[ns] UTC.
+    :param tz: Timezone name (e.g. 'Europe/London') or utc offset (e.g. '+01:00'). None for UTC.
+    :return: Array of timedelta64[ns], local time minus UTC.
+    """
+    index = np.asarray(index, dtype='datetime64[ns]')
+    if not tz or tz == 'UTC':
+        return np.zeros(len(index), dtype='timedelta64[ns]')
+
+    match = UTC_OFFSET.match(tz)
+    if match:
+        sign = 1 if match.group(1) == '+' else -1
+        offset = np.timedelta64(sign * (int(match.group(2)) * 60 + int(match.group(3))), 'm').astype('timedelta64[ns]')
+        return np.full(len(index), offset, dtype='timedelta64[ns]')
+
+    from zoneinfo import ZoneInfo
+    zone = ZoneInfo(tz)
+
+    # Offsets change on the hour at most, so one lookup per distinct hour serves every bar
+    hours, inverse = np.unique(index.astype('datetime64[h]'), return_inverse=True)
+    offsets = np.array([
+        datetime.fromtimestamp(int(hour.astype('datetime64[s]').astype(np.int64)), zone).utcoffset().total_seconds()
+        for hour in hours
+    ], dtype=np.int64).astype('timedelta64[s]').astype('timedelta64[ns]')
+    return offsets[inverse.ravel()]
+
+
+def resample(arrays: dict, interval: str, tz: str = None, fill_gaps: bool = False) -> dict:
+    """
+    Aggregate bars into a coarser interval in one vectorized pass.
+
+    :param arrays: Mapping of 'Datetime' (datetime64[ns] UTC, ascending) and columns to arrays, as returned
+        by `load_arrays`. Open, High, Low, Close and Volume are aggregated, other columns are left out.
+    :param interval: Interval of the bars built (e.g. '15m', '1h', '1d').
+    :param tz: Timezone the bars are aligned in, see `utc_offsets`. Defaults to UTC.
+    :param fill_gaps: If True, intervals without source bars get a flat bar at the previous close with no
+        volume. Only gaps between the first and last bar are filled.
+    :return: Mapping of 'Datetime' (start of every bar, UTC) and the aggregated columns to arrays.
+    """
+    step = interval_step(interval)
+    origin = WEEK_ORIGIN if interval.endswith('wk') else EPOCH
+    index = np.asarray(arrays[INDEX_COLUMN], dtype='datetime64[ns]')
+
+    if len(index) == 0:
+        return {INDEX_COLUMN: index[:0], **{name: np.asarray(arrays[name])[:0] for name in arrays if name in AGGREGATES}}
+
+    # Number of the bar of every source bar, counted in local time
+    offsets = utc_offsets(index, tz)
+    buckets = (index + offsets - origin) // step
+
+    # Source bars are in time order, so the bars are runs of equal bucket numbers
+    starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+    ends = np.append(starts[1:], len(index))
+
+    columns = {}
+    for name, aggregate in AGGREGATES.items():
+        if name in arrays:
+            columns[name] = aggregate(np.asarray(arrays[name]), starts, ends)
+
+    # Bars start at the start of their bucket, in the local time of their first source bar
+    bucket_numbers = buckets[starts]
+    labels = origin + bucket_numbers * step - offsets[starts]
+
+    if fill_gaps:
+        labels, columns = _fill_gaps(labels, bucket_numbers, columns, origin, step, offsets[starts])
+
+    return {INDEX_COLUMN: labels, **columns}
+
+
+def _fill_gaps(labels, bucket_numbers, columns, origin, step, offsets):
+    # Every bucket between the first and last bar, the missing ones at the previous close
+    every = np.arange(bucket_numbers[0], bucket_numbers[-1] + 1)
+    present = np.searchsorted(every, bucket_numbers)
+    previous = np.searchsorted(bucket_numbers, every, side='right') - 1
+
+    # Missing bars take the utc offset of the bar before them
+    filled_labels = origin + every * step - offsets[previous]
+    filled_labels[present] = labels
+
+    filled = {}
+    for name, values in columns.items():
+        if name == VOLUME_COLUMN:
+            filled[name] = np.zeros(len(every), dtype=values.dtype)
+            filled[name][present] = values
+        else:
+            close = columns.get('Close', values)
+            filled[name] = close[previous].astype(values.dtype)
+            filled[name][present] = values
+
+    return filled_labels, filled
+
+
+def stored_intervals(folder: str, sell_unit: str, buy_unit: str) -> dict:
+    """
+    Fetched histories of a pair in its trade folder, derived ones are left out.
+
+    :param folder: The trade folder of the pair (e.g. 'Trade_of_EUR_GBP/').
+    :return: Mapping of interval to store directory, finest interval first.
+    """
+    prefix = os.path.join(folder, f'{sell_unit}_{buy_unit}_')
+    intervals = {}
+    for path in glob.glob(glob.escape(prefix) + '*'):
+        interval = path[len(prefix):]
+        if not has_history(path) or read_meta(path).get('source'):
+            continue
+        try:
+            intervals[interval] = interval_step(interval)
+        except ValueError:
+            continue
+    return {interval: store_path(folder, sell_unit, buy_unit, interval) for interval in sorted(intervals, key=intervals.get)}
+
+
+def finest_history(folder: str, sell_unit: str, buy_unit: str, interval: str) -> str:
+    """
+    Finest fetched history of a pair a coarser interval can be built from.
+
+    :param folder: The trade folder of the pair.
+    :param interval: Interval to build (e.g. '1h').
+    :return: Store directory of the finest fetched interval dividing `interval`, or None.
+    """
+    step = interval_step(interval)
+    for source_interval, path in stored_intervals(folder, sell_unit, buy_unit).items():
+        source_step = interval_step(source_interval)
+        if source_step <= step and step % source_step == np.timedelta64(0):
+            return path
+    return None
+
+
+def _appended(meta: dict, source_index: np.ndarray) -> bool:
+    # The source only grew at its end since the derived history was built: same first bar, and its
+    # old last bar still at the same row
+    rows = meta.get('source_rows') or 0
+    return (
+        0 < rows <= len(source_index) and meta.get('source_start') == str(source_index[0])
+        and meta.get('source_end') == str(source_index[rows - 1])
+    )
+
+
+def derived_history(source_path: str, path: str, interval: str, fill_gaps: bool = False, replace_fetched: bool = False) -> dict:
+    """
+    History of an interval resampled from a finer stored history, and cached in the store.
+
+    :param source_path: Store directory of the finer history.
+    :param path: Store directory of the derived history.
+    :param interval: Interval of the derived history.
+    :param fill_gaps: If True, intervals without source bars are filled, see `resample`.
+    :param replace_fetched: If True, a fetched history at `path` is replaced by the resampled source
+        instead of being served, as when a base interval is configured.
+    :return: The derived history, as returned by `load_arrays`.
+    """
+    source_meta = read_meta(source_path)
+    source = load_arrays(source_path)
+    source_index = source[INDEX_COLUMN]
+    state = {'source': os.path.basename(os.path.normpath(source_path)), 'source_rows': source_meta['rows'],
+             'source_start': str(source_index[0]) if len(source_index) else None,
+             'source_end': str(source_index[-1]) if len(source_index) else None, 'fill_gaps': fill_gaps}
+
+    meta = read_meta(path) if has_history(path) else {}
+    if meta and not meta.get('source'):
+        if not replace_fetched:
+            # A fetched history of the interval is served as it is
+            return load_arrays(path)
+        meta = {}
+    if meta and all(meta.get(key) == value for key, value in state.items()):
+        return load_arrays(path)
+
+    tz = source_meta.get('tz')
+    if meta.get('source') == state['source'] and meta.get('fill_gaps') == fill_gaps and meta['rows'] and _appended(meta, source_index):
+        # Keep the bars before the last one, and rebuild from the source bars of the last one onwards
+        stored = load_arrays(path, mmap=False)
+        keep = meta['rows'] - 1
+        first = int(np.searchsorted(source[INDEX_COLUMN], stored[INDEX_COLUMN][keep], side='left'))
+        tail = resample({name: values[first:] for name, values in source.items()}, interval, tz, fill_gaps)
+        arrays = {name: np.concatenate([stored[name][:keep], tail[name]]) for name in tail}
+    else:
+        arrays = resample(source, interval, tz, fill_gaps)
+
+    index = arrays.pop(INDEX_COLUMN)
+    save_arrays(path, index, arrays, tz=tz, interval=interval)
+
+    # The source state is recorded once the bars are saved, so an interrupted write is rebuilt
+    update_meta(path, **state)
+
+    return load_arrays(path)
+
+
+def interval_history(folder: str, sell_unit: str, buy_unit: str, interval: str, fill_gaps: bool = False) -> dict:
+    """
+    History of a pair for an interval: stored when fetched, resampled from a finer fetched history otherwise.
+
+    :param folder: The trade folder of the pair.
+    :param interval: Interval of the history (e.g. '15m').
+    :param fill_gaps: If True, intervals without source bars are filled, see `resample`.
+    :return: The history, as returned by `load_arrays`.
+    """
+    path = store_path(folder, sell_unit, buy_unit, interval)
+    if has_history(path) and not read_meta(path).get('source'):
+        return load_arrays(path)
+
+    source_path = finest_history(folder, sell_unit, buy_unit, interval)
+    if source_path is None:
+        raise FileNotFoundError(f"No stored history of {sell_unit}{buy_unit} to build the {interval} interval from in '{folder}'.")
+    if source_path == path:
+        return load_arrays(path)
+    return derived_history(source_path, path, interval, fill_gaps)
+
+
+#___Unit Testing____#
+class TestResample(unittest.TestCase):
+
+    def setUp(self):
+        """Set up minute bars over two days, with a gap and a weekend."""
+        import tempfile
+
+        rng = np.random.default_rng(3)
+        index = np.arange(np.datetime64('2024-10-04T20:00', 'ns'), np.datetime64('2024-10-07T04:00', 'ns'), np.timedelta64(1, 'm'))
+        # Friday 22:00 to Sunday 22:00 UTC is closed, and 30 minutes are missing on Monday
+        keep = (index < np.datetime64('2024-10-04T22:00')) | (index >= np.datetime64('2024-10-06T22:00'))
+        keep &= (index < np.datetime64('2024-10-07T01:10')) | (index >= np.datetime64('2024-10-07T01:40'))
+        index = index[keep]
+
+        close = 1.1 + np.cumsum(rng.normal(0, 1e-4, len(index)))
+        self.arrays = {
+            INDEX_COLUMN: index,
+            'Open': np.append(1.1, close[:-1]),
+            'High': close + 1e-4,
+            'Low': close - 1e-4,
+            'Close': close,
+            VOLUME_COLUMN: rng.integers(0, 100, len(index)),
+        }
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+
+    def test_resample(self):
+        """Test that bars match a scan of the source bars of every bucket."""
+        arrays = self.arrays
+        for interval, tz in (('5m', None), ('1h', '+05:30'), ('1d', 'Europe/London'), ('1d', None)):
+            bars = resample(arrays, interval, tz)
+            offsets = utc_offsets(arrays[INDEX_COLUMN], tz)
+            local = arrays[INDEX_COLUMN] + offsets
+            step = interval_step(interval)
+
+            buckets = (local - EPOCH) // step
+            self.assertEqual(len(bars[INDEX_COLUMN]), len(np.unique(buckets)))
+            for indx, bucket in enumerate(np.unique(buckets)):
+                rows = buckets == bucket
+                self.assertEqual(bars['Open'][indx], arrays['Open'][rows][0])
+                self.assertEqual(bars['High'][indx], arrays['High'][rows].max())
+                self.assertEqual(bars['Low'][indx], arrays['Low'][rows].min())
+                self.assertEqual(bars['Close'][indx], arrays['Close'][rows][-1])
+                self.assertEqual(bars[VOLUME_COLUMN][indx], arrays[VOLUME_COLUMN][rows].sum())
+                self.assertEqual(bars[INDEX_COLUMN][indx] + offsets[rows][0], EPOCH + bucket * step)
+
+        daily = resample(arrays, '1d', 'Europe/London')
+        # Local midnight of British summer time is 23:00 UTC
+        self.assertEqual(daily[INDEX_COLUMN][-1], np.datetime64('2024-10-06T23:00', 'ns'))
+
+    def test_fill_gaps(self):
+        """Test that filled gaps are flat bars at the previous close without volume."""
+        bars = resample(self.arrays, '10m', fill_gaps=True)
+        self.assertTrue(np.all(np.diff(bars[INDEX_COLUMN]) == np.timedelta64(10, 'm')))
+
+        gap = np.searchsorted(bars[INDEX_COLUMN], np.datetime64('2024-10-07T01:20', 'ns'))
+        self.assertEqual(bars[VOLUME_COLUMN][gap], 0)
+        self.assertEqual(bars['Open'][gap], bars['Close'][gap - 1])
+        self.assertEqual(bars['High'][gap], bars['Close'][gap - 1])
+
+    def test_derived_history(self):
+        """Test that derived histories are cached, extended when the source grows, and equal a full resample."""
+        folder = os.path.join(self.root, 'Trade_of_EUR_GBP')
+        source_path = store_path(folder, 'EUR', 'GBP', '1m')
+        half = len(self.arrays[INDEX_COLUMN]) // 2
+
+        first = {name: values[:half] for name, values in self.arrays.items()}
+        save_arrays(source_path, first.pop(INDEX_COLUMN), first, tz='+01:00', interval='1m')
+        self.assertEqual(finest_history(folder, 'EUR', 'GBP', '15m'), source_path)
+        self.assertIsNone(finest_history(folder, 'EUR', 'JPY', '15m'))
+
+        bars = interval_history(folder, 'EUR', 'GBP', '15m')
+        path = store_path(folder, 'EUR', 'GBP', '15m')
+        modified = os.path.getmtime(os.path.join(path, 'Close.npy'))
+        self.assertEqual(len(interval_history(folder, 'EUR', 'GBP', '15m')['Close']), len(bars['Close']))
+        self.assertEqual(os.path.getmtime(os.path.join(path, 'Close.npy')), modified)
+
+        full = dict(self.arrays)
+        save_arrays(source_path, full.pop(INDEX_COLUMN), full, tz='+01:00', interval='1m')
+        bars = interval_history(folder, 'EUR', 'GBP', '15m')
+        expected = resample(self.arrays, '15m', '+01:00')
+        for name, values in expected.items():
+            np.testing.assert_array_equal(bars[name], values)
+
+        # Derived histories are never taken as a source
+        self.assertEqual(list(stored_intervals(folder, 'EUR', 'GBP')), ['1m'])
+
+    def test_backfilled_source(self):
+        """Test that bars added before the first source bar rebuild the derived history in full."""
+        import pandas as pd
+        from Modules.PriceStore import prepend_history
+
+        folder = os.path.join(self.root, 'Trade_of_EUR_GBP')
+        source_path = store_path(folder, 'EUR', 'GBP', '1m')
+        half = len(self.arrays[INDEX_COLUMN]) // 2
+
+        tail = {name: values[half:] for name, values in self.arrays.items()}
+        save_arrays(source_path, tail.pop(INDEX_COLUMN), tail, tz='UTC', interval='1m')
+        interval_history(folder, 'EUR', 'GBP', '15m')
+
+        # Backfill the head of the source, as a longer fetched period does
+        head = {name: values[:half] for name, values in self.arrays.items()}
+        index = pd.DatetimeIndex(head.pop(INDEX_COLUMN), name=INDEX_COLUMN).tz_localize('UTC')
+        prepend_history(source_path, pd.DataFrame(head, index=index))
+        self.assertEqual(read_meta(source_path)['rows'], len(self.arrays[INDEX_COLUMN]))
+
+        bars = interval_history(folder, 'EUR', 'GBP', '15m')
+        for name, values in resample(self.arrays, '15m').items():
+            np.testing.assert_array_equal(bars[name], values)
+
+    def test_replace_fetched(self):
+        """Test that a fetched history of the interval is served, unless it is replaced by the resampled source."""
+        folder = os.path.join(self.root, 'Trade_of_EUR_GBP')
+        source_path, path = store_path(folder, 'EUR', 'GBP', '1m'), store_path(folder, 'EUR', 'GBP', '15m')
+
+        full = dict(self.arrays)
+        save_arrays(source_path, full.pop(INDEX_COLUMN), full, interval='1m')
+        stale = resample({name: values[:300] for name, values in self.arrays.items()}, '15m')
+        save_arrays(path, stale.pop(INDEX_COLUMN), stale, interval='15m')
+
+        self.assertEqual(len(derived_history(source_path, path, '15m')['Close']), 20)
+        bars = derived_history(source_path, path, '15m', replace_fetched=True)
+        for name, values in resample(self.arrays, '15m').items():
+            np.testing.assert_array_equal(bars[name], values)
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
@@ -0,0 +1,269 @@
+import os
+import csv
+import itertools
+import unittest
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from Modules.Backtest import rolling_forecasts, simulate_trades, non_overlapping, summarise
+from Modules.PriceStore import store_path, has_history, load_arrays
+from Modules.Forecast import floatArray
+from Modules.Trade import HOLD, trade_signal
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+PARAMETER SWEEP
+---------------
+Backtests every combination of forecast factor, loss threshold, profit threshold and borrowing fee
+on the stored history of every (pair, interval), and ranks the combinations in one table.
+
+The forecasts only depend on the forecast factor through the forecast size: the forecast of n steps
+is the closing rate plus n times the expected step of the window. The expected step of every window
+is computed once per history, in one process per history, and the trade signals of a forecast
+factor follow from it in one array operation. The cells of a forecast factor, one per combination of
+thresholds and fee, then run in one process per (history, forecast factor).
+"""
+
+# Column the sweep table is ranked by, highest first
+RANK_BY = 'total_profit'
+
+
+def sweep_paths(root: str, pairs: list, intervals: list) -> dict:
+    """
+    Store directories of the stored histories of pairs for every interval.
+
+    Args:
+        root (str): Directory holding the `Trade_of_X_Y` folders.
+        pairs (list of tuple): (sell_unit, buy_unit) of every pair.
+        intervals (list of str): Intervals of the histories (e.g. ['1m', '2m']).
+
+    Returns:
+        dict: Store directory of every (pair name, interval) with a stored history.
+    """
+    paths = {}
+    for (sell_unit, buy_unit), interval in itertools.product(pairs, intervals):
+        path = store_path(os.path.join(root, f'Trade_of_{sell_unit}_{buy_unit}'), sell_unit, buy_unit, interval)
+        if has_history(path):
+            paths[(f'{sell_unit}{buy_unit}', interval)] = path
+    return paths
+
+
+def expected_steps(path, window, step=1, use_relative_frequency=False, dtype=None):
+    """
+    Expected change per step of the forecast at every decision point of a stored history.
+
+    Args:
+        path (str): Store directory of the history.
+        window (int): Number of trailing closes each forecast sees.
+        step (int, optional): Number of bars between decision points. Defaults to 1.
+        use_relative_frequency (bool, optional): Whether to use relative frequencies in the forecast. Defaults to False.
+        dtype (np.dtype, optional): Float type of the forecasts, np.float32 halves their memory. Defaults to float64.
+
+    Returns:
+        tuple:
+            entries (np.array): Index of the bar of every decision point.
+            expected_step (np.array): Expected change of the forecast per step, from each decision point.
+    """
+    closes = load_arrays(path)['Close']
+    entries, forecasts = rolling_forecasts(closes, window, 1, step, use_relative_frequency, from_value=0.0, dtype=dtype)
+    return entries, forecasts[:, 1]
+
+
+def sweep_cells(path, entries, expected_step, window, forecast_factor, thresholds, spread=0.0,
+                investment_amount=1000, overlap=False, dtype=None):
+    """
+    Backtest the cells of one forecast factor on a stored history.
+
+    Args:
+        path (str): Store directory of the history.
+        entries (np.array): Decision points, as returned by `expected_steps`.
+        expected_step (np.array): Expected change per step at every decision point.
+        window (int): Number of trailing closes each forecast sees.
+        forecast_factor (float): Forecast size as a fraction of the window.
+        thresholds (list of tuple): (loss_threshold, profit_threshold, borrowing_fee) of every cell.
+        spread (float, optional): Spread paid on every trade. Defaults to 0.
+        investment_amount (float, optional): Amount invested in every trade. Defaults to 1000.
+        overlap (bool, optional): If False, no trade opens while another one is open. Defaults to False.
+        dtype (np.dtype, optional): Float type of the closes, np.float32 halves their memory. Defaults to float64.
+
+    Returns:
+        list of dict: The P&L summary of every cell (see `Backtest.summarise`).
+    """
+    closes = floatArray(load_arrays(path)['Close'], dtype)
+    size_forecast = max(int(window * forecast_factor), 1)
+
+    opening_rate = closes[entries]
+    actions = trade_signal(opening_rate + size_forecast * expected_step, opening_rate, spread)
+    traded = actions != HOLD
+    entries, actions = entries[traded], actions[traded]
+
+    summaries = []
+    for loss_threshold, profit_threshold, borrowing_fee in thresholds:
+        exit_index, exit_rate, exit_reason, profit = simulate_trades(
+            closes, entries, actions, size_forecast, spread, investment_amount,
+            loss_threshold, profit_threshold, borrowing_fee
+        )
+        ledger = {'entry_index': entries, 'action': actions, 'exit_index': exit_index, 'exit_reason': exit_reason, 'profit': profit}
+        if not overlap:
+            selected = non_overlapping(entries, exit_index)
+            ledger = {key: values[selected] for key, values in ledger.items()}
+        summaries.append(summarise(ledger))
+
+    return summaries
+
+
+def sweep(paths, forecast_factors=(1/3,), loss_thresholds=(200,), profit_thresholds=(100,), borrowing_fees=(0,),
+          window=5000, step=10, spread=0.0, investment_amount=1000, use_relative_frequency=False, overlap=False,
+          workers=None, rank_by=RANK_BY, dtype=None):
+    """
+    Backtest every combination of the parameter grids on every stored history and rank them.
+
+    Args:
+        paths (dict): Store directory of every (pair name, interval), see `sweep_paths`.
+        forecast_factors (list of float, optional): Forecast sizes as fractions of the window.
+        loss_thresholds (list of float, optional): Losses at which trades are closed, None for no loss barrier.
+        profit_thresholds (list of float, optional): Profits at which trades are closed, None for no profit barrier.
+        borrowing_fees (list of float, optional): Fees on the borrowed amount of a sell.
+        window (int, optional): Number of trailing closes each forecast sees. Defaults to 5000.
+        step (int, optional): Number of bars between decision points. Defaults to 10.
+        spread (float, optional): Spread paid on every trade. Defaults to 0.
+        investment_amount (float, optional): Amount invested in every trade. Defaults to 1000.
+        use_relative_frequency (bool, optional): Whether to use relative frequencies in the forecast. Defaults to False.
+        overlap (bool, optional): If False, no trade opens while another one is open. Defaults to False.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        rank_by (str, optional): Summary column ranking the rows, highest first. Defaults to RANK_BY.
+        dtype (np.dtype, optional): Float type of the closes and forecasts, np.float32 halves their memory. Defaults to float64.
+
+    Returns:
+        list of dict: One row per pair, interval and parameter combination, with its parameters, its
+            P&L summary and its rank, ordered by rank.
+    """
+    thresholds = list(itertools.product(loss_thresholds, profit_thresholds, borrowing_fees))
+    keys = list(paths)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # The expected steps of a history serve every forecast factor
+        steps = dict(zip(keys, executor.map(
+            expected_steps, [paths[key] for key in keys], [window] * len(keys),
+            [step] * len(keys), [use_relative_frequency] * len(keys), [dtype] * len(keys)
+        )))
+
+        cells = {
+            (key, forecast_factor): executor.submit(
+                sweep_cells, paths[key], *steps[key], window, forecast_factor, thresholds,
+                spread, investment_amount, overlap, dtype
+            )
+            for key in keys for forecast_factor in forecast_factors
+        }
+
+        rows = []
+        for ((pair, interval), forecast_factor), cell in cells.items():
+            for (loss_threshold, profit_threshold, borrowing_fee), summary in zip(thresholds, cell.result()):
+                rows.append({
+                    'pair': pair,
+                    'interval': interval,
+                    'forecast_factor': forecast_factor,
+                    'loss_threshold': loss_threshold,
+                    'profit_threshold': profit_threshold,
+                    'borrowing_fee': borrowing_fee,
+                    **summary,
+                })
+
+    rows.sort(key=lambda row: row[rank_by], reverse=True)
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+
+    return rows
+
+
+def write_table(file_path: str, rows: list):
+    """Write sweep rows to a CSV file, rank first."""
+    if not rows:
+        return
+    fieldnames = ['rank', *(key for key in rows[0] if key != 'rank')]
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+#___Unit Testing____#
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a stored random walk quantised like forex closes."""
+        import tempfile
+        from Modules.PriceStore import save_arrays
+
+        steps = np.random.default_rng(3).normal(scale=5e-4, size=4000)
+        self.closes = np.round(1.1 + np.cumsum(steps), 5)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'EUR_GBP_1m')
+        index = np.datetime64('2024-10-01T00:00', 'ns') + np.arange(len(self.closes)) * np.timedelta64(1, 'm')
+        save_arrays(self.path, index, {'Close': self.closes})
+
+    def test_sweep(self):
+        """Test that every cell matches a backtest with its parameters and rows are ranked."""
+        from Modules.Backtest import backtest
+
+        rows = sweep(
+            {('EURGBP', '1m'): self.path}, forecast_factors=(0.1, 0.25), loss_thresholds=(3, 10),
+            profit_thresholds=(3, None), borrowing_fees=(0, 0.001), window=500, step=10, spread=1e-4, workers=2
+        )
+        self.assertEqual(len(rows), 16)
+        self.assertEqual([row['rank'] for row in rows], list(range(1, 17)))
+        self.assertTrue(all(a[RANK_BY] >= b[RANK_BY] for a, b in zip(rows, rows[1:])))
+
+        for row in rows:
+            _, summary = backtest(
+                self.closes, 500, row['forecast_factor'], step=10, spread=1e-4, loss_threshold=row['loss_threshold'],
+                profit_threshold=row['profit_threshold'], borrowing_fee=row['borrowing_fee']
+            )
+            self.assertEqual({key: row[key] for key in summary}, summary)
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
+
+    def optional_float(value):
+        return None if value.lower() == 'none' else float(value)
+
+    parser = argparse.ArgumentParser(description='Sweep trade parameters over stored pair histories.')
+    parser.add_argument('pairs', nargs='+', help='Pairs as SELL_BUY (e.g. EUR_GBP)')
+    parser.add_argument('--dir', default='', help='Directory holding the Trade_of_X_Y folders')
+    parser.add_argument('--intervals', nargs='+', default=['2m'])
+    parser.add_argument('--forecast-factors', type=float, nargs='+', default=[1/3])
+    parser.add_argument('--loss-thresholds', type=optional_float, nargs='+', default=[200])
+    parser.add_argument('--profit-thresholds', type=optional_float, nargs='+', default=[100])
+    parser.add_argument('--borrowing-fees', type=float, nargs='+', default=[0])
+    parser.add_argument('--window', type=int, default=5000)
+    parser.add_argument('--step', type=int, default=10)
+    parser.add_argument('--spread', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--rank-by', default=RANK_BY)
+    parser.add_argument('--float32', action='store_true', help='Compute in float32, halving the memory of the histories')
+    parser.add_argument('--top', type=int, default=20, help='Number of rows printed')
+    parser.add_argument('--output', help='CSV file of the full table')
+    args = parser.parse_args()
+
+    paths = sweep_paths(args.dir, [tuple(pair.split('_')) for pair in args.pairs], args.intervals)
+    rows = sweep(
+        paths, args.forecast_factors, args.loss_thresholds, args.profit_thresholds, args.borrowing_fees,
+        window=args.window, step=args.step, spread=args.spread, workers=args.workers, rank_by=args.rank_by,
+        dtype=np.float32 if args.float32 else None
+    )
+
+    columns = ['rank', 'pair', 'interval', 'forecast_factor', 'loss_threshold', 'profit_threshold', 'borrowing_fee',
+               'trades', 'win_rate', 'total_profit', 'max_drawdown']
+    print(''.join(f'{column:>18}' for column in columns))
+    for row in rows[:args.top]:
+        print(''.join(f'{row[column]:>18.6g}' if isinstance(row[column], float) else f'{str(row[column]):>18}' for column in columns))
+
+    if args.output:
+        write_table(args.output, rows)
@@ -0,0 +1,84 @@
+import numpy as np
+
+"""
+TRADE RULES
+-----------
+Actions are coded as SELL = -1, HOLD = 0 and BUY = 1 so they can be held in arrays.
+
+A sell closes with profit factor  opening_rate / (closing_rate + spread) - (1 + borrowing_fee)
+A buy closes with profit factor   closing_rate / (opening_rate + spread) - 1
+
+Every function accepts scalars or arrays and broadcasts its arguments.
+"""
+
+SELL, HOLD, BUY = -1, 0, 1
+ACTIONS = {SELL: 'sell', HOLD: 'hold', BUY: 'buy'}
+
+
+def trade_signal(forecast, current_sell_rate, spread):
+    """
+    Decides the action for a forecast closing rate.
+
+    :param forecast: Expected closing rate.
+    :param current_sell_rate: Current sell (bid) rate.
+    :param spread: Spread between the buy and sell rate.
+    :return: SELL if the forecast is below the rate less the spread, BUY if above the rate plus the spread, else HOLD.
+    """
+    forecast, current_sell_rate = np.asarray(forecast), np.asarray(current_sell_rate)
+    signal = np.where(forecast < current_sell_rate - spread, SELL, np.where(forecast > current_sell_rate + spread, BUY, HOLD))
+    return signal if signal.ndim else int(signal)
+
+
+def profit_factor(closing_rate, opening_rate, spread, action, borrowing_fee=0):
+    """
+    Profit per unit of investment when a position opened at `opening_rate` closes at `closing_rate`.
+
+    :param closing_rate: Closing rate(s) of the position.
+    :param opening_rate: Sell rate when the position was opened.
+    :param spread: Spread when the position was opened.
+    :param action: SELL or BUY (HOLD gives NaN).
+    :param borrowing_fee: Fee on the borrowed amount of a sell.
+    :return: The profit factor(s).
+    """
+    closing_rate, opening_rate, action = np.asarray(closing_rate), np.asarray(opening_rate), np.asarray(action)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(
+            action == SELL, opening_rate / (closing_rate + spread) - (1 + borrowing_fee),
+            np.where(action == BUY, closing_rate / (opening_rate + spread) - 1, np.nan)
+        )
+    return factor if factor.ndim else float(factor)
+
+
+def rate_thresholds(opening_rate, spread, investment_amount, loss_threshold, profit_threshold, action, borrowing_fee=0):
+    """
+    Closing rates at which a position loses `loss_threshold` or gains `profit_threshold`.
+
+    A sell loses above its loss rate and gains below its profit rate, a buy the other way round.
+
+    :param opening_rate: Sell rate when the position was opened.
+    :param spread: Spread when the position was opened.
+    :param investment_amount: Amount invested in the position.
+    :param loss_threshold: Loss at which to close the position. None for no loss barrier.
+    :param profit_threshold: Profit at which to close the position. None or 0 for no profit barrier.
+    :param action: SELL or BUY (HOLD gives NaN).
+    :param borrowing_fee: Fee on the borrowed amount of a sell.
+    :return: Tuple of (rate_loss_threshold, rate_profit_threshold), NaN where a barrier is not set.
+    """
+    opening_rate, action = np.asarray(opening_rate, dtype=np.float64), np.asarray(action)
+
+    # A NaN threshold gives a NaN rate, i.e. no barrier
+    loss = np.nan if loss_threshold is None else -np.asarray(loss_threshold, dtype=np.float64)
+    profit = np.nan if profit_threshold is None else np.asarray(profit_threshold, dtype=np.float64)
+    profit = np.where(profit == 0, np.nan, profit)
+
+    def rate(threshold):
+        return np.where(
+            action == SELL, opening_rate * (investment_amount / (threshold + investment_amount * (1 + borrowing_fee))) - spread,
+            np.where(action == BUY, (opening_rate + spread) * (threshold / investment_amount + 1), np.nan)
+        )
+
+    rate_loss, rate_profit = rate(loss), rate(profit)
+    if rate_loss.ndim == 0 and rate_profit.ndim == 0:
+        return float(rate_loss), float(rate_profit)
+    return rate_loss, rate_profit
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import subprocess
+import tracemalloc
+import numpy as np
+from Modules.DataModification import DataMod
+from Modules.DistributionCache import DistributionCache
+from Modules.Forecast import forecastData, forecastHorizons
+from Modules.OnlineDistribution import OnlineDistribution
+from Modules.Providers import MarketDataProvider
+from Modules.PriceMatrix import PriceMatrix
+from Modules.Portfolio import positions, evaluate_portfolio
+from Modules.Trade import SELL, BUY
+from Modules.FirstPassage import threshold_analysis
+from Modules.PriceStore import read_legacy_dump
+
+"""
+BENCHMARKS
+----------
+Time and peak memory of the DataMod and forecast hot paths, and of the modules built on them, on
+the stored pair histories and on synthetic random walks of 10^3 to 10^7 points. Timing checks of
+those modules live here rather than in their unit tests, which only check behaviour. A run is compared against a saved baseline, and
+any case slower or larger than the baseline beyond the tolerance fails the run.
+
+    python benchmark.py --save-baseline      # record the baseline of this machine
+    python benchmark.py                      # compare against it, exit 1 on a regression
+    python benchmark.py --startup            # check the import time of main_trade against its budget
+
+Short runs of main_trade.py (e.g. from cron) are dominated by imports, so the startup check times
+`import main_trade` in fresh interpreters and fails when it exceeds STARTUP_BUDGET, or when it
+imports a module of STARTUP_FORBIDDEN: those are only imported once a fetch needs them.
+"""
+
+# Legacy dumps of the stored histories, converted to the store on first use
+STORED_HISTORIES = {
+    'EUR_GBP': 'Trade_of_EUR_GBP/EUR_GBP.csv',
+    'EUR_AUD': 'Trade_1_day/Trade_of_EUR_AUD/EUR_AUD.csv',
+    'USD_ZAR': 'Trade_1_day/Trade_of_USD_ZAR/USD_ZAR.csv',
+}
+SYNTHETIC_SIZES = [10**3, 10**4, 10**5, 10**6, 10**7]
+
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# Allowed growth over the baseline before a case counts as a regression
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.2
+
+# Minimum total time of the timed calls of a case, in seconds
+MIN_TIME = 0.2
+
+# Import time allowed for main_trade in seconds, and modules it must not import
+STARTUP_MODULE = 'main_trade'
+STARTUP_BUDGET = 0.5
+STARTUP_FORBIDDEN = ('yfinance', 'requests', 'pandas')
+STARTUP_RUNS = 5
+
+
+def _bin_edges(data):
+    return np.quantile(data, [0, 0.25, 0.5, 0.75, 1]).tolist()
+
+
+def _online_tick(data):
+    # A window of the whole series: every call adds one close, expires the oldest and bins the window.
+    # The time per call should stay flat from one size to the next.
+    online, closes = OnlineDistribution(data, window=len(data)), itertools.cycle(data[:1000].tolist())
+    return lambda: (online.add(next(closes)), online.distribution())
+
+
+class _SleepingProvider(MarketDataProvider):
+    # Quotes after a fixed wait, like a request to a remote provider
+    async def _quote(self, from_currency, to_currency):
+        await asyncio.sleep(0.01)
+        return 1.0, 1.0, 0.0
+
+
+def _provider_quotes(data):
+    # 20 overlapping requests take one wait, not 20
+    provider_pairs = [('EUR', 'GBP')] * 20
+    return lambda: asyncio.run(_SleepingProvider(max_concurrency=20).quotes(provider_pairs))
+
+
+def _portfolio(data):
+    # 500 positions over three pairs moving with the series, its reverse and a shifted copy
+    rng = np.random.default_rng(0)
+    values = np.stack([data, data[::-1], np.roll(data, len(data) // 2)], axis=1)
+    matrix = PriceMatrix(np.datetime64('2024-10-01', 'ns') + np.arange(len(data)).astype('timedelta64[m]'), values, ['EURUSD', 'GBPUSD', 'USDZAR'])
+    book = positions(
+        rng.choice(['EURUSD', 'GBPUSD', 'USDZAR', 'ZARUSD'], 500), rng.choice([SELL, BUY], 500), rng.uniform(100, 5000, 500),
+        rng.uniform(0.9, 1.1, 500), 1e-4, horizons=rng.integers(1, max(len(data) // 10, 2), 500)
+    )
+    return lambda: evaluate_portfolio(book, matrix)
+
+
+# Every case builds the call to time from the input series, outside the timed section.
+# Cases with an input size cap are skipped on larger series.
+CASES = {
+    'binCounts': (lambda data: (lambda edges=_bin_edges(data): DataMod().binCounts(edges, data)), None),
+    'linearise': (lambda data: (lambda: DataMod().linearise(data)), None),
+    'deviation': (lambda data: (lambda linear=DataMod().linearise(data): DataMod().deviation(linear, data, return_elements=False)), None),
+    # Builds the deviations of every pair of elements: quadratic time and memory
+    'deviation_elements': (lambda data: (lambda linear=DataMod().linearise(data): DataMod().deviation(linear, data)), 10**3),
+    'distribution_deviation': (lambda data: (lambda diff=np.diff(data): DataMod().distribution(diff, std_dev=False)), None),
+    'distribution': (lambda data: (lambda diff=np.diff(data): DataMod().distribution(diff)), None),
+    # Repeated window: every timed call but the first is a hit of the memory tier
+    'distribution_cached': (lambda data: (lambda diff=np.diff(data), data_mod=DataMod(cache=DistributionCache()): data_mod.distribution(diff)), None),
+    'expectation': (lambda data: (lambda probabilities=np.full(len(data), 1 / len(data)): DataMod().expectation(len(data), data, probabilities)), None),
+    'forecastData': (lambda data: (lambda: forecastData(data, size_forecast=len(data) // 3)), None),
+    'forecastHorizons': (lambda data: (lambda: forecastHorizons(data, size_forecasts=[30, 120, 720, len(data) // 3])), None),
+    'online_tick': (_online_tick, 10**6),
+    # Scenarios x positions of profits: memory grows with the series times 500
+    'portfolio': (_portfolio, 10**4),
+    # Horizon of a third of the series, the tables of maxima take (chunk + horizon) log horizon
+    'first_passage': (lambda data: (lambda: threshold_analysis(data, data[0], data[0] * 1.003, data[0] * 0.996, len(data) // 3)), 10**6),
+    # Does not depend on the series, run once on the smallest
+    'provider_quotes': (_provider_quotes, 10**3),
+}
+
+
+def synthetic_series(size: int, seed: int = 0) -> np.ndarray:
+    """Random walk of forex-like closes."""
+    rng = np.random.default_rng(seed)
+    return 1.1 + np.cumsum(rng.normal(0, 1e-4, size))
+
+
+def stored_series(root: str = '') -> dict:
+    """Closes of the stored histories, keyed by pair name."""
+    series = {}
+    for name, file_path in STORED_HISTORIES.items():
+        file_path = os.path.join(root, file_path)
+        if os.path.exists(file_path):
+            series[name] = np.asarray(read_legacy_dump(file_path)[1]['Close'])
+    return series
+
+
+def measure(function) -> dict:
+    """
+    Time and peak memory of a call.
+
+    :param function: Callable without arguments.
+    :return: Dict with the best time per call in seconds, the number of calls timed, and the peak
+        memory allocated during one call in bytes.
+    """
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+
+    # Repeat fast calls until MIN_TIME is spent, keeping the best one
+    calls, best = 1, elapsed
+    while elapsed < MIN_TIME:
+        start = time.perf_counter()
+        function()
+        call_time = time.perf_counter() - start
+        calls, best, elapsed = calls + 1, min(best, call_time), elapsed + call_time
+
+    # Tracing slows the call down, so memory is measured on a separate call
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': best, 'calls': calls, 'peak_bytes': peak}
+
+
+def run(cases=None, sizes=SYNTHETIC_SIZES, root: str = '', stored: bool = True, log: bool = True) -> dict:
+    """
+    Benchmark the cases on every input.
+
+    :param cases: Names of the cases to run. Defaults to every case of CASES.
+    :param sizes: Sizes of the synthetic series.
+    :param root: Directory holding the trade folders of the stored histories.
+    :param stored: If False, the stored histories are not benchmarked.
+    :param log: If True, print every result as it is measured.
+    :return: Nested dict of case name -> input name -> measurement (see `measure`), or {'error': ...}
+        when the case raised on that input.
+    """
+    inputs = stored_series(root) if stored else {}
+    inputs.update({f'synthetic_{size}': synthetic_series(size) for size in sizes})
+
+    results = {}
+    for case in cases or CASES:
+        setup, cap = CASES[case]
+        results[case] = {}
+        for name, data in inputs.items():
+            if cap is not None and len(data) > cap:
+                continue
+            try:
+                result = results[case][name] = measure(setup(data))
+            except Exception as error:
+                # A failing case is recorded and reported, the other cases still run
+                result = results[case][name] = {'error': repr(error)}
+            if log and 'error' in result:
+                print(f'{case:<24}{name:<20}{result["error"]}')
+            elif log:
+                print(f'{case:<24}{name:<20}{result["seconds"] * 1e3:>12.3f} ms{result["peak_bytes"] / 2**20:>12.2f} MiB')
+
+    return results
+
+
+def startup(module: str = STARTUP_MODULE, runs: int = STARTUP_RUNS, root: str = '') -> dict:
+    """
+    Import time of a module in fresh interpreters.
+
+    :param module: Module to import.
+    :param runs: Number of interpreters started, the fastest import counts.
+    :param root: Directory to import the module from.
+    :return: Dict with the best import time in seconds and the forbidden modules it imported.
+    """
+    script = (
+        'import sys, time\n'
+        'start = time.perf_counter()\n'
+        f'import {module}\n'
+        'print(time.perf_counter() - start)\n'
+        f'print(",".join(name for name in {STARTUP_FORBIDDEN!r} if name in sys.modules))\n'
+    )
+    seconds, imported = [], set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', script], cwd=root or None, capture_output=True, text=True, check=True).stdout.split('\n')
+        seconds.append(float(output[0]))
+        imported.update(filter(None, output[1].split(',')))
+
+    return {'seconds': min(seconds), 'forbidden_imports': sorted(imported)}
+
+
+def compare(results: dict, baseline: dict, time_tolerance: float = TIME_TOLERANCE, memory_tolerance: float = MEMORY_TOLERANCE) -> list:
+    """
+    Regressions of a run against a baseline.
+
+    :return: List of messages, one per case and input slower or larger than the baseline allows.
+    """
+    regressions = []
+    for case, inputs in results.items():
+        for name, result in inputs.items():
+            reference = baseline.get(case, {}).get(name)
+            if reference is None:
+                continue
+            if 'error' in result:
+                if 'error' not in reference:
+                    regressions.append(f'{case} on {name}: {result["error"]}')
+                continue
+            if 'error' in reference:
+                continue
+            if result['seconds'] > reference['seconds'] * (1 + time_tolerance):
+                regressions.append(f'{case} on {name}: {result["seconds"]:.6f} s, baseline {reference["seconds"]:.6f} s')
+            if result['peak_bytes'] > reference['peak_bytes'] * (1 + memory_tolerance):
+                regressions.append(f'{case} on {name}: {result["peak_bytes"]} B peak, baseline {reference["peak_bytes"]} B')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the DataMod and forecast functions.')
+    parser.add_argument('cases', nargs='*', choices=[[], *CASES], help='Cases to run. Defaults to every case')
+    parser.add_argument('--sizes', type=int, nargs='*', default=SYNTHETIC_SIZES, help='Sizes of the synthetic series')
+    parser.add_argument('--no-stored', action='store_true', help='Skip the stored histories')
+    parser.add_argument('--dir', default='', help='Directory holding the trade folders')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='Save this run as the baseline instead of comparing')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument('--startup', action='store_true', help=f'Check the import time of {STARTUP_MODULE} instead')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET)
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        result = startup(root=args.dir)
+        print(f'import {STARTUP_MODULE}: {result["seconds"] * 1e3:.1f} ms, budget {args.startup_budget * 1e3:.0f} ms')
+        for name in result['forbidden_imports']:
+            print(f'REGRESSION import {STARTUP_MODULE} imports {name}')
+        return 1 if result['seconds'] > args.startup_budget or result['forbidden_imports'] else 0
+
+    results = run(args.cases, args.sizes, args.dir, stored=not args.no_stored)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=4)
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --save-baseline first')
+        return 0
+
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.time_tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,29 @@
 # 1. Import necessary modules and functions
 import os
+import sys
 import time
-import json
-import pickle
-import pandas as pd
+import asyncio
+import argparse
 import numpy as np
-from Modules.Forecast import forecastData
-from Modules.Forex import hist_forex, forexRate
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from Modules.Forecast import forecastData, forecastMonteCarlo, forecastHorizons, horizonSizes
+from Modules.Forex import hist_forex, hist_forex_incremental, forexRate
+from Modules.Providers import ReplayProvider, YahooProvider
+from Modules.Daemon import TickDaemon
+from Modules.RateMatrix import RateMatrix
+from Modules.PriceMatrix import PriceMatrix
+from Modules.Portfolio import positions_from_outputs, evaluate_portfolio
+from Modules.FirstPassage import threshold_analysis
+from Modules.PriceStore import store_path, save_history, has_history, convert_legacy_file, history_arrays
+from Modules.Resample import finest_history, derived_history, interval_history, resample
 from Modules.ReadWrite import write_output_to_file
+from Modules.Journal import JournalWriter, journal_record, BINARY_EXTENSION, JSONL_EXTENSION
+from Modules import Instrumentation, DistributionCache
+from Modules.Instrumentation import stage, count, observe
+from Modules.Trade import ACTIONS, HOLD, SELL, trade_signal, profit_factor, rate_thresholds
 
 
-# 2. Set display options for pandas and numpy
-np.set_printoptions(threshold=np.inf)
-pd.set_option('display.max_rows', None)
-pd.set_option('display.max_columns', None)
-pd.set_option('display.max_seq_items', None)
-
-
-# 3. Constants & Trading settings
-current_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+# 2. Constants & Trading settings
 sell_unit = 'EUR'
 buy_unit = 'GBP'
 currency_investment = 'ZAR'
@@ -35,68 +40,28 @@ param_period = {
     'interval': '2m'
 }
 forecast_factor = 1/3
+FORECAST_FUNCTION = forecastData
+FORECAST_FUNCTIONS = {function.__name__: function for function in (forecastData, forecastMonteCarlo)}
 
-# 4. Data Loading: Fetch or load data
-fetch_external_data = True
-save_external_data = True
-over_write_save = True
-
-write_variables = True
-allow_file_overwrite = True
-use_binary_format = False
-save_to_json = True
-use_csv_format = True
-
-# Trade folder path
-trade_folder_path = f'Trade_of_{sell_unit}_{buy_unit}/'
-external_file_name = f'{trade_folder_path}{sell_unit}_{buy_unit}'
-write_file = f'{trade_folder_path}{sell_unit}_{buy_unit}'
-
-# Ensure trade folder exists
-os.makedirs(os.path.dirname(trade_folder_path), exist_ok=True) if os.path.dirname(trade_folder_path) else None
-
-if fetch_external_data:
-    raw_data = hist_forex(sell_unit, buy_unit, **param_period).dropna()
-else:
-    local_data_path = external_file_name
-    raw_data = pd.read_csv(local_data_path)
-
-# Save external data
-if save_external_data: 
-    file_extension = '.csv'
-    with open(f'{external_file_name}{file_extension}', 'w') as file:
-        file.write(str(raw_data))
-
-data = raw_data['Close'].to_list()
+# Finest interval fetched, every coarser interval is resampled from its store (see `Modules.Resample`).
+# None fetches every interval itself
+base_interval = None
 
+# Horizons forecast along with the forecast size, as lengths of time (e.g. ['1h', '4h', '1d']), None for none
+forecast_horizons = None
 
-###____TRADE SECTION____###
+# Estimate from the history how often, and how soon, the thresholds of a trade are reached (see `Modules.FirstPassage`)
+first_passage = False
 
-# Current rate and spread
-current_sell_rate, current_buy_rate, spread = forexRate(sell_unit, buy_unit)
+# Options of forecastMonteCarlo, whose quantiles are saved with the output
+monte_carlo = {
+    'num_paths': 10_000,
+    'quantiles': (0.05, 0.25, 0.5, 0.75, 0.95),
+    'seed': None,
+}
 
-# 1. Forecast Calculation
-FORECAST_FUNCTION = forecastData
-size_forecast = int(len(data)*forecast_factor)
-distr_forecast = FORECAST_FUNCTION(data, current_sell_rate, size_forecast)
-min_forecast, forecast, max_forecast = distr_forecast
-
-print(f'SIZE FORECAST {size_forecast}\nCURRENT RATE {current_sell_rate}\nFORECAST IS {forecast}\n')
-
-# 2. Trade Logic
-if forecast < current_sell_rate - spread:
-    action = 'sell'
-    unit_a = sell_unit
-    distr_profit_factor = [current_sell_rate / (n + spread) - (1 + borrowing_fee) for n in distr_forecast]
-elif forecast > current_sell_rate + spread:
-    action = 'buy'
-    unit_a = buy_unit
-    distr_profit_factor = [n / (current_sell_rate + spread) - 1 for n in distr_forecast]
-else:
-    print('NO TRADE')
-    exit()
-    action = 'hold'
-    distr_profit_factor = []
+# Float type of the histories: np.float32 halves their memory, at about 7 significant digits
+DTYPE = np.float64
 
 # Toggle to determine if trade amount is in sell units
 amount_in_sell_units = True
@@ -104,88 +69,755 @@ trade_amount_a = 1000
 loss_threshold = 200
 profit_threshold = 100
 
-# Further calculations
-trade_amount_b = trade_amount_a * (current_sell_rate + spread)
-investment_amount = trade_amount_a
-
-rate_inv_unit_a = (
-    1 if currency_investment == unit_a else 
-    forexRate(currency_investment, unit_a)
-    )[0]
-rate_unit_a_sell = 1 if action == 'sell' else 1 / (current_sell_rate + spread)
-
-if amount_in_sell_units:
-    investment_amount = trade_amount_a / (rate_inv_unit_a * rate_unit_a_sell)
-else:
-    trade_amount_a = investment_amount * rate_inv_unit_a * rate_unit_a_sell
-    trade_amount_b = trade_amount_a * (current_sell_rate + spread)
-
-# Loss and profit threshold
-rate_loss_threshold = (
-    current_sell_rate * (investment_amount/(-loss_threshold + investment_amount * (1 + borrowing_fee))) - spread
-    if action == 'sell' else
-    (current_sell_rate + spread) * (-loss_threshold/investment_amount + 1)
-    if action == 'buy' else None
-)
-rate_profit_threshold = (
-    current_sell_rate * (investment_amount/(profit_threshold + investment_amount * (1 + borrowing_fee))) - spread
-    if action == 'sell' else
-    (current_sell_rate + spread) * (profit_threshold/investment_amount + 1)
-    if action == 'buy' else None
-) if profit_threshold else profit_threshold
-
-
-# 3. Profit Calculation
-investment_rate_a = forexRate(currency_investment, unit_a)[0]
-immediate_loss = investment_amount * (current_sell_rate / (current_sell_rate + spread) - 1)
-
-distr_profit = [
-    investment_amount * profit_factor
-    for profit_factor in distr_profit_factor
-]
-
-max_possible_loss = min(distr_profit)
-
-
-###____SAVED VARIABLES____###
-
-output_variables = {
-    'rate_given': f'"{sell_unit}{buy_unit}"',
-    'time_of_trade': f"'{current_time}'",
-    'trade_action': f'"{action}"',
-    'currency_investment': f'"{currency_investment}"',
-    'Forecast_Function': f'"{FORECAST_FUNCTION.__name__}"',
-}
+# 3. Data Loading: Fetch or load data
+fetch_external_data = True
+incremental_fetch = True
+save_external_data = True
+over_write_save = True
 
-for key, val in param_period.items():    
-    output_variables[key] = f"'{val}'"
-
-output_variables.update({
-    'data_size': len(data),
-    'forecast_factor': forecast_factor,
-    'forecast_size': size_forecast,
-    'price_spread': spread,
-    'borrowing_fee': borrowing_fee,
-    'amount_in_sell_units' : amount_in_sell_units,
-    'trade_amount_a' : trade_amount_a,
-    'trade_amount_b' : trade_amount_b if action == 'buy' else None,
-    'investment_amount': investment_amount,
-    'immediate_loss': immediate_loss,
-    'forecast_closing_rates': distr_forecast,
-    'distr_profit_factor': distr_profit_factor,
-    'distr_profit': distr_profit,
-    'rate_opening'.upper(): current_sell_rate,
-    'expected_closing_rate'.upper(): forecast,
-    'expected_profit': distr_profit[1],
-    'loss_threshold': loss_threshold,
-    'profit_threshold': profit_threshold,
-    f'rate_loss_threshold ({"<" if action == "sell" else ">" if action == "buy" else "Na"})': rate_loss_threshold,
-    f'rate_profit_threshold ({">" if action == "sell" else "<" if action == "buy" else "Na"})': rate_profit_threshold,
-}
-)
+write_variables = True
+allow_file_overwrite = True
+save_to_json = True
+use_csv_format = True
+
+# Journal every decision of every run is appended to, None to skip it (see `Modules.Journal`)
+journal_file = 'trade_journal'
+use_binary_format = False
 
-write_output_to_file(
-    write_file, output_variables, 
-    allow_file_overwrite=allow_file_overwrite, 
-    save_to_json=save_to_json
-)
+# Runner: worker counts of the fetch threads and the evaluation processes (None for the default)
+fetch_workers = 8
+evaluate_workers = None
+summary_file = 'trade_summary.json'
+
+# Directory of the distribution cache shared by runs and workers, None to compute every distribution (see `Modules.DistributionCache`)
+distribution_cache = None
+
+# Daemon: seconds between ticks, and longest wait for quotes on a tick
+poll_seconds = 5.0
+tick_budget = 2.0
+
+
+def default_settings() -> dict:
+    """Collect the settings above, so they can be overridden per run and sent to worker processes."""
+    return {
+        'currency_investment': currency_investment,
+        'borrowing_fee': borrowing_fee,
+        'param_period': dict(param_period),
+        'base_interval': base_interval,
+        'forecast_factor': forecast_factor,
+        'forecast_function': FORECAST_FUNCTION,
+        'forecast_horizons': forecast_horizons,
+        'monte_carlo': dict(monte_carlo),
+        'first_passage': first_passage,
+        'dtype': DTYPE,
+        'amount_in_sell_units': amount_in_sell_units,
+        'trade_amount_a': trade_amount_a,
+        'loss_threshold': loss_threshold,
+        'profit_threshold': profit_threshold,
+        'fetch_external_data': fetch_external_data,
+        'incremental_fetch': incremental_fetch,
+        'save_external_data': save_external_data,
+        'over_write_save': over_write_save,
+        'write_variables': write_variables,
+        'allow_file_overwrite': allow_file_overwrite,
+        'save_to_json': save_to_json,
+        'use_csv_format': use_csv_format,
+        'journal_file': journal_file,
+        'use_binary_format': use_binary_format,
+        'distribution_cache': distribution_cache,
+    }
+
+
+def trade_paths(sell_unit: str, buy_unit: str, root: str = '') -> dict:
+    """Trade folder, data file and output file of a pair under `root`."""
+    trade_folder_path = os.path.join(root, f'Trade_of_{sell_unit}_{buy_unit}/')
+    return {
+        'trade_folder_path': trade_folder_path,
+        'external_file_name': f'{trade_folder_path}{sell_unit}_{buy_unit}',
+        'write_file': f'{trade_folder_path}{sell_unit}_{buy_unit}',
+    }
+
+
+def discover_pairs(directory: str) -> list:
+    """Pairs of the `Trade_of_X_Y` folders in a directory, e.g. `Trade_1_day/`."""
+    pairs = []
+    for name in sorted(os.listdir(directory)):
+        parts = name.split('_')
+        if len(parts) == 4 and name.startswith('Trade_of_') and os.path.isdir(os.path.join(directory, name)):
+            pairs.append((parts[2], parts[3]))
+    return pairs
+
+
+def load_data(sell_unit: str, buy_unit: str, paths: dict, settings: dict):
+    """
+    Fetch the history of a pair, or load it from the store, and save it if required.
+
+    Fetched histories are DataFrames, stored ones are loaded as column arrays without pandas. With a
+    base interval, only the base interval is fetched and the interval is resampled from it.
+    """
+    period = settings['param_period']
+    history_path = store_path(paths['trade_folder_path'], sell_unit, buy_unit, period['interval'])
+
+    base = settings.get('base_interval')
+    if base and base != period['interval']:
+        base_settings = {**settings, 'param_period': {**period, 'interval': base}, 'base_interval': None}
+        base_data = load_data(sell_unit, buy_unit, paths, base_settings)
+        base_path = store_path(paths['trade_folder_path'], sell_unit, buy_unit, base)
+        if has_history(base_path) and (settings['save_external_data'] or not settings['fetch_external_data']):
+            # Always built from the base, a fetched history of the interval itself is replaced
+            return derived_history(base_path, history_path, period['interval'], replace_fetched=True)
+        # Base histories fetched without saving them are resampled as they are
+        arrays, tz = history_arrays(base_data)
+        return resample(arrays, period['interval'], tz)
+
+    # Ensure trade folder exists
+    os.makedirs(os.path.dirname(paths['trade_folder_path']), exist_ok=True) if os.path.dirname(paths['trade_folder_path']) else None
+
+    # Incremental fetches append to the stored history themselves, so they need saving to be on
+    fetch_incremental = (
+        settings['fetch_external_data'] and settings['incremental_fetch'] and settings['save_external_data']
+        and not period['start_date']
+    )
+
+    if fetch_incremental:
+        # Only downloads the bars newer than the stored history, which it updates
+        raw_data = hist_forex_incremental(sell_unit, buy_unit, history_path, period['period'], period['interval'])
+    elif settings['fetch_external_data']:
+        raw_data = hist_forex(sell_unit, buy_unit, **period).dropna()
+    else:
+        # Histories saved by older versions are text dumps, convert them once
+        if not has_history(history_path) and finest_history(paths['trade_folder_path'], sell_unit, buy_unit, period['interval']) is None:
+            convert_legacy_file(f'{paths["external_file_name"]}.csv')
+        # Intervals never fetched are resampled from a finer stored one
+        raw_data = interval_history(paths['trade_folder_path'], sell_unit, buy_unit, period['interval'])
+
+    # Save external data
+    if settings['save_external_data'] and settings['fetch_external_data']:
+        if not fetch_incremental:
+            save_history(history_path, raw_data, interval=period['interval'], overwrite=settings['over_write_save'])
+        if settings['use_csv_format']:
+            if fetch_incremental:
+                append_csv(f'{paths["external_file_name"]}.csv', raw_data)
+            else:
+                raw_data.to_csv(f'{paths["external_file_name"]}.csv')
+
+    return raw_data
+
+
+def append_csv(file_path: str, price_data):
+    """
+    Append the rows of a history newer than the last row of its CSV file.
+
+    The file is written in full when it is missing, has other columns or its last row has no
+    readable timestamp (e.g. a text dump of an older version).
+
+    Args:
+        file_path (str): Path of the CSV file.
+        price_data (pd.DataFrame): History indexed by a DatetimeIndex.
+    """
+    import pandas as pd
+
+    header = ','.join([price_data.index.name or ''] + [str(column) for column in price_data.columns])
+    try:
+        with open(file_path, 'rb') as file:
+            first_line = file.readline().decode().strip()
+            # Only the tail of the file is read for its last row
+            file.seek(0, os.SEEK_END)
+            file.seek(max(file.tell() - 4096, 0))
+            last_line = file.read().decode().strip().splitlines()[-1]
+        last_timestamp = pd.Timestamp(last_line.split(',')[0])
+        new_rows = price_data[price_data.index > last_timestamp] if first_line == header else None
+    except (OSError, IndexError, UnicodeDecodeError, ValueError, TypeError):
+        new_rows = None
+
+    if new_rows is None:
+        price_data.to_csv(file_path)
+    elif len(new_rows):
+        new_rows.to_csv(file_path, mode='a', header=False)
+
+
+def fetch_pair(sell_unit: str, buy_unit: str, paths: dict, settings: dict) -> dict:
+    """Network stage of a pair: its history and current quote."""
+    with stage('fetch'):
+        raw_data = load_data(sell_unit, buy_unit, paths, settings)
+    # A view of the stored column when it already has the dtype of the settings
+    closes = np.asarray(raw_data['Close'], dtype=settings['dtype'])
+    count('bars_fetched', len(closes))
+
+    with stage('quote'):
+        quote = forexRate(sell_unit, buy_unit)
+
+    return {'data': closes, 'quote': quote, 'quote_time': time.time()}
+
+
+def quote_or_error(from_currency: str, to_currency: str):
+    """Quote of a pair, or the exception raised fetching it."""
+    try:
+        return forexRate(from_currency, to_currency)
+    except Exception as error:
+        return error
+
+
+def conversion_matrix(pairs: list, currency_investment: str) -> RateMatrix:
+    """
+    Rate matrix converting the investment currency to every unit of the pairs.
+
+    The traded pairs are quoted along with the base pairs, so one batch of quotes serves both.
+    """
+    units = [currency_investment, *(unit for pair in pairs for unit in pair)]
+    base_pairs = RateMatrix.for_currencies(units).base_pairs
+    return RateMatrix(base_pairs + [tuple(pair) for pair in pairs])
+
+
+def conversion_rates(matrix: RateMatrix, sell_unit: str, buy_unit: str, currency_investment: str) -> dict:
+    """
+    Rate from the investment currency to both units of a pair, triangulated by the rate matrix.
+
+    Both units are converted, since which one is traded is only known after the forecast.
+    """
+    return {unit: matrix.rate(currency_investment, unit)[0] for unit in (sell_unit, buy_unit)}
+
+
+def evaluate_pair(sell_unit: str, buy_unit: str, data: list, quote: tuple, conversion_rates: dict, settings: dict,
+                  quote_time: float = None) -> dict:
+    """
+    Compute the forecast, trade decision and profit distribution of a pair.
+
+    Args:
+        sell_unit (str): The base currency code (e.g. 'EUR').
+        buy_unit (str): The quote currency code (e.g. 'GBP').
+        data (np.array): Closes of the pair history.
+        quote (tuple): Current sell rate, buy rate and spread of the pair.
+        conversion_rates (dict): Rate from the investment currency to each unit of the pair.
+        settings (dict): Trade settings (see `default_settings`).
+        quote_time (float, optional): Time the quote was received, the quote_to_decision latency runs from it.
+
+    Returns:
+        dict: The output variables of the run. The action is 'hold' when no trade is made. With
+            `settings['first_passage']`, trades also hold the first passage analysis of their thresholds.
+    """
+    current_sell_rate = quote[0]
+    forecast_function = settings['forecast_function']
+
+    ###____TRADE SECTION____###
+
+    # 1. Forecast Calculation
+    size_forecast = int(len(data)*settings['forecast_factor'])
+    horizons = settings['forecast_horizons'] or []
+    horizon_sizes = horizonSizes(horizons, settings['param_period']['interval'])
+    horizon_forecasts = None
+    with stage('forecast', size=len(data)):
+        if forecast_function is forecastMonteCarlo:
+            distr_forecast, forecast_quantiles = forecast_function(data, current_sell_rate, size_forecast, return_quantiles=True, **settings['monte_carlo'])
+        elif horizons and forecast_function is forecastData:
+            # The forecast size and the horizons from one distribution of the differences
+            forecasts = forecastHorizons(data, current_sell_rate, [size_forecast, *horizon_sizes])
+            distr_forecast, horizon_forecasts, forecast_quantiles = forecasts[0].tolist(), forecasts[1:], None
+        else:
+            distr_forecast, forecast_quantiles = forecast_function(data, current_sell_rate, size_forecast), None
+
+        if horizons and horizon_forecasts is None:
+            horizon_forecasts = forecastHorizons(data, current_sell_rate, horizon_sizes)
+
+    if horizon_forecasts is not None:
+        horizon_forecasts = dict(zip(horizons, horizon_forecasts.tolist()))
+
+    output_variables = decide_pair(
+        sell_unit, buy_unit, distr_forecast, len(data), size_forecast, quote, conversion_rates, settings,
+        quote_time, forecast_quantiles, horizon_forecasts
+    )
+
+    if settings['first_passage'] and output_variables['trade_action'] != ACTIONS[HOLD]:
+        rate_loss, rate_profit = (
+            value for key, value in output_variables.items() if key.startswith(('rate_loss_threshold', 'rate_profit_threshold'))
+        )
+        with stage('first_passage', size=len(data)):
+            output_variables['first_passage'] = threshold_analysis(data, current_sell_rate, rate_loss, rate_profit, size_forecast)
+
+    return output_variables
+
+
+def decide_pair(sell_unit: str, buy_unit: str, distr_forecast: list, data_size: int, size_forecast: int, quote: tuple,
+                conversion_rates: dict, settings: dict, quote_time: float = None, forecast_quantiles: dict = None,
+                horizon_forecasts: dict = None) -> dict:
+    """
+    Compute the trade decision and profit distribution of a pair from its forecast.
+
+    Args:
+        sell_unit (str): The base currency code (e.g. 'EUR').
+        buy_unit (str): The quote currency code (e.g. 'GBP').
+        distr_forecast (list): Forecasted lower bound, expected value and upper bound of the closing rate.
+        data_size (int): Number of closes the forecast is based on.
+        size_forecast (int): Number of steps forecast.
+        quote (tuple): Current sell rate, buy rate and spread of the pair.
+        conversion_rates (dict): Rate from the investment currency to each unit of the pair.
+        settings (dict): Trade settings (see `default_settings`).
+        quote_time (float, optional): Time the quote was received, the quote_to_decision latency runs from it.
+        forecast_quantiles (dict, optional): Forecast rate of every quantile, saved with the output.
+        horizon_forecasts (dict, optional): Forecasted lower bound, expected value and upper bound of every horizon,
+            saved with the output along with the action each would give.
+
+    Returns:
+        dict: The output variables of the run. The action is 'hold' when no trade is made.
+    """
+    current_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+    current_sell_rate, current_buy_rate, spread = quote
+    forecast_function = settings['forecast_function']
+    borrowing_fee = settings['borrowing_fee']
+    min_forecast, forecast, max_forecast = distr_forecast
+
+    print(f'{sell_unit}{buy_unit}\nSIZE FORECAST {size_forecast}\nCURRENT RATE {current_sell_rate}\nFORECAST IS {forecast}\n')
+
+    with stage('trade_math'):
+        # 2. Trade Logic
+        signal = trade_signal(forecast, current_sell_rate, spread)
+        action = ACTIONS[signal]
+        if quote_time is not None:
+            observe('quote_to_decision', time.time() - quote_time)
+
+        output_variables = {
+            'rate_given': f'{sell_unit}{buy_unit}',
+            'time_of_trade': current_time,
+            'trade_action': action,
+            'currency_investment': settings['currency_investment'],
+            'Forecast_Function': forecast_function.__name__,
+            **settings['param_period'],
+        }
+
+        output_variables.update({
+            'data_size': data_size,
+            'forecast_factor': settings['forecast_factor'],
+            'forecast_size': size_forecast,
+            'price_spread': spread,
+            'borrowing_fee': borrowing_fee,
+            'forecast_closing_rates': [float(rate) for rate in distr_forecast],
+            'rate_opening'.upper(): current_sell_rate,
+            'expected_closing_rate'.upper(): forecast,
+        })
+        if forecast_quantiles:
+            output_variables['forecast_quantiles'] = {str(quantile): rate for quantile, rate in forecast_quantiles.items()}
+        if horizon_forecasts:
+            output_variables['horizon_forecasts'] = horizon_forecasts
+            output_variables['horizon_actions'] = {
+                horizon: ACTIONS[trade_signal(rates[1], current_sell_rate, spread)] for horizon, rates in horizon_forecasts.items()
+            }
+
+        if signal == HOLD:
+            print('NO TRADE')
+            return output_variables
+
+        unit_a = sell_unit if signal == SELL else buy_unit
+        distr_profit_factor = profit_factor(np.asarray(distr_forecast), current_sell_rate, spread, signal, borrowing_fee)
+
+        # Further calculations
+        trade_amount_a = settings['trade_amount_a']
+        trade_amount_b = trade_amount_a * (current_sell_rate + spread)
+        investment_amount = trade_amount_a
+
+        rate_inv_unit_a = conversion_rates[unit_a]
+        rate_unit_a_sell = 1 if action == 'sell' else 1 / (current_sell_rate + spread)
+
+        if settings['amount_in_sell_units']:
+            investment_amount = trade_amount_a / (rate_inv_unit_a * rate_unit_a_sell)
+        else:
+            trade_amount_a = investment_amount * rate_inv_unit_a * rate_unit_a_sell
+            trade_amount_b = trade_amount_a * (current_sell_rate + spread)
+
+        # Loss and profit threshold
+        loss_threshold, profit_threshold = settings['loss_threshold'], settings['profit_threshold']
+        rate_loss_threshold, rate_profit_threshold = rate_thresholds(
+            current_sell_rate, spread, investment_amount,
+            loss_threshold, profit_threshold, signal, borrowing_fee
+        )
+        rate_profit_threshold = rate_profit_threshold if profit_threshold else profit_threshold
+
+        # 3. Profit Calculation
+        immediate_loss = investment_amount * (current_sell_rate / (current_sell_rate + spread) - 1)
+
+        distr_profit = investment_amount * distr_profit_factor
+
+        max_possible_loss = float(distr_profit.min())
+
+        if forecast_quantiles:
+            quantile_rates = np.array(list(forecast_quantiles.values()))
+            quantile_profits = investment_amount * profit_factor(quantile_rates, current_sell_rate, spread, signal, borrowing_fee)
+            output_variables['profit_quantiles'] = {str(quantile): float(profit) for quantile, profit in zip(forecast_quantiles, quantile_profits)}
+
+        ###____SAVED VARIABLES____###
+
+        output_variables.update({
+            'amount_in_sell_units' : settings['amount_in_sell_units'],
+            'trade_amount_a' : trade_amount_a,
+            'trade_amount_b' : trade_amount_b if action == 'buy' else None,
+            'investment_amount': investment_amount,
+            'immediate_loss': immediate_loss,
+            'distr_profit_factor': distr_profit_factor.tolist(),
+            'distr_profit': distr_profit.tolist(),
+            'expected_profit': float(distr_profit[1]),
+            'max_possible_loss': max_possible_loss,
+            'loss_threshold': loss_threshold,
+            'profit_threshold': profit_threshold,
+            f'rate_loss_threshold ({"<" if action == "sell" else ">" if action == "buy" else "Na"})': rate_loss_threshold,
+            f'rate_profit_threshold ({">" if action == "sell" else "<" if action == "buy" else "Na"})': rate_profit_threshold,
+        })
+
+        return output_variables
+
+
+def journal_path(settings: dict) -> str:
+    """Journal file of the settings, binary or JSON Lines, or None when journaling is off."""
+    if not settings['journal_file']:
+        return None
+    return settings['journal_file'] + (BINARY_EXTENSION if settings['use_binary_format'] else JSONL_EXTENSION)
+
+
+def write_pair(paths: dict, output_variables: dict, settings: dict, journal: JournalWriter = None):
+    """Write the output variables of a pair next to its history, and append its decision to the journal."""
+    if journal is not None:
+        journal.append(journal_record(output_variables))
+    if settings['write_variables']:
+        with stage('write'):
+            write_output_to_file(
+                paths['write_file'], output_variables,
+                allow_file_overwrite=settings['allow_file_overwrite'],
+                save_to_json=settings['save_to_json']
+            )
+
+
+async def fetch_pairs_async(provider, pairs: list, settings: dict) -> dict:
+    """Network stage of many pairs through a market data provider, every request running concurrently."""
+    period = settings['param_period']
+    inv = settings['currency_investment']
+    matrix = conversion_matrix(pairs, inv)
+
+    with stage('fetch', size=len(pairs)):
+        histories, quotes = await asyncio.gather(
+            provider.histories(
+                pairs, return_exceptions=True, period=period['period'], interval=period['interval'],
+                start_date=period['start_date'], end_date=period['end_date']
+            ),
+            provider.quotes(matrix.base_pairs, return_exceptions=True),
+        )
+    quote_time = time.time()
+    count('quotes', len(matrix.base_pairs))
+    matrix.update(quotes)
+    quotes = dict(zip(matrix.base_pairs, quotes))
+
+    fetched = {}
+    for pair, history in zip(pairs, histories):
+        try:
+            for result in (history, quotes[pair]):
+                if isinstance(result, Exception):
+                    raise result
+            fetched[pair] = {
+                'data': np.asarray(history['Close'], dtype=settings['dtype']),
+                'quote': quotes[pair],
+                'quote_time': quote_time,
+                'conversion_rates': conversion_rates(matrix, *pair, inv),
+            }
+        except Exception as error:
+            fetched[pair] = error
+
+    return fetched
+
+
+def fetch_pairs(pairs: list, paths: dict, settings: dict, fetch_workers: int = fetch_workers, provider=None) -> dict:
+    """
+    Network stage of many pairs, on a thread pool or through a market data provider.
+
+    Returns:
+        dict: The fetched data of every pair, or the exception that stopped its fetch.
+    """
+    if provider is not None:
+        return asyncio.run(fetch_pairs_async(provider, pairs, settings))
+
+    # One bulk quote fetch for the pairs and the conversion base pairs, the fetch threads then hit the quote cache
+    inv = settings['currency_investment']
+    matrix = conversion_matrix(pairs, inv)
+    with stage('quote', size=len(matrix.base_pairs)):
+        try:
+            matrix.refresh()
+        except Exception:
+            # A failing symbol fails the whole batch, quote the base pairs one at a time so the others still convert
+            matrix.refresh(lambda base_pairs: [quote_or_error(*pair) for pair in base_pairs])
+    count('quotes', len(matrix.base_pairs))
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+        fetches = {pair: executor.submit(fetch_pair, *pair, paths[pair], settings) for pair in pairs}
+
+    fetched = {}
+    for pair, fetch in fetches.items():
+        try:
+            fetched[pair] = fetch.result()
+            fetched[pair]['conversion_rates'] = conversion_rates(matrix, *pair, inv)
+        except Exception as error:
+            fetched[pair] = error
+
+    return fetched
+
+
+def use_distribution_cache(settings: dict):
+    """Cache distributions in the directory of the settings, unless this process caches them already."""
+    if settings.get('distribution_cache') and DistributionCache.CACHE is None:
+        DistributionCache.enable(directory=settings['distribution_cache'])
+
+
+def evaluate_in_worker(args: tuple, instrument: bool):
+    """Evaluate a pair in a worker process, returning its output and the metrics recorded on the way."""
+    use_distribution_cache(args[5])
+    if instrument:
+        # Workers may have inherited the metrics of the parent, only this evaluation is sent back
+        Instrumentation.reset()
+        Instrumentation.enable()
+    output_variables = evaluate_pair(*args)
+    return output_variables, Instrumentation.snapshot() if instrument else None
+
+
+def run_pairs(pairs: list, root: str = '', settings: dict = None, fetch_workers: int = fetch_workers,
+              evaluate_workers: int = evaluate_workers, summary_file: str = summary_file, provider=None) -> dict:
+    """
+    Evaluate many pairs: fetch on a thread pool, forecast and trade math on a process pool,
+    then write every pair output, append every decision to the journal (see `journal_path`)
+    and write one summary. A failing pair is reported in the summary
+    without stopping the others.
+
+    Args:
+        pairs (list of tuple): (sell_unit, buy_unit) of every pair.
+        root (str, optional): Directory holding the `Trade_of_X_Y` folders. Defaults to the working directory.
+        settings (dict, optional): Trade settings. Defaults to `default_settings()`.
+        fetch_workers (int, optional): Number of threads fetching histories and quotes.
+        evaluate_workers (int, optional): Number of processes evaluating pairs. 1 evaluates in this process.
+        summary_file (str, optional): File of the run summary, None to skip it.
+        provider (MarketDataProvider, optional): Provider of histories and quotes (see `Modules.Providers`). 
+            Defaults to None, fetching from Yahoo Finance and updating the stored histories.
+
+    Returns:
+        dict: The output variables of every pair, or its error, keyed by pair name.
+    """
+    settings = default_settings() if settings is None else settings
+    use_distribution_cache(settings)
+    paths = {pair: trade_paths(*pair, root) for pair in pairs}
+    results = {f'{sell}{buy}': None for sell, buy in pairs}
+
+    fetches = fetch_pairs(pairs, paths, settings, fetch_workers, provider)
+
+    journal = JournalWriter(journal_path(settings)) if journal_path(settings) else None
+
+    evaluated = {}
+    executor = ProcessPoolExecutor(max_workers=evaluate_workers) if evaluate_workers != 1 else None
+    for pair, fetched in fetches.items():
+        if isinstance(fetched, Exception):
+            results[''.join(pair)] = {'error': repr(fetched)}
+            continue
+        args = (*pair, fetched['data'], fetched['quote'], fetched['conversion_rates'], settings, fetched['quote_time'])
+        evaluated[pair] = executor.submit(evaluate_in_worker, args, Instrumentation.ENABLED) if executor else args
+
+    for pair, evaluation in evaluated.items():
+        try:
+            if executor:
+                output_variables, metrics = evaluation.result()
+                if metrics:
+                    Instrumentation.merge(metrics)
+            else:
+                output_variables = evaluate_pair(*evaluation)
+            write_pair(paths[pair], output_variables, settings, journal)
+            results[''.join(pair)] = output_variables
+        except Exception as error:
+            results[''.join(pair)] = {'error': repr(error)}
+
+    if executor:
+        executor.shutdown()
+    if journal is not None:
+        journal.close()
+
+    count('pairs', len(pairs))
+    count('pair_errors', sum('error' in result for result in results.values()))
+
+    if summary_file:
+        summary = {
+            name: {
+                key: output.get(key) for key in (
+                    'error', 'trade_action', 'RATE_OPENING', 'EXPECTED_CLOSING_RATE', 'expected_profit', 'horizon_actions'
+                )
+                if key in output
+            }
+            for name, output in results.items()
+        }
+        write_output_to_file(summary_file, summary, allow_file_overwrite=True)
+
+    return results
+
+
+def write_portfolio(results: dict, root: str, settings: dict, file_path: str) -> dict:
+    """
+    Joint profit distribution of the trades decided by a run, over the stored histories of the pairs
+    under `root` (see `Modules.Portfolio`), written to a file.
+
+    Args:
+        results (dict): Output variables of every pair, as returned by `run_pairs`.
+        root (str): Directory holding the `Trade_of_X_Y` folders.
+        settings (dict): Trade settings of the run.
+        file_path (str): File the portfolio is written to.
+
+    Returns:
+        dict: The portfolio evaluation, or None when no trade was decided.
+    """
+    book = positions_from_outputs(results)
+    if not len(book):
+        return None
+
+    with stage('portfolio', size=len(book)):
+        matrix = PriceMatrix.from_directory(root, settings['param_period']['interval'])
+        portfolio = evaluate_portfolio(book, matrix)
+    write_output_to_file(file_path, portfolio, allow_file_overwrite=True)
+    return portfolio
+
+
+def run_daemon(pairs: list, settings: dict = None, provider=None, ticks: int = None, poll_seconds: float = poll_seconds,
+               tick_budget: float = tick_budget, replay: bool = False) -> int:
+    """
+    Decide every pair on each tick of a `TickDaemon`, appending the decisions to the journal.
+
+    The histories are loaded once and kept in online distributions, so the forecasts are those of
+    forecastData over a trailing window as long as the loaded history.
+
+    Args:
+        pairs (list of tuple): (sell_unit, buy_unit) of every pair.
+        settings (dict, optional): Trade settings. Defaults to `default_settings()`.
+        provider (MarketDataProvider, optional): Provider of histories and quotes. Defaults to a `YahooProvider`.
+        ticks (int, optional): Number of ticks to run. Defaults to None, running until interrupted or a replay ends.
+        poll_seconds (float, optional): Seconds between the starts of two ticks.
+        tick_budget (float, optional): Longest wait for the provider on a tick, in seconds.
+        replay (bool, optional): If True, the provider is a `ReplayProvider` advanced by one bar on every tick.
+
+    Returns:
+        int: Number of ticks run.
+    """
+    settings = default_settings() if settings is None else settings
+    provider = YahooProvider() if provider is None else provider
+    period, inv = settings['param_period'], settings['currency_investment']
+    matrix = conversion_matrix(pairs, inv)
+
+    def decide(sell_unit, buy_unit, forecast, data_size, size_forecast, quote, quote_time):
+        rates = conversion_rates(matrix, sell_unit, buy_unit, inv)
+        return decide_pair(sell_unit, buy_unit, forecast, data_size, size_forecast, quote, rates, settings, quote_time)
+
+    daemon = TickDaemon(
+        provider, pairs, matrix, decide, forecast_factor=settings['forecast_factor'], period=period['period'],
+        interval=period['interval'], poll_seconds=poll_seconds, tick_budget=tick_budget, replay=replay
+    )
+    journal = JournalWriter(journal_path(settings)) if journal_path(settings) else None
+
+    def on_decisions(decisions):
+        count('pair_errors', sum('error' in decision for decision in decisions.values()))
+        if journal is not None:
+            for decision in decisions.values():
+                if 'error' not in decision:
+                    journal.append(journal_record(decision))
+            journal.flush()
+
+    async def run():
+        errors = await daemon.load()
+        for pair, error in errors.items():
+            print(f'{"".join(pair)}: {error!r}')
+        return await daemon.run(ticks, on_decisions)
+
+    try:
+        return asyncio.run(run())
+    except KeyboardInterrupt:
+        return daemon.ticks
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Forecast and decide trades for forex pairs.')
+    parser.add_argument('pairs', nargs='*', help=f'Pairs as SELL_BUY (e.g. EUR_GBP). Defaults to {sell_unit}_{buy_unit}')
+    parser.add_argument('--dir', help='Evaluate every Trade_of_X_Y folder in this directory (e.g. Trade_1_day)')
+    parser.add_argument('--period', default=param_period['period'])
+    parser.add_argument('--interval', default=param_period['interval'])
+    parser.add_argument('--forecast-factor', type=float, default=forecast_factor)
+    parser.add_argument('--base-interval', default=base_interval, help='Fetch only this interval and resample the interval from it, e.g. 1m')
+    parser.add_argument('--horizons', nargs='+', default=forecast_horizons, help='Horizons also forecast, e.g. 1h 4h 1d')
+    parser.add_argument('--forecast-function', choices=FORECAST_FUNCTIONS, default=FORECAST_FUNCTION.__name__)
+    parser.add_argument('--paths', type=int, default=monte_carlo['num_paths'], help='Paths of forecastMonteCarlo')
+    parser.add_argument('--seed', type=int, default=monte_carlo['seed'], help='Seed of forecastMonteCarlo')
+    parser.add_argument('--first-passage', action='store_true', help='Estimate from the history how often and how soon the thresholds are reached')
+    parser.add_argument('--float32', action='store_true', help='Keep the histories in float32, halving their memory')
+    parser.add_argument('--currency-investment', default=currency_investment)
+    parser.add_argument('--loss-threshold', type=float, default=loss_threshold)
+    parser.add_argument('--profit-threshold', type=float, default=profit_threshold)
+    parser.add_argument('--stored-history', action='store_true', help='Load histories from the store instead of fetching them')
+    parser.add_argument(
+        '--offline', '--replay', dest='replay', action='store_true',
+        help='Forecast from the stored histories, quoting the close of their last bar: no network, yfinance or pandas'
+    )
+    parser.add_argument('--replay-spread', type=float, default=0.0, help='Spread of the replayed quotes')
+    parser.add_argument('--fetch-workers', type=int, default=fetch_workers)
+    parser.add_argument('--workers', type=int, default=evaluate_workers, help='Evaluation processes, 1 to evaluate in this process')
+    parser.add_argument('--summary', default=summary_file)
+    parser.add_argument('--portfolio', help='Write the joint profit distribution of the decided trades to this file')
+    parser.add_argument('--journal', default=journal_file, help='Journal file, without extension, every decision is appended to. "none" to skip it')
+    parser.add_argument('--binary-journal', action='store_true', help='Write the journal as binary records instead of JSON Lines')
+    parser.add_argument('--cache-dir', default=distribution_cache, help='Directory caching distributions across runs, e.g. .cache/distributions')
+    parser.add_argument('--daemon', action='store_true', help='Keep the histories loaded and decide every pair on each tick (forecastData only)')
+    parser.add_argument('--ticks', type=int, help='Ticks of the daemon. Defaults to running until interrupted, or until the replay ends')
+    parser.add_argument('--poll-seconds', type=float, default=poll_seconds, help='Seconds between daemon ticks')
+    parser.add_argument('--tick-budget', type=float, default=tick_budget, help='Longest wait for quotes on a daemon tick, in seconds')
+    parser.add_argument('--replay-from', help='Replay time the daemon starts from, e.g. 2024-10-01T08:00 (with --offline)')
+    parser.add_argument('--metrics', help='Record stage timings and write them to this file (.prom for Prometheus text, JSON otherwise)')
+    args = parser.parse_args(argv)
+
+    root = args.dir or ''
+    pairs = [tuple(pair.split('_')) for pair in args.pairs] or (discover_pairs(root) if args.dir else [(sell_unit, buy_unit)])
+
+    settings = default_settings()
+    settings['param_period'].update(period=args.period, interval=args.interval)
+    settings['monte_carlo'].update(num_paths=args.paths, seed=args.seed)
+    settings.update(
+        forecast_factor=args.forecast_factor,
+        forecast_function=FORECAST_FUNCTIONS[args.forecast_function],
+        base_interval=args.base_interval,
+        forecast_horizons=args.horizons,
+        first_passage=args.first_passage or first_passage,
+        dtype=np.float32 if args.float32 else DTYPE,
+        currency_investment=args.currency_investment,
+        loss_threshold=args.loss_threshold,
+        profit_threshold=args.profit_threshold,
+        fetch_external_data=settings['fetch_external_data'] and not args.stored_history,
+        journal_file=None if args.journal.lower() == 'none' else args.journal,
+        use_binary_format=args.binary_journal or use_binary_format,
+        distribution_cache=args.cache_dir,
+    )
+
+    provider = ReplayProvider.from_directory(root, args.interval, spread=args.replay_spread, now=args.replay_from) if args.replay else None
+
+    if args.metrics:
+        Instrumentation.enable()
+
+    if args.daemon:
+        settings['forecast_function'] = forecastData
+        run_daemon(
+            pairs, settings, provider, ticks=args.ticks, poll_seconds=args.poll_seconds,
+            tick_budget=args.tick_budget, replay=args.replay
+        )
+        if args.metrics:
+            Instrumentation.export(args.metrics)
+        return 0
+
+    with stage('run', size=len(pairs)):
+        results = run_pairs(
+            pairs, root, settings, fetch_workers=args.fetch_workers,
+            evaluate_workers=args.workers, summary_file=args.summary, provider=provider
+        )
+        if args.portfolio:
+            write_portfolio(results, root, settings, args.portfolio)
+
+    if args.metrics:
+        Instrumentation.export(args.metrics)
+    return 0 if all(result and 'error' not in result for result in results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
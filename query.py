@@ -0,0 +1,198 @@
+import sys
+import argparse
+import unittest
+import numpy as np
+from Modules.Journal import ACTION_CODES, read_journal, json_record, to_records
+from Modules.Trade import ACTIONS
+
+# Toggle to enable unit test execution
+RUN_UNIT_TESTING = False
+
+"""
+JOURNAL QUERIES
+---------------
+Select the decisions of a run journal (see `Modules.Journal`) by pair, time range, action and
+expected profit:
+
+    python query.py trade_journal.bin --pair EURGBP --start 2024-10-01 --action buy --min-profit 10
+
+The journal is indexed once when it is opened: the records are ordered by time, and the positions
+of every pair are kept in that order. A query then finds its time range by binary search within
+the records of its pair, and only filters that range by action and profit.
+"""
+
+
+class JournalQuery:
+    """
+    Indexed queries over a run journal.
+    """
+
+    def __init__(self, path_or_records):
+        """
+        :param path_or_records: Journal file, or records as returned by `read_journal`.
+        """
+        self.records = read_journal(path_or_records) if isinstance(path_or_records, str) else path_or_records
+
+        # Positions of the records ordered by time, appended journals are mostly ordered already
+        self.order = np.argsort(self.records['time'], kind='stable')
+        self.times = self.records['time'][self.order]
+
+        # Positions of the records of every pair, in time order
+        pairs, codes = np.unique(self.records['pair'][self.order], return_inverse=True)
+        grouped = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[grouped], np.arange(len(pairs) + 1))
+        self.pair_order = {
+            pair.decode(): self.order[grouped[start:end]]
+            for pair, start, end in zip(pairs, bounds[:-1], bounds[1:])
+        }
+        self.pair_times = {pair: self.records['time'][positions] for pair, positions in self.pair_order.items()}
+
+    @property
+    def pairs(self) -> list:
+        """Pairs in the journal."""
+        return sorted(self.pair_order)
+
+    def select(self, pair: str = None, start=None, end=None, action: str = None, min_profit: float = None,
+               max_profit: float = None, limit: int = None, latest: bool = False) -> np.ndarray:
+        """
+        Records matching every given condition, in time order.
+
+        :param pair: Pair name (e.g. 'EURGBP').
+        :param start: Earliest decision time, inclusive (e.g. '2024-10-01' or a datetime64).
+        :param end: Latest decision time, exclusive.
+        :param action: 'sell', 'hold' or 'buy'.
+        :param min_profit: Lowest expected profit, inclusive. Holds have no expected profit and never match.
+        :param max_profit: Highest expected profit, inclusive.
+        :param limit: Maximum number of records returned.
+        :param latest: If True, the limit keeps the latest records instead of the earliest.
+        :return: Structured array of the matching records.
+        """
+        if pair is None:
+            positions, times = self.order, self.times
+        else:
+            positions = self.pair_order.get(pair, np.zeros(0, dtype=np.int64))
+            times = self.pair_times.get(pair, np.zeros(0, dtype='datetime64[ns]'))
+
+        # Time range by binary search over the time ordered positions
+        first = 0 if start is None else np.searchsorted(times, np.datetime64(start, 'ns'), side='left')
+        last = len(times) if end is None else np.searchsorted(times, np.datetime64(end, 'ns'), side='left')
+        positions = positions[first:last]
+
+        if action is not None or min_profit is not None or max_profit is not None:
+            keep = np.ones(len(positions), dtype=bool)
+            if action is not None:
+                keep &= self.records['action'][positions] == ACTION_CODES[action]
+            if min_profit is not None or max_profit is not None:
+                profit = self.records['expected_profit'][positions]
+                keep &= profit >= (-np.inf if min_profit is None else min_profit)
+                keep &= profit <= (np.inf if max_profit is None else max_profit)
+            positions = positions[keep]
+
+        if limit is not None:
+            positions = positions[-limit:] if latest else positions[:limit]
+
+        return np.asarray(self.records[positions])
+
+    def summary(self, records: np.ndarray = None) -> dict:
+        """
+        Decision counts and expected profit per pair.
+
+        :param records: Records to summarise. Defaults to the whole journal.
+        :return: Dict of pair name to counts per action and total and mean expected profit.
+        """
+        records = self.records if records is None else records
+        summary = {}
+        for pair in np.unique(records['pair']):
+            selected = records[records['pair'] == pair]
+            profit = selected['expected_profit'][~np.isnan(selected['expected_profit'])]
+            summary[pair.decode()] = {
+                **{action: int(np.count_nonzero(selected['action'] == code)) for action, code in ACTION_CODES.items()},
+                'total_expected_profit': float(profit.sum()),
+                'mean_expected_profit': float(profit.mean()) if len(profit) else None,
+            }
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query a run journal.')
+    parser.add_argument('journal', help='Journal file (.jsonl or .bin)')
+    parser.add_argument('--pair', help='Pair name, e.g. EURGBP')
+    parser.add_argument('--start', help='Earliest decision time, e.g. 2024-10-01 or 2024-10-01T08:00')
+    parser.add_argument('--end', help='Latest decision time, exclusive')
+    parser.add_argument('--action', choices=list(ACTION_CODES))
+    parser.add_argument('--min-profit', type=float)
+    parser.add_argument('--max-profit', type=float)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--latest', action='store_true', help='Show the latest records within the limit')
+    parser.add_argument('--summary', action='store_true', help='Show counts and profit per pair instead of records')
+    parser.add_argument('--jsonl', action='store_true', help='Print records as JSON Lines')
+    args = parser.parse_args(argv)
+
+    query = JournalQuery(args.journal)
+    records = query.select(
+        args.pair, args.start, args.end, args.action, args.min_profit, args.max_profit,
+        limit=None if args.summary else args.limit, latest=args.latest
+    )
+
+    if args.summary:
+        for pair, values in query.summary(records).items():
+            print(pair, ' '.join(f'{key}={value}' for key, value in values.items()))
+    elif args.jsonl:
+        for record in records:
+            print(json_record(record))
+    else:
+        columns = ['time', 'pair', 'action', 'rate_opening', 'forecast', 'expected_profit']
+        print(f'{"time":<32}{"pair":<8}{"action":<8}{"rate_opening":>16}{"forecast":>16}{"expected_profit":>18}')
+        for record in records:
+            time, pair, action, rate_opening, forecast, profit = (record[column] for column in columns)
+            print(f'{str(time):<32}{pair.decode():<8}{ACTIONS[int(action)]:<8}{rate_opening:>16.6f}{forecast:>16.6f}{profit:>18.4f}')
+
+    return 0
+
+
+#___Unit Testing____#
+class TestJournalQuery(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a journal of random decisions, out of time order."""
+        rng = np.random.default_rng(4)
+        size = 5000
+        self.records = to_records([
+            {
+                'time': np.datetime64('2024-10-01T00:00', 'ns') + np.timedelta64(int(minute), 'm'),
+                'pair': pair, 'action': action, 'data_size': 5000, 'forecast_size': 1666,
+                'expected_profit': None if action == ACTION_CODES['hold'] else float(profit),
+            }
+            for minute, pair, action, profit in zip(
+                rng.permutation(size), rng.choice(['EURGBP', 'USDZAR', 'EURAUD'], size),
+                rng.choice(list(ACTIONS), size), rng.normal(0, 50, size)
+            )
+        ])
+        self.query = JournalQuery(self.records)
+
+    def test_select(self):
+        """Test that every filter combination matches a scan of the records."""
+        records = self.records
+        start, end = np.datetime64('2024-10-02T00:00', 'ns'), np.datetime64('2024-10-03T06:00', 'ns')
+
+        for pair in (None, 'EURGBP', 'GBPUSD'):
+            for action in (None, 'buy', 'hold'):
+                expected = (records['time'] >= start) & (records['time'] < end)
+                expected &= True if pair is None else records['pair'] == pair.encode()
+                expected &= True if action is None else records['action'] == ACTION_CODES[action]
+                expected &= np.nan_to_num(records['expected_profit'], nan=-np.inf) >= 10
+
+                selected = self.query.select(pair, start, end, action, min_profit=10)
+                self.assertEqual(len(selected), np.count_nonzero(expected))
+                self.assertTrue(np.all(np.diff(selected['time']) > np.timedelta64(0)))
+
+        latest = self.query.select('USDZAR', limit=5, latest=True)
+        self.assertEqual(latest['time'][-1], records['time'][records['pair'] == b'USDZAR'].max())
+
+
+if __name__ == '__main__':
+
+    if RUN_UNIT_TESTING:
+        unittest.main()
+
+    sys.exit(main())